@@ -28,4 +28,27 @@ app.conf.beat_schedule = {
         'task': 'navigation.tasks.clean_expired_queues',
         'schedule': crontab(hour='0', minute='0'),  # 每天零点执行
     },
+    'refresh-prophet-forecasts': {
+        'task': 'navigation.ml.tasks.refresh_prophet_forecasts',
+        'schedule': crontab(hour='1', minute='0'),  # 每天凌晨1点刷新预测表
+    },
+    'collect-training-data-incremental': {
+        'task': 'navigation.ml.tasks.collect_training_data_incremental',
+        'schedule': crontab(minute='15'),  # 每小时追加新完成的队列
+    },
+    'train-wait-time-models-incremental': {
+        'task': 'navigation.ml.tasks.train_wait_time_models',
+        'schedule': crontab(minute='30'),  # 每小时增量训练，跳过数据分布未变化的科室
+        'kwargs': {'incremental': True},
+    },
+    'train-wait-time-models-tuned': {
+        'task': 'navigation.ml.tasks.train_wait_time_models',
+        'schedule': crontab(hour='2', minute='0', day_of_week='1'),  # 每周一凌晨2点完整训练，调优参数过期的科室重新搜索超参数
+        'kwargs': {'tune': True},
+    },
+    'train-prophet-models-incremental': {
+        'task': 'train-prophet-models',
+        'schedule': crontab(minute='45'),
+        'kwargs': {'incremental': True},
+    },
 } 
\ No newline at end of file
@@ -213,3 +213,33 @@ ALLOWED_WEBSOCKET_ORIGINS = [
     'http://localhost:8000',
     'http://127.0.0.1:8000',
 ]
+
+# 机器学习配置
+PROPHET_MODEL_CACHE_SIZE = 64  # 进程内缓存的Prophet模型数量上限
+PROPHET_FORECAST_DAYS = 7  # Prophet逐小时预测表覆盖的天数
+ML_TRAINING_WORKERS = None  # 并行训练模型的进程数，None表示使用CPU核数
+ML_INCREMENTAL_MIN_ROWS = 20  # 增量训练至少需要的新数据条数
+ML_INCREMENTAL_BOOST_ROUNDS = 20  # XGBoost增量训练追加的提升轮数
+ML_SHIFT_PSI_THRESHOLD = 0.1  # 数据分布变化检测的PSI阈值
+ML_SHIFT_PSI_MIN_ROWS = 50  # 新数据不少于该条数时使用PSI，否则检验均值偏移
+ML_SHIFT_Z_THRESHOLD = 3.0  # 均值偏移检验的阈值
+ML_TUNING_SEARCH = 'halving'  # 超参数搜索方式: halving（逐次减半）、random（随机）或 grid（完整网格）
+ML_TUNING_BUDGET = 60  # 超参数搜索的计算预算（完整训练次数上限）
+ML_TUNING_CV = 3  # 超参数搜索的交叉验证折数
+ML_TUNING_ESTIMATOR_THREADS = 1  # 调优时每个模型使用的线程数，搜索并行数 = 核数 / 该值
+ML_TUNING_CACHE_DAYS = 7  # 科室调优参数的缓存天数
+ML_MODEL_REGISTRY_CHECK_INTERVAL = 5  # 各进程检查模型注册表新版本的间隔（秒）
+ML_MODEL_REGISTRY_KEEP = 5  # 每个模型保留的历史版本数，用于回滚
+ML_PROPHET_LIVE_FALLBACK = True  # 预计算的Prophet预测表不可用时，是否在Web进程中导入Prophet实时预测
+ML_INFERENCE_SERVER = None  # 预测服务进程地址，如 'unix:/run/hospital_queue/inference.sock' 或 '127.0.0.1:8765'；None表示各进程自行加载模型
+ML_INFERENCE_TIMEOUT = 2.0  # 请求预测服务的超时时间（秒）
+ML_INFERENCE_RETRY_INTERVAL = 10  # 预测服务不可用时，改为本进程预测的时长（秒）
+ML_INFERENCE_BATCH_WINDOW = 0.005  # 预测服务合并并发请求的等待时间（秒）
+ML_INFERENCE_MAX_BATCH = 512  # 预测服务每批最多合并的行数
+
+# 队列看板广播配置
+QUEUE_UPDATE_BROADCAST_WINDOW = 0.25  # 合并变更的时间窗口（秒），0表示每次变更立即广播
+QUEUE_SNAPSHOT_TTL = 300  # 看板快照在缓存中的保留时间（秒）
+DASHBOARD_STATS_CACHE_TTL = 5  # 看板统计缓存时间（秒），队列变更时立即失效
+QUEUE_HISTORY_EXPORT_CHUNK_SIZE = 2000  # 历史记录流式导出时每次从数据库读取的行数
+QUEUE_BULK_ADMISSION_MAX_ITEMS = 1000  # 批量入队接口单次请求的最大条目数
@@ -10,6 +10,7 @@ from .models import (
     Patient, Department, Equipment, Examination, Queue, QueueHistory,
     NotificationTemplate, NotificationCategory, NotificationStats
 )
+from .utils.broadcast import suppress_queue_updates
 
 # 基础管理类
 class BaseModelAdmin(admin.ModelAdmin):
@@ -127,36 +128,39 @@ class QueueAdmin(BaseModelAdmin):
     def mark_as_in_progress(self, request, queryset):
         from django.utils import timezone
         updated = 0
-        for queue in queryset:
-            if queue.status != 'processing':
-                queue.status = 'processing'
-                if not queue.start_time:
-                    queue.start_time = timezone.now()
-                queue.save()
-                updated += 1
+        with suppress_queue_updates():
+            for queue in queryset:
+                if queue.status != 'processing':
+                    queue.status = 'processing'
+                    if not queue.start_time:
+                        queue.start_time = timezone.now()
+                    queue.save()
+                    updated += 1
         self.message_user(request, f"成功将{updated}条记录标记为处理中")
     mark_as_in_progress.short_description = "标记为处理中"
     
     def mark_as_completed(self, request, queryset):
         from django.utils import timezone
         updated = 0
-        for queue in queryset:
-            if queue.status != 'completed':
-                queue.status = 'completed'
-                if not queue.end_time:
-                    queue.end_time = timezone.now()
-                queue.save()
-                updated += 1
+        with suppress_queue_updates():
+            for queue in queryset:
+                if queue.status != 'completed':
+                    queue.status = 'completed'
+                    if not queue.end_time:
+                        queue.end_time = timezone.now()
+                    queue.save()
+                    updated += 1
         self.message_user(request, f"成功将{updated}条记录标记为已完成")
     mark_as_completed.short_description = "标记为已完成"
     
     def mark_as_cancelled(self, request, queryset):
         updated = 0
-        for queue in queryset:
-            if queue.status != 'cancelled':
-                queue.status = 'cancelled'
-                queue.save()
-                updated += 1
+        with suppress_queue_updates():
+            for queue in queryset:
+                if queue.status != 'cancelled':
+                    queue.status = 'cancelled'
+                    queue.save()
+                    updated += 1
         self.message_user(request, f"成功将{updated}条记录标记为已取消")
     mark_as_cancelled.short_description = "标记为已取消"
     
@@ -178,10 +182,11 @@ class QueueAdmin(BaseModelAdmin):
     def update_wait_time_with_standard(self, request, queryset):
         """使用标准算法更新所选队列的预计等待时间"""
         updated = 0
-        for queue in queryset:
-            if hasattr(queue, 'recalculate_wait_time'):
-                queue.recalculate_wait_time()
-                updated += 1
+        with suppress_queue_updates():
+            for queue in queryset:
+                if hasattr(queue, 'recalculate_wait_time'):
+                    queue.recalculate_wait_time()
+                    updated += 1
         
         self.message_user(
             request, 
@@ -193,13 +198,14 @@ class QueueAdmin(BaseModelAdmin):
     def mark_as_in_service(self, request, queryset):
         from django.utils import timezone
         updated = 0
-        for queue in queryset:
-            if queue.status != 'in_service':
-                queue.status = 'in_service'
-                if not queue.start_time:
-                    queue.start_time = timezone.now()
-                queue.save()
-                updated += 1
+        with suppress_queue_updates():
+            for queue in queryset:
+                if queue.status != 'in_service':
+                    queue.status = 'in_service'
+                    if not queue.start_time:
+                        queue.start_time = timezone.now()
+                    queue.save()
+                    updated += 1
         self.message_user(request, f"成功将{updated}条记录标记为服务中")
     mark_as_in_service.short_description = "标记为服务中"
 
@@ -14,9 +14,7 @@ from django.conf import settings
 from celery.result import AsyncResult
 from django.views.decorators.csrf import csrf_exempt
 from .models import Department, Queue
-from .ml.models import prediction_service
-from .ml.data_collector import data_collector
-from .ml.tasks import train_wait_time_models, update_predicted_wait_times
+from .ml.serialization import model_department_id
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +40,11 @@ class MLDashboardView(TemplateView):
         context['available_apps'] = []
         context['app_list'] = []
         
+        # 机器学习模块在打开页面时才导入，避免Web进程启动时加载pandas等库
+        from .ml.inference import get_prediction_service
+        from .ml.data_collector import data_collector
+        prediction_service = get_prediction_service()
+        
         # 模型状态
         is_model_ready = prediction_service.is_ready()
         model_status = "就绪" if is_model_ready else "未就绪"
@@ -51,14 +54,13 @@ class MLDashboardView(TemplateView):
         departments_with_models = Department.objects.filter(id__in=available_departments)
         
         # 训练数据
-        training_data = data_collector.get_training_data()
-        training_data_count = len(training_data) if training_data is not None else 0
+        training_data_count = data_collector.get_training_data_count()
         
         # 上次训练时间
         model_dir = os.path.join(settings.BASE_DIR, 'navigation', 'ml', 'trained_models')
         last_trained = None
         if os.path.exists(model_dir):
-            model_files = [os.path.join(model_dir, f) for f in os.listdir(model_dir) if f.endswith('.pkl')]
+            model_files = [os.path.join(model_dir, f) for f in os.listdir(model_dir) if model_department_id(f) is not None]
             if model_files:
                 last_trained = datetime.fromtimestamp(max(os.path.getmtime(f) for f in model_files))
         
@@ -165,6 +167,7 @@ def ml_collect_data(request):
             request.is_ajax = lambda: True
             
             # 收集训练数据
+            from .ml.data_collector import data_collector
             logger.info(f"开始收集{days}天的历史数据")
             training_data = data_collector.collect_historical_data(days=days)
             
@@ -212,6 +215,7 @@ def ml_train_model(request):
     
     try:
         # 尝试使用Celery任务来训练模型
+        from .ml.tasks import train_wait_time_models
         task = train_wait_time_models.delay(algorithm=algorithm)
         task_id = task.id
         logger.info(f"已提交模型训练任务，任务ID: {task_id}，算法: {algorithm}")
@@ -311,7 +315,7 @@ def ml_check_status(request):
             is_completed = False
             model_dir = os.path.join(settings.BASE_DIR, 'navigation', 'ml', 'trained_models')
             if os.path.exists(model_dir):
-                model_files = [os.path.join(model_dir, f) for f in os.listdir(model_dir) if f.endswith('.pkl')]
+                model_files = [os.path.join(model_dir, f) for f in os.listdir(model_dir) if model_department_id(f) is not None]
                 # 如果最近5分钟内有模型文件更新，认为任务已完成
                 if model_files and any(os.path.getmtime(f) > (timezone.now().timestamp() - 300) for f in model_files):
                     is_completed = True
@@ -404,6 +408,7 @@ def ml_update_wait_times(request):
     if request.method == 'POST':
         try:
             # 启动Celery任务进行等待时间更新
+            from .ml.tasks import update_predicted_wait_times
             task = update_predicted_wait_times.delay()
             
             logger.info(f"启动更新队列等待时间任务: {task.id}")
@@ -38,9 +38,11 @@ class TrainWaitTimeModels(APIView):
             
             # 获取请求中的算法参数
             algorithm = request.data.get('algorithm', 'xgboost')
+            # 是否在训练前为调优参数过期的科室搜索超参数
+            tune = str(request.data.get('tune', '')).lower() in ('1', 'true', 'yes')
             
             # 异步启动训练任务
-            task = train_wait_time_models.delay(algorithm=algorithm)
+            task = train_wait_time_models.delay(algorithm=algorithm, tune=tune)
             
             return Response({
                 'status': 'success',
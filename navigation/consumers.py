@@ -5,6 +5,8 @@ from django.core.cache import cache
 from django.utils import timezone
 from .models import Patient, Department, Queue
 from .utils.notifications import get_notifications
+from .utils.broadcast import get_group_name
+from .utils.snapshot import snapshot_store
 
 
 class NotificationConsumer(AsyncJsonWebsocketConsumer):
@@ -228,60 +230,70 @@ class QueueStatusConsumer(AsyncJsonWebsocketConsumer):
 
 
 class QueueConsumer(AsyncWebsocketConsumer):
-    """队列实时更新消费者"""
+    """
+    队列实时更新消费者
+
+    ws/queue_updates/ 订阅全院看板，ws/queue_updates/<科室代码>/ 只订阅该科室的数据
+    """
 
     async def connect(self):
-        """建立连接"""
+        """建立连接并加入队列更新组"""
+        # 当前连接已发送的快照版本
+        self.snapshot_version = 0
+        # 推送模式: full 每次发送完整快照，delta 只发送与上一版本的差异
+        self.mode = 'full'
+        self.department_id = None
+        self.group_name = None
         try:
-            print("WebSocket 连接尝试...")
-            
-            # 最简单的连接方式 - 直接接受连接，不使用channel_layer
+            department_code = self.scope['url_route']['kwargs'].get('department_code')
+            if department_code:
+                self.department_id = await self.get_department_id(department_code)
+                if self.department_id is None:
+                    await self.close(code=4404)
+                    return
+
+            self.group_name = get_group_name(self.department_id)
+            await self.channel_layer.group_add(self.group_name, self.channel_name)
             await self.accept()
-            print("WebSocket 连接已接受")
 
             # 发送连接成功消息
             await self.send(text_data=json.dumps({
                 'type': 'connection_established',
                 'message': '连接成功'
             }))
-            
-            # 发送一个简单的测试消息避免数据库错误
-            await self.send(text_data=json.dumps({
-                'type': 'test_message',
-                'message': '这是一个测试消息',
-                'timestamp': timezone.now().isoformat()
-            }))
         except Exception as e:
             print(f"WebSocket 连接错误: {str(e)}")
-            print(f"错误类型: {type(e).__name__}")
-            if hasattr(e, '__dict__'):
-                print(f"错误详情: {e.__dict__}")
             await self.close(code=1011)
 
     async def disconnect(self, close_code):
-        """断开连接"""
+        """断开连接并离开队列更新组"""
+        if not self.group_name:
+            return
         try:
-            print(f"WebSocket 断开连接，代码: {close_code}")
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
         except Exception as e:
             print(f"断开连接时出错: {str(e)}")
-            print(f"错误类型: {type(e).__name__}")
 
     async def receive(self, text_data):
         """处理接收到的消息"""
         try:
-            print(f"收到消息: {text_data}")
             data = json.loads(text_data)
             command = data.get('command')
 
-            # 简化的处理逻辑
-            await self.send(text_data=json.dumps({
-                'type': 'echo',
-                'received': data,
-                'timestamp': timezone.now().isoformat()
-            }))
-            
+            if command in ('get_initial_data', 'subscribe'):
+                if data.get('mode') in ('full', 'delta'):
+                    self.mode = data['mode']
+                await self.send_initial_data(data.get('version'))
+            elif command == 'resync':
+                version, payload = await self.get_latest_snapshot()
+                await self.send_snapshot(version, payload, force=True)
+            elif command == 'heartbeat':
+                await self.send(text_data=json.dumps({
+                    'type': 'heartbeat_response',
+                    'timestamp': timezone.now().isoformat()
+                }))
+
         except json.JSONDecodeError as e:
-            print(f"JSON 解析错误: {str(e)}")
             await self.send(text_data=json.dumps({
                 'type': 'error',
                 'message': '无效的消息格式'
@@ -294,23 +306,23 @@ class QueueConsumer(AsyncWebsocketConsumer):
             }))
 
     async def queue_update(self, event):
-        """处理并广播队列更新事件"""
+        """按版本号转发共享快照，已持有该版本时跳过"""
         try:
-            print("处理队列更新事件...")
-            # 获取最新数据
-            stats = await self.get_stats()
-            departments = await self.get_departments()
-            queues = await self.get_queues()
+            version = event.get('version')
+            if version is not None and version <= self.snapshot_version:
+                return
 
-            # 发送更新
-            await self.send(text_data=json.dumps({
-                'type': 'queue_update',
-                'stats': stats,
-                'departments': departments,
-                'queues': queues,
-                'timestamp': timezone.now().isoformat()
-            }))
-            print("队列更新数据已发送")
+            payload = None
+            if version is not None:
+                if self.mode == 'delta' and self.snapshot_version:
+                    payload = await self.get_delta(self.snapshot_version, version)
+                else:
+                    payload = await self.get_snapshot(version)
+            if payload is None:
+                # 快照已过期或消息未携带版本号，改为发送最新版本
+                version, payload = await self.get_latest_snapshot()
+
+            await self.send_snapshot(version, payload)
         except Exception as e:
             print(f"更新数据时出错: {str(e)}")
             await self.send(text_data=json.dumps({
@@ -318,82 +330,47 @@ class QueueConsumer(AsyncWebsocketConsumer):
                 'message': f'更新数据时出错: {str(e)}'
             }))
 
+    async def send_initial_data(self, client_version=None):
+        """
+        发送初始数据
+
+        增量模式下客户端可以带上已持有的版本号，只接收此后的差异；
+        版本号无效或已过期时发送完整快照，客户端据此重新同步。
+        """
+        version, payload = await self.get_latest_snapshot()
+        if self.mode == 'delta' and isinstance(client_version, int) and 0 < client_version <= version:
+            delta = await self.get_delta(client_version, version)
+            if delta is not None:
+                self.snapshot_version = version
+                await self.send(text_data=delta)
+                return
+        await self.send_snapshot(version, payload, force=True)
+
+    async def send_snapshot(self, version, payload, force=False):
+        """发送编码好的快照"""
+        if not force and version <= self.snapshot_version:
+            return
+        self.snapshot_version = max(self.snapshot_version, version)
+        await self.send(text_data=payload)
+
     @database_sync_to_async
-    def get_stats(self):
-        """获取统计数据"""
-        try:
-            today = timezone.now().date()
-            stats = {
-                'total_patients': Queue.objects.filter(status__in=['waiting', 'processing']).count(),
-                'waiting_queues': Queue.objects.filter(status='waiting').count(),
-                'processing_queues': Queue.objects.filter(status='processing').count(),
-                'completed_today': Queue.objects.filter(
-                    status='completed',
-                    completed_time__date=today
-                ).count()
-            }
-            return stats
-        except Exception as e:
-            print(f"获取统计数据时出错: {str(e)}")
-            raise
+    def get_department_id(self, department_code):
+        """根据科室代码获取启用科室的ID"""
+        return Department.objects.filter(
+            code=department_code, is_active=True
+        ).values_list('id', flat=True).first()
 
     @database_sync_to_async
-    def get_departments(self):
-        """获取科室数据"""
-        try:
-            departments = []
-            for dept in Department.objects.filter(is_active=True).prefetch_related('queue_set'):
-                departments.append({
-                    'name': dept.name,
-                    'code': dept.code,
-                    'location': dept.location,
-                    'waiting_count': dept.queue_set.filter(status='waiting').count()
-                })
-            return departments
-        except Exception as e:
-            print(f"获取科室数据时出错: {str(e)}")
-            raise
+    def get_snapshot(self, version):
+        """按版本号获取编码后的快照"""
+        return snapshot_store.get(version, self.department_id)
 
     @database_sync_to_async
-    def get_queues(self):
-        """获取队列数据"""
-        try:
-            queues = []
-            for queue in Queue.objects.filter(
-                status__in=['waiting', 'processing']
-            ).select_related('patient', 'department', 'examination').order_by('enter_time'):
-                try:
-                    queue_data = {
-                        'queue_number': queue.queue_number,
-                        'patient_name': queue.patient.name,
-                        'department_name': queue.department.name,
-                        'examination_name': queue.examination.name,
-                        'status': queue.status,
-                        'estimated_wait_time': queue.estimated_wait_time,
-                        'enter_time': queue.enter_time.isoformat() if queue.enter_time else None
-                    }
-                    
-                    # 计算前面排队的人数
-                    if queue.status == 'waiting':
-                        try:
-                            # 尝试使用ahead_count属性
-                            ahead_count = queue.ahead_count
-                        except AttributeError:
-                            # 如果属性不存在，则直接计算
-                            ahead_count = Queue.objects.filter(
-                                department=queue.department,
-                                status='waiting',
-                                enter_time__lt=queue.enter_time
-                            ).count()
-                        queue_data['ahead_count'] = ahead_count
-                    else:
-                        queue_data['ahead_count'] = None
-                        
-                    queues.append(queue_data)
-                except Exception as e:
-                    print(f"处理单个队列数据时出错: {str(e)}")
-                    continue
-            return queues
-        except Exception as e:
-            print(f"获取队列数据时出错: {str(e)}")
-            raise 
\ No newline at end of file
+    def get_latest_snapshot(self):
+        """获取最新版本的编码后快照"""
+        return snapshot_store.get_latest(self.department_id)
+
+    @database_sync_to_async
+    def get_delta(self, base_version, version):
+        """获取两个版本之间编码后的增量更新"""
+        return snapshot_store.get_delta(base_version, version, self.department_id)
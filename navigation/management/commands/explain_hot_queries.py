@@ -0,0 +1,209 @@
+"""
+热点查询的执行计划检查
+
+对排队位置、等待时间预估、每日接诊量、科室统计、数据采集和分页/搜索等热点查询执行 EXPLAIN，
+报告每个查询使用的索引、是否全表扫描以及实际执行耗时。查询条件与业务代码中的查询保持一致，
+参数取自数据库中的现有数据。
+
+数据量很小时数据库可能认为全表扫描更快，检查应在接近生产规模的数据上运行（例如百万行队列的副本）。
+--check 模式下存在全表扫描时以非零状态退出。
+"""
+import re
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import F, Window
+from django.db.models.functions import Rank
+from django.utils import timezone
+
+from navigation.models import Queue, QueueHistory
+
+
+def _sample():
+    """热点查询的参数: 最近一条等待中的队列所在科室和检查项目，以及最近有历史记录的患者"""
+    queue = Queue.objects.filter(status='waiting').order_by('-enter_time', '-id').first()
+    if queue is None:
+        queue = Queue.objects.order_by('-enter_time', '-id').first()
+    if queue is None:
+        return None
+    history = QueueHistory.objects.order_by('-enter_time', '-id').first()
+    return {
+        'queue': queue,
+        'patient_id': history.patient_id if history else queue.patient_id,
+        'now': timezone.now(),
+    }
+
+
+def _hot_queries(sample):
+    """
+    返回 (名称, 来源, 查询集) 列表
+
+    聚合查询（count/aggregate）以同样条件、不排序的 SELECT 代替，两者使用相同的索引
+    """
+    queue = sample['queue']
+    now = sample['now']
+    day_start = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time()))
+    waiting = Queue.objects.filter(department_id=queue.department_id, status='waiting')
+    collected = QueueHistory.objects.filter(
+        created_at__gte=now - timedelta(days=30),
+        status__in=['completed', 'cancelled', 'skipped'],
+    ).values('id', 'department_id', 'examination_id', 'status', 'created_at')
+
+    return [
+        (
+            'queue_position_load',
+            'utils.queue_index: 科室等待队列',
+            waiting.values_list('id', 'priority', 'enter_time'),
+        ),
+        (
+            'queue_ahead_count',
+            'Queue.estimate_initial_wait_time: 同优先级先到的人数',
+            waiting.filter(priority=queue.priority, enter_time__lt=queue.enter_time).order_by().values('id'),
+        ),
+        (
+            'queue_positions_window',
+            'Queue.annotate_positions: 本页科室的排队位置',
+            Queue.objects.filter(status='waiting', department_id__in=[queue.department_id]).annotate(
+                position=Window(
+                    Rank(),
+                    partition_by=F('department_id'),
+                    order_by=[F('priority').desc(), F('enter_time').asc(), F('id').asc()],
+                )
+            ).values_list('id', 'position'),
+        ),
+        (
+            'exam_history_wait',
+            'Queue.estimate_initial_wait_time: 检查项目近30天已完成队列',
+            Queue.objects.filter(
+                examination_id=queue.examination_id,
+                status='completed',
+                start_time__isnull=False,
+                enter_time__gte=now - timedelta(days=30),
+                actual_wait_time__isnull=False,
+            ).order_by().values('actual_wait_time'),
+        ),
+        (
+            'daily_patient_count',
+            'Queue.clean: 科室当日接诊量',
+            Queue.objects.filter(
+                department_id=queue.department_id,
+                created_at__gte=day_start,
+                created_at__lt=day_start + timedelta(days=1),
+            ).order_by().values('id'),
+        ),
+        (
+            'department_average_wait',
+            'Department.get_average_wait_time: 最近完成的队列',
+            Queue.objects.filter(
+                department_id=queue.department_id,
+                status='completed',
+                end_time__gte=now - timedelta(days=1),
+            ).order_by().values('actual_wait_time'),
+        ),
+        (
+            'collector_history',
+            'QueueDataCollector.collect_historical_data: 近30天全部历史记录',
+            collected,
+        ),
+        (
+            'collector_history_department',
+            'QueueDataCollector.collect_historical_data: 单个科室的历史记录',
+            collected.filter(department_id=queue.department_id),
+        ),
+        (
+            'queue_cursor_page',
+            'QueueViewSet.list: 游标分页',
+            Queue.objects.filter(enter_time__gte=queue.enter_time).order_by('enter_time', 'id')[:11],
+        ),
+        (
+            'patient_history_page',
+            'PatientViewSet.history: 患者历史记录游标分页',
+            QueueHistory.objects.filter(patient_id=sample['patient_id']).order_by('-enter_time', '-id')[:11],
+        ),
+        (
+            'queue_search_number',
+            'QueueViewSet.search: 队列号',
+            Queue.objects.filter(Queue.search_filter(queue.queue_number)).order_by('-enter_time', '-id')[:11],
+        ),
+    ]
+
+
+def full_scans(plan):
+    """执行计划中对表的全表扫描，不支持的数据库返回None"""
+    lines = plan.splitlines()
+    if connection.vendor == 'sqlite':
+        # SQLite: "SCAN 表名" 为全表扫描，"SCAN 表名 USING INDEX" 为按索引顺序遍历，
+        # "SCAN (subquery-N)" 是遍历子查询结果
+        return [
+            line.strip() for line in lines
+            if re.search(r'\bSCAN \w', line) and 'USING' not in line
+        ]
+    if connection.vendor == 'postgresql':
+        return [line.strip() for line in lines if 'Seq Scan' in line]
+    return None
+
+
+class Command(BaseCommand):
+    help = '检查热点查询的执行计划是否使用索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='每个查询执行的次数，报告最短耗时（默认: 5）'
+        )
+        parser.add_argument(
+            '--analyze',
+            action='store_true',
+            help='PostgreSQL 上使用 EXPLAIN ANALYZE'
+        )
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='存在全表扫描时报错退出'
+        )
+
+    def handle(self, *args, **options):
+        sample = _sample()
+        if sample is None:
+            raise CommandError('没有队列数据，无法生成查询参数')
+
+        explain_options = {'analyze': True} if options['analyze'] and connection.vendor == 'postgresql' else {}
+        self.stdout.write(
+            f"数据库 {connection.vendor}，队列 {Queue.objects.count()} 条，历史记录 {QueueHistory.objects.count()} 条"
+        )
+
+        scanned = []
+        for name, source, queryset in _hot_queries(sample):
+            plan = queryset.explain(**explain_options)
+            elapsed = self._best_time(queryset, options['repeat'])
+            scans = full_scans(plan)
+
+            if scans is None:
+                status = self.style.WARNING('未检查')
+            elif scans:
+                status = self.style.ERROR('全表扫描')
+                scanned.append(name)
+            else:
+                status = self.style.SUCCESS('索引扫描')
+            self.stdout.write(f"\n{name} [{status}] {elapsed * 1000:.2f}ms  ({source})")
+            for line in plan.splitlines():
+                self.stdout.write(f"    {line}")
+
+        if scanned and options['check']:
+            raise CommandError(f"以下查询使用了全表扫描: {', '.join(scanned)}")
+        if not scanned:
+            self.stdout.write(self.style.SUCCESS('\n所有热点查询均使用索引'))
+
+    @staticmethod
+    def _best_time(queryset, repeat):
+        best = None
+        for _ in range(max(repeat, 1)):
+            start = time.perf_counter()
+            list(queryset.all())
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
@@ -0,0 +1,120 @@
+"""
+把已保存的模型重新导出为只含推理所需内容的格式，并对比导出前后的加载耗时和内存占用
+
+- XGBoost 模型导出为原生 .ubj 文件，原来的 .pkl 文件保留，加载时优先使用 .ubj
+- Prophet 模型去掉训练历史和 Stan 拟合对象后，作为同一文件的新版本发布到模型注册表；
+  未登记的旧文件先登记为一个版本，需要时可以回滚
+"""
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from navigation.ml.registry import registry_for
+from navigation.ml.serialization import (
+    XGBOOST_EXT, load_model_file, dump_model_file, is_prophet_model, is_compact_prophet, measure_load
+)
+
+
+def _model_dirs():
+    return [
+        os.path.join(settings.BASE_DIR, 'navigation', 'ml', 'trained_models'),
+        os.path.join(settings.BASE_DIR, 'ml_models', 'prophet'),
+    ]
+
+
+def _measure_in_subprocess(path):
+    # 每次测量使用新的进程，避免已加载的模型和内存分配影响结果
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=django.setup) as executor:
+        return executor.submit(measure_load, path).result()
+
+
+class Command(BaseCommand):
+    help = '把模型导出为精简格式（XGBoost .ubj / 去掉训练历史的 Prophet），并对比加载耗时和内存'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--no-benchmark',
+            action='store_true',
+            help='只导出，不做加载基准测试'
+        )
+
+    def handle(self, *args, **options):
+        pairs = []
+        for directory in _model_dirs():
+            if not os.path.isdir(directory):
+                continue
+            for file_name in sorted(os.listdir(directory)):
+                stem, ext = os.path.splitext(file_name)
+                if ext != '.pkl' or '.' in stem:
+                    continue
+                pair = self._export(os.path.join(directory, file_name))
+                if pair:
+                    pairs.append((stem,) + pair)
+
+        if not pairs:
+            self.stdout.write(self.style.WARNING('没有需要导出的模型'))
+            return
+        if not options['no_benchmark']:
+            self._benchmark(pairs)
+
+    def _export(self, path):
+        """
+        导出单个模型
+
+        返回:
+        - (导出前的文件, 导出后的文件)，模型不需要导出时返回None
+        """
+        name = os.path.basename(path)
+        registry = registry_for(path)
+        try:
+            model, _ = registry.load(path, load_model_file)
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"{name}: 加载失败 {str(e)}"))
+            return None
+
+        if type(model).__module__.startswith('xgboost'):
+            target = os.path.splitext(path)[0] + XGBOOST_EXT
+            if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                return None
+        elif is_prophet_model(model) and not is_compact_prophet(model):
+            target = path
+            if registry.current(path) is None:
+                # 先把原文件原样登记为一个版本，保留回滚的可能
+                registry.publish(model, path, dump=lambda _, tmp_path: shutil.copyfile(path, tmp_path))
+        else:
+            return None
+
+        # 导出前的文件：已登记的模型取当前版本文件，Prophet 发布新版本后访问路径会指向新文件
+        current = registry.current(path)
+        before = os.path.join(registry.root, current['file']) if current else path
+        metrics = current['metrics'] if current else None
+        version = registry_for(target).publish(model, target, metrics, dump=dump_model_file)
+        self.stdout.write(self.style.SUCCESS(
+            f"{name}: 已导出 {os.path.basename(target)} (版本 {version}), "
+            f"{os.path.getsize(before) / 1024:.0f}KB -> {os.path.getsize(target) / 1024:.0f}KB"
+        ))
+        return before, target
+
+    def _benchmark(self, pairs):
+        self.stdout.write(self.style.HTTP_INFO('\n加载基准测试（每次在新进程中冷加载）'))
+        self.stdout.write(f"{'模型':<28}{'导出前耗时':>12}{'导出后耗时':>12}{'导出前内存':>12}{'导出后内存':>12}")
+        totals = [0.0, 0.0, 0, 0]
+        for stem, before, after in pairs:
+            before_time, before_rss = _measure_in_subprocess(before)
+            after_time, after_rss = _measure_in_subprocess(after)
+            for index, value in enumerate((before_time, after_time, before_rss, after_rss)):
+                totals[index] += value
+            self.stdout.write(
+                f"{stem:<28}{before_time * 1000:>10.1f}ms{after_time * 1000:>10.1f}ms"
+                f"{before_rss / 1048576:>10.1f}MB{after_rss / 1048576:>10.1f}MB"
+            )
+        self.stdout.write(
+            f"{'合计':<28}{totals[0] * 1000:>10.1f}ms{totals[1] * 1000:>10.1f}ms"
+            f"{totals[2] / 1048576:>10.1f}MB{totals[3] / 1048576:>10.1f}MB"
+        )
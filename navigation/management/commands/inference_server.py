@@ -0,0 +1,62 @@
+"""
+启动预测服务进程，集中持有模型并为各 Web/Worker 进程提供批量预测
+
+    python manage.py inference_server                       # 使用 settings.ML_INFERENCE_SERVER
+    python manage.py inference_server --address unix:/run/hospital_queue/inference.sock
+    python manage.py inference_server --status              # 查询正在运行的服务
+"""
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = '启动预测服务进程（Unix 套接字或本机TCP），或查询运行中服务的状态'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--address',
+            help='监听地址，unix:<路径> 或 <主机>:<端口>，默认为 settings.ML_INFERENCE_SERVER'
+        )
+        parser.add_argument(
+            '--status',
+            action='store_true',
+            help='查询正在运行的预测服务的状态后退出'
+        )
+
+    def handle(self, *args, **options):
+        address = options['address'] or getattr(settings, 'ML_INFERENCE_SERVER', None)
+        if not address:
+            raise CommandError('未配置 ML_INFERENCE_SERVER，请使用 --address 指定监听地址')
+
+        if options['status']:
+            self._print_status(address)
+            return
+
+        from navigation.ml.inference_server import InferenceService, create_server
+
+        service = InferenceService()
+        departments, prophet_models = service.preload()
+        self.stdout.write(f"已加载 {departments} 个科室模型、{prophet_models} 个Prophet模型")
+
+        try:
+            server = create_server(address, service)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"无法监听 {address}: {str(e)}")
+
+        self.stdout.write(self.style.SUCCESS(f"预测服务已启动: {address}"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write("正在停止预测服务")
+        finally:
+            server.server_close()
+
+    def _print_status(self, address):
+        from navigation.ml.inference import InferenceClient
+
+        status = InferenceClient(address).status()
+        if status is None:
+            raise CommandError(f"预测服务 {address} 不可用")
+        self.stdout.write(json.dumps(status, indent=2, ensure_ascii=False))
@@ -0,0 +1,116 @@
+"""
+模型注册表管理命令：查看版本、回滚和校验
+
+回滚 Prophet 模型后会用回滚后的模型重新生成预测表（<模型>.forecast.npz），
+否则预测表仍是新版本模型的结果，或因模型文件变化而失效、退回实时预测。
+"""
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from navigation.ml.inference import prophet_model_dir, prophet_model_target
+from navigation.ml.registry import get_registry
+
+
+def _model_dirs():
+    """所有使用注册表发布模型的目录"""
+    return [
+        os.path.join(settings.BASE_DIR, 'navigation', 'ml', 'trained_models'),
+        prophet_model_dir(),
+    ]
+
+
+class Command(BaseCommand):
+    help = '查看模型版本、回滚到旧版本或校验模型文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'action',
+            choices=['list', 'rollback', 'verify'],
+            help='list: 列出模型版本; rollback: 回滚模型; verify: 校验所有版本文件'
+        )
+        parser.add_argument(
+            'model',
+            nargs='?',
+            help='模型文件名，如 xgboost_model_3.ubj 或 prophet_dept_3.pkl（rollback 时必填）'
+        )
+        parser.add_argument(
+            '--to',
+            type=int,
+            dest='target_version',
+            help='回滚到的版本号，默认回到上一个版本'
+        )
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'list':
+            self._list(options['model'])
+        elif action == 'rollback':
+            self._rollback(options['model'], options['target_version'])
+        else:
+            self._verify()
+
+    def _list(self, model=None):
+        for directory in _model_dirs():
+            registry = get_registry(directory)
+            models = registry.list_models()
+            if not models:
+                continue
+            self.stdout.write(self.style.HTTP_INFO(f"{directory} (generation {registry.generation()})"))
+            for name in sorted(models):
+                if model and name != model:
+                    continue
+                entry = models[name]
+                self.stdout.write(f"  {name}")
+                for version in sorted(entry['versions'], key=int):
+                    info = entry['versions'][version]
+                    marker = '*' if int(version) == entry['current'] else ' '
+                    mae = info['metrics'].get('mae')
+                    mae_text = f"MAE={mae:.2f}" if isinstance(mae, (int, float)) else ''
+                    self.stdout.write(
+                        f"   {marker} v{version}  {info['created_at']}  {info['sha256'][:12]}  {mae_text}"
+                    )
+
+    def _rollback(self, model, version=None):
+        if not model:
+            raise CommandError('回滚时必须指定模型名称')
+        for directory in _model_dirs():
+            registry = get_registry(directory)
+            if model in registry.list_models():
+                try:
+                    version = registry.rollback(os.path.join(directory, model), version)
+                except ValueError as e:
+                    raise CommandError(str(e))
+                self.stdout.write(self.style.SUCCESS(f"模型 {model} 已回滚到版本 {version}"))
+                if directory == prophet_model_dir():
+                    self._rebuild_forecast_table(model)
+                return
+        raise CommandError(f'未找到模型 {model}')
+
+    def _rebuild_forecast_table(self, model):
+        """用回滚后的 Prophet 模型重新生成预测表"""
+        target = prophet_model_target(model)
+        if target is None:
+            return
+        # Prophet 依赖较重，只在回滚 Prophet 模型时导入
+        from navigation.ml.prophet_predictor import ProphetWaitTimePredictor
+
+        department_id, examination_id = target
+        predictor = ProphetWaitTimePredictor(department_id=department_id, examination_id=examination_id)
+        if predictor.build_forecast_table():
+            self.stdout.write(self.style.SUCCESS(f"已重新生成预测表 {os.path.basename(predictor.forecast_file)}"))
+        else:
+            self.stdout.write(self.style.WARNING(
+                '重新生成预测表失败，预测将退回实时计算，可稍后执行 refresh_prophet_forecasts 任务'
+            ))
+
+    def _verify(self):
+        problems = []
+        for directory in _model_dirs():
+            problems.extend(get_registry(directory).verify())
+        for name, version, reason in problems:
+            self.stdout.write(self.style.ERROR(f"{name} v{version}: {reason}"))
+        if problems:
+            raise CommandError(f'{len(problems)} 个模型版本校验失败')
+        self.stdout.write(self.style.SUCCESS('所有模型版本校验通过'))
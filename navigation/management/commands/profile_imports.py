@@ -0,0 +1,161 @@
+"""
+Web进程启动的导入耗时分析
+
+在新的 Python 进程中使用 -X importtime 完成 Django 初始化、加载URL配置和 WSGI/ASGI 应用，
+按顶层包汇总导入耗时，并报告启动后的常驻内存。--check 模式下，如果启动过程导入了
+只在训练时需要的库（XGBoost、Prophet、scikit-learn 等），列出导入链并以非零状态退出，
+可放在CI中防止这些库重新出现在请求路径上。
+"""
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Web进程不应导入的训练用库
+FORBIDDEN_PACKAGES = ('xgboost', 'prophet', 'cmdstanpy', 'sklearn', 'matplotlib', 'pandas', 'pyarrow')
+
+# 子进程中执行的启动代码，结果以JSON输出到stdout，importtime 输出在stderr
+STARTUP_SCRIPT = '''
+import importlib, json, os, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+from django.conf import settings
+from django.urls import get_resolver
+get_resolver(importlib.import_module(settings.ROOT_URLCONF)).url_patterns
+for module in {modules!r}:
+    importlib.import_module(module)
+elapsed = time.perf_counter() - start
+try:
+    with open('/proc/self/statm') as f:
+        rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+except (OSError, ValueError, IndexError):
+    rss = None
+print(json.dumps({{'elapsed': elapsed, 'rss': rss, 'modules': sorted(sys.modules)}}))
+'''
+
+TARGET_MODULES = {
+    'web': ['hospital_queue.wsgi'],
+    'asgi': ['hospital_queue.asgi'],
+}
+
+
+def parse_importtime(stderr):
+    """
+    解析 -X importtime 输出
+
+    返回:
+    - list: (模块名, 自身耗时微秒, 累计耗时微秒, 嵌套层级)，按输出顺序（子模块在前）
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+            stripped = name.lstrip(' ')
+            level = (len(name) - len(stripped) - 1) // 2
+            entries.append((stripped.strip(), int(self_us), int(cumulative_us), level))
+        except ValueError:
+            continue
+    return entries
+
+
+def import_chain(entries, index):
+    """某个模块是被哪些模块依次导入的（从外到内）"""
+    chain = [entries[index][0]]
+    level = entries[index][3]
+    for name, _, _, entry_level in entries[index + 1:]:
+        if entry_level < level:
+            chain.append(name)
+            level = entry_level
+            if level == 0:
+                break
+    return list(reversed(chain))
+
+
+class Command(BaseCommand):
+    help = '分析Web进程启动时的导入耗时，检查是否导入了训练用的机器学习库'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--target',
+            choices=sorted(TARGET_MODULES),
+            default='web',
+            help='要分析的入口: web（WSGI）或 asgi（默认: web）'
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=15,
+            help='显示导入耗时最多的前N个顶层包（默认: 15）'
+        )
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='导入了训练用的库时报错退出'
+        )
+        parser.add_argument(
+            '--allow',
+            nargs='*',
+            default=[],
+            help='--check 时允许导入的包'
+        )
+
+    def handle(self, *args, **options):
+        script = STARTUP_SCRIPT.format(modules=TARGET_MODULES[options['target']])
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+            'DJANGO_SETTINGS_MODULE', 'hospital_queue.settings'
+        ))
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', script],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+        )
+        if process.returncode != 0:
+            raise CommandError(f"启动进程失败:\n{process.stderr[-2000:]}")
+
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        entries = parse_importtime(process.stderr)
+
+        self._print_breakdown(result, entries, options['top'])
+
+        forbidden = [p for p in FORBIDDEN_PACKAGES if p not in options['allow']]
+        loaded = [p for p in forbidden if p in result['modules']]
+        if not loaded:
+            self.stdout.write(self.style.SUCCESS('未导入训练用的机器学习库'))
+            return
+
+        for package in loaded:
+            index = next(
+                (i for i, entry in enumerate(entries) if entry[0] == package or entry[0].startswith(f'{package}.')),
+                None
+            )
+            chain = import_chain(entries, index) if index is not None else [package]
+            # 只显示到第一个属于该包的模块
+            chain = chain[:next(i for i, name in enumerate(chain) if name.split('.')[0] == package) + 1]
+            chain = ' -> '.join(chain)
+            self.stdout.write(self.style.WARNING(f'导入了 {package}: {chain}'))
+
+        if options['check']:
+            raise CommandError(f"启动时导入了训练用的库: {', '.join(loaded)}")
+
+    def _print_breakdown(self, result, entries, top):
+        by_package = defaultdict(int)
+        for name, self_us, _, _ in entries:
+            by_package[name.split('.')[0]] += self_us
+        total_us = sum(by_package.values())
+
+        rss = f"{result['rss'] / 1024 / 1024:.1f}MB" if result['rss'] else '未知'
+        self.stdout.write(
+            f"启动耗时 {result['elapsed']:.2f}秒（其中导入 {total_us / 1e6:.2f}秒），"
+            f"常驻内存 {rss}，已加载模块 {len(result['modules'])} 个"
+        )
+        # 中文字符占两个显示宽度，表头按显示宽度对齐
+        self.stdout.write(f"{'包':<23}{'导入耗时(ms)':>10}{'占比':>6}")
+        for package, us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+            share = us / total_us * 100 if total_us else 0
+            self.stdout.write(f"{package:<24}{us / 1000:>14.1f}{share:>7.1f}%")
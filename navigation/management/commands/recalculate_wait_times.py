@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from navigation.models import Queue
+from navigation.utils.wait_time import BatchWaitTimeEstimator
 
 
 class Command(BaseCommand):
@@ -34,30 +35,20 @@ class Command(BaseCommand):
         total_count = waiting_queues.count()
         self.stdout.write(f'找到 {total_count} 个等待中的队列')
 
-        # 重新计算每个队列的等待时间
-        updated_count = 0
-        for i, queue in enumerate(waiting_queues):
-            old_wait_time = queue.estimated_wait_time
-            try:
-                new_wait_time = queue.estimate_initial_wait_time()
-                
-                if old_wait_time != new_wait_time:
-                    queue.estimated_wait_time = new_wait_time
-                    queue.save(update_fields=['estimated_wait_time'])
-                    updated_count += 1
-                    
-                    if verbose:
-                        self.stdout.write(
-                            f'队列 ID:{queue.id} 科室:{queue.department.name} 检查:{queue.examination.name} '
-                            f'等待时间从 {old_wait_time} 更新为 {new_wait_time} 分钟'
-                        )
-                
-                # 每10个队列显示一次进度
-                if (i + 1) % 10 == 0 or i + 1 == total_count:
-                    self.stdout.write(f'处理进度: {i + 1}/{total_count} ({(i + 1) / total_count * 100:.1f}%)')
-            
-            except Exception as e:
-                self.stderr.write(self.style.ERROR(f'处理队列 ID:{queue.id} 时出错: {str(e)}'))
+        # 批量重新计算等待时间，并通过一次 bulk_update 写回
+        try:
+            changed = BatchWaitTimeEstimator().update(waiting_queues)
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f'批量计算等待时间时出错: {str(e)}'))
+            return
+
+        updated_count = len(changed)
+        if verbose:
+            for queue, old_wait_time, new_wait_time in changed:
+                self.stdout.write(
+                    f'队列 ID:{queue.id} 科室:{queue.department.name} 检查:{queue.examination.name} '
+                    f'等待时间从 {old_wait_time} 更新为 {new_wait_time} 分钟'
+                )
 
         end_time = timezone.now()
         duration = (end_time - start_time).total_seconds()
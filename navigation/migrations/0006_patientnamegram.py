@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def name_grams(name):
+    """与 PatientNameGram.grams_for 相同: 规范化后的单字和二元组"""
+    name = (name or '').casefold()
+    return set(name) | {name[i:i + 2] for i in range(len(name) - 1)}
+
+
+def build_name_grams(apps, schema_editor):
+    """为已有患者生成姓名索引"""
+    Patient = apps.get_model('navigation', 'Patient')
+    PatientNameGram = apps.get_model('navigation', 'PatientNameGram')
+    batch = []
+    for patient_id, name in Patient.objects.values_list('id', 'name').iterator(chunk_size=2000):
+        batch.extend(PatientNameGram(patient_id=patient_id, gram=gram) for gram in sorted(name_grams(name)))
+        if len(batch) >= 5000:
+            PatientNameGram.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        PatientNameGram.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('navigation', '0005_alter_queuehistory_options_alter_queuerecord_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientNameGram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(max_length=2, verbose_name='姓名片段')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='name_grams', to='navigation.patient', verbose_name='患者')),
+            ],
+            options={
+                'verbose_name': '患者姓名索引',
+                'verbose_name_plural': '患者姓名索引',
+                'constraints': [models.UniqueConstraint(fields=('gram', 'patient'), name='patient_name_gram_unique')],
+            },
+        ),
+        migrations.RunPython(build_name_grams, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('navigation', '0006_patientnamegram'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='queue',
+            name='navigation__queue_n_34cabc_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='queue',
+            name='navigation__priorit_31a962_idx',
+        ),
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(condition=models.Q(('status', 'waiting')), fields=['department', '-priority', 'enter_time', 'id'], name='queue_waiting_position_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(fields=['examination', 'status', 'enter_time'], name='queue_exam_status_enter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(fields=['department', 'created_at'], name='queue_dept_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(condition=models.Q(('status', 'completed')), fields=['department', 'end_time'], name='queue_completed_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(fields=['enter_time', 'id'], name='queue_enter_time_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queuehistory',
+            index=models.Index(fields=['created_at', 'status', 'department', 'examination'], name='history_collect_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queuehistory',
+            index=models.Index(fields=['patient', 'enter_time', 'id'], name='history_patient_enter_idx'),
+        ),
+    ]
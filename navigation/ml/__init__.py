@@ -1,24 +1,38 @@
 """
 机器学习模块，用于等待时间预测和排队优化
+
+导入本包不会加载 pandas、scikit-learn、XGBoost、Prophet 等库：
+prediction_service、data_collector、model_trainer 在第一次访问时才导入对应模块。
+Web进程中的预测请使用 navigation.ml.inference。
 """
 
 import os
 import logging
+from importlib import import_module
 
 # 创建目录结构
 os.makedirs('navigation/ml/trained_models', exist_ok=True)
 os.makedirs('navigation/ml/data', exist_ok=True)
 
-# 导入模型和服务
-from .models import WaitTimePredictionService, WaitTimePredictor
-from .data_collector import data_collector
-from .trainer import model_trainer
-
-# 创建全局预测服务实例
-prediction_service = WaitTimePredictionService()
+# 延迟导出的名称 -> 所在模块
+_LAZY_EXPORTS = {
+    'prediction_service': '.models',
+    'WaitTimePredictionService': '.models',
+    'WaitTimePredictor': '.models',
+    'data_collector': '.data_collector',
+    'model_trainer': '.trainer',
+}
 
 # 设置日志
 logger = logging.getLogger(__name__)
-logger.info("机器学习模块已初始化")
 
-__all__ = ['prediction_service', 'data_collector', 'model_trainer'] 
\ No newline at end of file
+
+def __getattr__(name):
+    if name not in _LAZY_EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_LAZY_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+__all__ = ['prediction_service', 'data_collector', 'model_trainer']
@@ -12,6 +12,7 @@ from django.utils import timezone
 from django.conf import settings
 
 from navigation.models import Queue, Department, Equipment, QueueHistory, Examination
+from navigation.ml.data_store import training_data_store
 
 # 配置日志 - 确保与tasks.py中的设置一致
 logger = logging.getLogger(__name__)
@@ -36,137 +37,260 @@ class WaitTimeDataCollector:
     等待时间数据收集器 - 收集模型训练所需的数据
     """
     
+    # 训练数据的特征列，顺序与保存的CSV一致
+    FEATURE_COLUMNS = [
+        'queue_id', 'department_id', 'queue_count', 'department_capacity', 'staff_efficiency',
+        'equipment_status', 'historical_wait_time', 'hour', 'day_of_week', 'is_weekend',
+        'priority', 'actual_wait_time', 'timestamp'
+    ]
+    
+    # 科室历史平均等待时间的滚动窗口
+    HISTORY_WINDOW = timedelta(days=7)
+    
     def __init__(self):
         self.data_file = os.path.join(DATA_DIR, 'wait_time_training_data.csv')
+        self.store = training_data_store
     
     def collect_historical_data(self, days=30, save=True):
         """
         收集历史队列等待时间数据作为训练数据
         
+        以集合方式计算特征：一次有序扫描队列记录，排队人数由进入/开始服务事件的扫描线得到，
+        科室7天平均等待时间由 pandas 按时间滚动计算，查询次数与数据量无关。
+        
         参数:
             days (int): 向前收集多少天的数据
-            save (bool): 是否保存到文件
+            save (bool): 是否保存到文件，列式存储可用时重建 Parquet 数据集，否则写入CSV
             
         返回:
             DataFrame: 收集到的训练数据
         """
         start_date = timezone.now() - timedelta(days=days)
+        df, watermark = self._build_features(start_date)
+        logger.info(f"收集到 {len(df)} 条训练数据")
         
-        # 收集已完成的队列记录
-        completed_queues = Queue.objects.filter(
-            status='completed',
-            start_time__isnull=False,
-            enter_time__isnull=False,
-            actual_wait_time__isnull=False,
-            created_at__gte=start_date
-        ).select_related('department', 'equipment', 'examination')
+        if save and not df.empty:
+            try:
+                if self.store.is_available():
+                    self.store.rebuild(df, watermark=watermark)
+                else:
+                    df.to_csv(self.data_file, index=False)
+                    logger.info(f"已保存 {len(df)} 条训练数据到 {self.data_file}")
+            except Exception as e:
+                logger.error(f"保存数据失败: {str(e)}")
+        
+        return df
+    
+    def collect_incremental_data(self, days=30):
+        """
+        只收集水位线之后完成的队列并追加到列式存储
+        
+        存储为空时退回到完整收集。扫描范围从新完成队列中最早的创建时间开始，不再重复处理已收录的数据。
+        
+        参数:
+            days (int): 存储为空时完整收集的天数，也是增量收集回溯的上限
+            
+        返回:
+            int: 追加的行数
+        """
+        if not self.store.is_available():
+            logger.warning("pyarrow 未安装，增量收集退回到完整收集")
+            return len(self.collect_historical_data(days=days))
+        
+        watermark = self.store.get_watermark()
+        if watermark is None or not self.store.exists():
+            return len(self.collect_historical_data(days=days))
+        
+        earliest = Queue.objects.filter(
+            self._completed_after(watermark), status='completed'
+        ).aggregate(earliest=Min('created_at'))['earliest']
+        if earliest is None:
+            logger.info(f"水位线 {watermark.isoformat()} 之后没有新完成的队列")
+            return 0
+        
+        start_date = max(earliest, timezone.now() - timedelta(days=days))
+        df, new_watermark = self._build_features(start_date, completed_after=watermark)
+        if not df.empty:
+            # 完成时间等于水位线的队列可能已在上一批中收录，按队列ID去重
+            stored = self.store.read(columns=['queue_id'], since=df['timestamp'].min())
+            if stored is not None and not stored.empty:
+                df = df[~df['queue_id'].isin(stored['queue_id'])].reset_index(drop=True)
+        return self.store.append(df, watermark=new_watermark or watermark)
+    
+    @staticmethod
+    def _completed_after(watermark):
+        """
+        完成时间（结束服务时间，缺失时为更新时间）不早于水位线的条件
+
+        与水位线同一时刻完成、但上一批收集时尚未提交的队列也要包含在内，重复的记录由调用方按ID去除
+        """
+        return Q(end_time__gte=watermark) | Q(end_time__isnull=True, updated_at__gte=watermark)
+    
+    def _build_features(self, start_date, completed_after=None):
+        """
+        计算 start_date 之后创建的已完成队列的训练特征
+        
+        参数:
+            start_date (datetime): 样本的最早创建时间
+            completed_after (datetime): 只保留完成时间不早于该时间的样本
+            
+        返回:
+            (DataFrame, datetime): 特征数据和样本中最晚的完成时间（没有样本时为None）
+        """
+        history_start = start_date - self.HISTORY_WINDOW
+        
+        frame = self._load_queue_frame(start_date, history_start)
+        completed_time = frame['end_time'].fillna(frame['updated_at'])
+        
+        # 已完成的队列记录作为训练样本
+        mask = (
+            (frame['status'] == 'completed') &
+            frame['start_time'].notna() &
+            frame['enter_time'].notna() &
+            frame['actual_wait_time'].notna() &
+            (frame['created_at'] >= start_date)
+        )
+        if completed_after is not None:
+            mask &= completed_time >= pd.Timestamp(completed_after)
+        samples = frame[mask]
+        if samples.empty:
+            logger.info("没有可用的已完成队列记录")
+            return pd.DataFrame(columns=self.FEATURE_COLUMNS), None
+        
+        # 各科室容量和设备状态
+        department_capacity, first_available = self._load_department_resources()
+        
+        # 队列进入时科室的排队人数
+        queue_count = self._waiting_counts_at(frame, samples)
+        
+        # 队列创建时是否有可用设备
+        available_since = samples['department_id'].map(first_available)
+        equipment_status = (
+            available_since.notna() & (available_since <= samples['created_at'])
+        ).astype(int)
+        
+        # 过去7天科室平均等待时间
+        historical_wait_time = self._rolling_history_means(frame, history_start).reindex(samples.index).fillna(0)
+        
+        # 没有实际处理时间数据，根据设备状态估算效率：设备正常时效率较高，故障时效率较低，并添加随机扰动
+        staff_efficiency = np.where(equipment_status == 1, 1.2, 0.7) * np.random.uniform(0.9, 1.1, len(samples))
+        
+        timestamp = samples['enter_time']
+        day_of_week = timestamp.dt.dayofweek  # 0=周一, 6=周日
+        df = pd.DataFrame({
+            'queue_id': samples['id'],
+            'department_id': samples['department_id'],
+            'queue_count': queue_count,
+            'department_capacity': samples['department_id'].map(department_capacity).fillna(5).astype(int),  # 默认容量为5
+            'staff_efficiency': staff_efficiency,
+            'equipment_status': equipment_status,
+            'historical_wait_time': historical_wait_time,
+            'hour': timestamp.dt.hour,
+            'day_of_week': day_of_week,
+            'is_weekend': (day_of_week >= 5).astype(int),
+            'priority': samples['priority'],
+            'actual_wait_time': samples['actual_wait_time'].astype(int),
+            'timestamp': timestamp,
+        }, columns=self.FEATURE_COLUMNS).reset_index(drop=True)
+        
+        return df, completed_time[samples.index].max().to_pydatetime()
+    
+    def _load_queue_frame(self, start_date, history_start):
+        """
+        一次有序扫描加载特征计算需要的队列记录
+        
+        包含: 历史窗口内创建的记录、在收集窗口内开始服务的记录，以及尚未开始服务的等待队列，
+        这样收集窗口内任一时刻仍在排队的记录都在扫描结果中。
+        """
+        fields = [
+            'id', 'department_id', 'status', 'priority', 'actual_wait_time',
+            'enter_time', 'start_time', 'end_time', 'created_at', 'updated_at'
+        ]
+        rows = Queue.objects.filter(
+            Q(created_at__gte=history_start) |
+            Q(start_time__gte=start_date) |
+            Q(start_time__isnull=True, status='waiting')
+        ).order_by('enter_time', 'id').values_list(*fields)
+        
+        frame = pd.DataFrame.from_records(list(rows), columns=fields)
+        for column in ('enter_time', 'start_time', 'end_time', 'created_at', 'updated_at'):
+            frame[column] = pd.to_datetime(frame[column], utc=True)
+        frame['actual_wait_time'] = pd.to_numeric(frame['actual_wait_time'], errors='coerce')
+        return frame
+    
+    def _load_department_resources(self):
+        """
+        一次查询获取各科室容量和最早可用设备的更新时间
+        
+        返回:
+            (dict, dict): 科室容量 {department_id: capacity}，最早可用时间 {department_id: Timestamp}
+        """
+        equipment = {
+            row['department_id']: row
+            for row in Equipment.objects.order_by().values('department_id').annotate(
+                equipment_count=Count('id'),
+                first_available=Min('updated_at', filter=Q(status='available')),
+            )
+        }
         
-        # 获取各科室容量数据
-        departments = Department.objects.all()
         department_capacity = {}
-        for dept in departments:
+        first_available = {}
+        for dept in Department.objects.all():
+            row = equipment.get(dept.id, {})
             # 科室容量 = 设备数量 + 医生数量
-            equipment_count = Equipment.objects.filter(department_id=dept.id).count()
             # 假设医生数量字段存在，如果不存在，则假设每个科室有3-8名医生
             doctor_count = getattr(dept, 'doctor_count', np.random.randint(3, 9))
-            department_capacity[dept.id] = equipment_count + doctor_count
-        
-        data = []
-        for queue in completed_queues:
-            try:
-                # 获取该队列创建时科室的排队情况
-                queue_time = queue.created_at
-                dept_id = queue.department_id
-                
-                # 获取队列创建时的排队人数
-                queue_count = Queue.objects.filter(
-                    department_id=dept_id,
-                    status='waiting',
-                    created_at__lte=queue_time
-                ).count()
-                
-                # 获取当时的设备状态
-                equipment_available = Equipment.objects.filter(
-                    department_id=dept_id,
-                    status='available',
-                    updated_at__lte=queue_time
-                ).exists()
-                equipment_status = 1 if equipment_available else 0
-                
-                # 提取时间特征
-                timestamp = queue.enter_time
-                hour = timestamp.hour
-                day_of_week = timestamp.weekday()  # 0=周一, 6=周日
-                is_weekend = 1 if day_of_week >= 5 else 0
-                
-                # 计算实际等待时间（分钟）
-                actual_wait_time = queue.actual_wait_time or 0
-                
-                # 获取该科室的历史平均等待时间（过去7天）
-                week_ago = queue_time - timedelta(days=7)
-                historical_wait_times = Queue.objects.filter(
-                    department_id=dept_id,
-                    status='completed',
-                    created_at__gte=week_ago,
-                    created_at__lt=queue_time,
-                    actual_wait_time__isnull=False
-                ).values_list('actual_wait_time', flat=True)
-                
-                historical_wait_time = 0
-                if historical_wait_times:
-                    historical_wait_time = sum(historical_wait_times) / len(historical_wait_times)
-                
-                # 计算医生/设备工作效率
-                # 效率 = 理想处理时间 / 实际处理时间
-                # 如果存在处理时间字段，使用实际数据，否则基于设备状态估算
-                staff_efficiency = 1.0  # 默认标准效率
-                
-                if hasattr(queue, 'processing_time') and queue.processing_time:
-                    ideal_time = 15  # 假设理想处理时间为15分钟
-                    actual_time = queue.processing_time
-                    if actual_time > 0:
-                        staff_efficiency = ideal_time / actual_time
-                        # 将效率限制在合理范围内
-                        staff_efficiency = max(0.5, min(1.5, staff_efficiency))
-                else:
-                    # 如果没有实际数据，根据设备状态估算效率
-                    # 设备正常时效率较高，故障时效率较低
-                    staff_efficiency = 1.2 if equipment_status == 1 else 0.7
-                    # 添加随机扰动
-                    staff_efficiency *= np.random.uniform(0.9, 1.1)
-                
-                # 构建特征向量
-                data.append({
-                    'queue_id': queue.id,
-                    'department_id': dept_id,
-                    'queue_count': queue_count,
-                    'department_capacity': department_capacity.get(dept_id, 5),  # 默认容量为5
-                    'staff_efficiency': staff_efficiency,
-                    'equipment_status': equipment_status,
-                    'historical_wait_time': historical_wait_time,
-                    'hour': hour,
-                    'day_of_week': day_of_week,
-                    'is_weekend': is_weekend,
-                    'priority': queue.priority,
-                    'actual_wait_time': actual_wait_time,
-                    'timestamp': timestamp
-                })
-            except Exception as e:
-                logger.error(f"处理队列 {queue.id} 时出错: {str(e)}")
-                continue
+            department_capacity[dept.id] = row.get('equipment_count', 0) + doctor_count
+            if row.get('first_available') is not None:
+                first_available[dept.id] = pd.Timestamp(row['first_available'])
+        return department_capacity, first_available
+    
+    def _waiting_counts_at(self, frame, samples):
+        """
+        扫描线计算每个样本进入队列时科室的排队人数
         
-        # 转换为DataFrame
-        df = pd.DataFrame(data)
+        排队人数 = 此前进入队列的记录数 - 此时已离开队列的记录数。
+        离开时间为开始服务时间；未开始服务的取消/过号记录以结束时间（或更新时间）为准，
+        仍在等待的记录视为尚未离开。
+        """
+        leave_time = frame['start_time'].fillna(frame['end_time']).fillna(frame['updated_at'])
+        leave_time = leave_time.where(frame['start_time'].notna() | (frame['status'] != 'waiting'))
         
-        # 保存到CSV
-        if save and not df.empty:
-            try:
-                df.to_csv(self.data_file, index=False)
-                logger.info(f"已保存 {len(df)} 条训练数据到 {self.data_file}")
-            except Exception as e:
-                logger.error(f"保存数据失败: {str(e)}")
+        counts = pd.Series(0, index=samples.index, dtype=int)
+        for dept_id, group in frame.groupby('department_id'):
+            dept_samples = samples[samples['department_id'] == dept_id]
+            if dept_samples.empty:
+                continue
+            enters = np.sort(group['enter_time'].dropna().values)
+            leaves = np.sort(leave_time[group.index].dropna().values)
+            t = dept_samples['enter_time'].values
+            entered = np.searchsorted(enters, t, side='left')
+            left = np.searchsorted(leaves, t, side='right')
+            counts[dept_samples.index] = np.maximum(entered - left, 0)
+        return counts
+    
+    def _rolling_history_means(self, frame, history_start):
+        """
+        按科室计算每条已完成记录创建前7天内的平均实际等待时间（不含同一时刻及之后的记录）
         
-        return df
+        返回:
+            Series: 以 frame 的索引为索引，没有历史记录时为NaN
+        """
+        history = frame[
+            (frame['status'] == 'completed') &
+            frame['actual_wait_time'].notna() &
+            (frame['created_at'] >= history_start)
+        ].sort_values('created_at', kind='stable')
+        
+        means = []
+        for _, group in history.groupby('department_id'):
+            rolled = group.set_index('created_at')['actual_wait_time'].rolling(
+                self.HISTORY_WINDOW, closed='left'
+            ).mean()
+            means.append(pd.Series(rolled.values, index=group.index))
+        if not means:
+            return pd.Series(dtype=float)
+        return pd.concat(means)
     
     def collect_real_time_data(self):
         """
@@ -245,20 +369,44 @@ class WaitTimeDataCollector:
         
         return real_time_data
     
-    def get_training_data(self):
+    def get_training_data(self, columns=None, department_id=None):
         """
         获取已保存的训练数据
         
+        优先从列式存储读取，只加载需要的列和科室分区；没有列式数据时读取CSV文件。
+        
+        参数:
+            columns (list): 需要的列，为None时读取全部列
+            department_id (int): 只读取该科室的数据
+        
         返回:
             DataFrame: 训练数据，如果文件不存在则返回None
         """
         try:
+            if self.store.exists():
+                return self.store.read(columns=columns, department_id=department_id)
             if os.path.exists(self.data_file):
-                return pd.read_csv(self.data_file)
+                df = pd.read_csv(self.data_file, usecols=columns)
+                if department_id is not None and 'department_id' in df.columns:
+                    df = df[df['department_id'] == department_id]
+                return df
             return None
         except Exception as e:
             logger.error(f"读取训练数据文件时出错: {str(e)}")
             return None
+    
+    def get_training_data_count(self):
+        """获取训练数据行数，列式存储只读取文件元数据"""
+        try:
+            if self.store.exists():
+                return self.store.count_rows()
+            if os.path.exists(self.data_file):
+                with open(self.data_file, 'r', encoding='utf-8') as f:
+                    return max(sum(1 for _ in f) - 1, 0)
+            return 0
+        except Exception as e:
+            logger.error(f"统计训练数据行数时出错: {str(e)}")
+            return 0
 
 
 class QueueDataCollector:
@@ -338,6 +486,18 @@ class QueueDataCollector:
             logger.error(f"收集历史数据失败：{str(e)}")
             return pd.DataFrame()
     
+    @staticmethod
+    def slice_history(history, department_id=None, examination_id=None):
+        """从已加载的历史数据中筛选科室或检查项目的数据"""
+        if history.empty:
+            return history
+        mask = pd.Series(True, index=history.index)
+        if department_id:
+            mask &= history['department_id'] == department_id
+        if examination_id:
+            mask &= history['examination_id'] == examination_id
+        return history[mask].copy()
+    
     def collect_current_queue_data(self, department_id=None, examination_id=None):
         """
         收集当前排队数据
@@ -447,7 +607,7 @@ class QueueDataCollector:
         
         return aggregated
     
-    def prepare_prophet_data(self, department_id=None, examination_id=None, time_unit='day'):
+    def prepare_prophet_data(self, department_id=None, examination_id=None, time_unit='day', history=None):
         """
         准备Prophet模型训练数据
         
@@ -455,12 +615,16 @@ class QueueDataCollector:
         - department_id: 科室ID
         - examination_id: 检查项目ID
         - time_unit: 时间单位，可选值：'hour', 'day', 'week'
+        - history: 已加载的全部历史数据，提供时从中筛选而不再查询数据库
         
         返回:
         - Prophet格式的训练数据
         """
         # 收集历史数据
-        df = self.collect_historical_data(department_id, examination_id)
+        if history is None:
+            df = self.collect_historical_data(department_id, examination_id)
+        else:
+            df = self.slice_history(history, department_id, examination_id)
         
         if df.empty:
             logger.warning("没有可用的历史数据来准备Prophet模型")
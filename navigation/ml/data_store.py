@@ -0,0 +1,206 @@
+"""
+训练数据列式存储 - 按科室和日期分区的 Parquet 数据集
+
+目录结构: <root>/department_id=<id>/day=<YYYY-MM-DD>/part-<token>-<n>.parquet
+每次追加写入新的分区文件，不改写已有文件；读取时通过内存映射只加载需要的列和分区，
+统计行数只读取文件元数据。增量追加的水位线（已收录的最晚完成时间）保存在 _watermark.json。
+"""
+import json
+import logging
+import os
+import shutil
+import uuid
+
+import pandas as pd
+from django.conf import settings
+from django.utils import timezone
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    from pyarrow import fs as pa_fs
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# 默认存储目录
+STORE_DIR = os.path.join(settings.BASE_DIR, 'navigation', 'ml', 'data', 'training_store')
+
+
+def _schema():
+    """训练数据各列的存储类型（分区列 department_id 不写入文件）"""
+    return pa.schema([
+        ('queue_id', pa.int64()),
+        ('queue_count', pa.int32()),
+        ('department_capacity', pa.int32()),
+        ('staff_efficiency', pa.float32()),
+        ('equipment_status', pa.int8()),
+        ('historical_wait_time', pa.float32()),
+        ('hour', pa.int8()),
+        ('day_of_week', pa.int8()),
+        ('is_weekend', pa.int8()),
+        ('priority', pa.int16()),
+        ('actual_wait_time', pa.int32()),
+        ('timestamp', pa.timestamp('us', tz='UTC')),
+    ])
+
+
+def _partitioning():
+    return ds.partitioning(
+        pa.schema([('department_id', pa.int64()), ('day', pa.string())]),
+        flavor='hive'
+    )
+
+
+class TrainingDataStore:
+    """
+    训练数据的 Parquet 分区存储
+
+    pyarrow 未安装时 is_available() 返回False，调用方应退回到CSV文件。
+    """
+
+    WATERMARK_FILE = '_watermark.json'
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+
+    def is_available(self):
+        return PYARROW_AVAILABLE
+
+    def exists(self):
+        """存储中是否已有数据文件"""
+        if not PYARROW_AVAILABLE or not os.path.isdir(self.root):
+            return False
+        return any(name.startswith('department_id=') for name in os.listdir(self.root))
+
+    def _dataset(self):
+        # 使用内存映射读取，只有实际访问的列会被加载
+        return ds.dataset(
+            self.root,
+            format='parquet',
+            partitioning=_partitioning(),
+            filesystem=pa_fs.LocalFileSystem(use_mmap=True),
+        )
+
+    def _to_table(self, df):
+        frame = df.copy()
+        frame['timestamp'] = pd.to_datetime(frame['timestamp'], utc=True)
+        # 按本地日期分区，与科室每天的排班一致
+        frame['day'] = frame['timestamp'].dt.tz_convert(settings.TIME_ZONE).dt.strftime('%Y-%m-%d')
+        schema = _schema().append(pa.field('department_id', pa.int64())).append(pa.field('day', pa.string()))
+        return pa.Table.from_pandas(frame[schema.names], schema=schema, preserve_index=False)
+
+    def append(self, df, watermark=None):
+        """
+        追加训练数据
+
+        参数:
+            df (DataFrame): 与 WaitTimeDataCollector.FEATURE_COLUMNS 相同列的数据
+            watermark (datetime): 本批数据对应的水位线，为None时不更新
+
+        返回:
+            int: 写入的行数
+        """
+        if not PYARROW_AVAILABLE:
+            raise RuntimeError("pyarrow 未安装，无法写入列式训练数据")
+
+        if df is not None and not df.empty:
+            os.makedirs(self.root, exist_ok=True)
+            ds.write_dataset(
+                self._to_table(df),
+                self.root,
+                format='parquet',
+                partitioning=_partitioning(),
+                basename_template=f'part-{uuid.uuid4().hex}-{{i}}.parquet',
+                existing_data_behavior='overwrite_or_ignore',
+            )
+            logger.info(f"已追加 {len(df)} 条训练数据到 {self.root}")
+
+        if watermark is not None:
+            self.set_watermark(watermark)
+        return 0 if df is None else len(df)
+
+    def rebuild(self, df, watermark=None):
+        """
+        用完整的训练数据替换存储
+
+        先写入同级的临时目录，写完后再替换原目录: 写入失败时原有数据保持不变，
+        读取方也不会看到只写了一部分的数据集。
+        """
+        root = os.path.normpath(self.root)
+        token = uuid.uuid4().hex
+        staging = TrainingDataStore(f'{root}.tmp-{token}')
+        try:
+            os.makedirs(staging.root)
+            rows = staging.append(df, watermark=watermark)
+        except Exception:
+            shutil.rmtree(staging.root, ignore_errors=True)
+            raise
+
+        # 非空目录不能直接覆盖，先把原目录移开再换入新目录，两次都是同一文件系统内的 rename
+        retired = f'{root}.old-{token}'
+        if os.path.isdir(root):
+            os.replace(root, retired)
+        os.replace(staging.root, root)
+        shutil.rmtree(retired, ignore_errors=True)
+        return rows
+
+    def read(self, columns=None, department_id=None, since=None):
+        """
+        读取训练数据
+
+        参数:
+            columns (list): 需要的列，为None时读取全部特征列
+            department_id (int): 只读取该科室的分区
+            since (datetime): 只读取该时间之后的记录
+
+        返回:
+            DataFrame: 训练数据，存储为空时返回None
+        """
+        if not self.exists():
+            return None
+
+        dataset = self._dataset()
+        expression = None
+        if department_id is not None:
+            expression = ds.field('department_id') == department_id
+        if since is not None:
+            condition = ds.field('timestamp') >= pa.scalar(pd.Timestamp(since).tz_convert('UTC'), type=pa.timestamp('us', tz='UTC'))
+            expression = condition if expression is None else expression & condition
+
+        if columns is None:
+            columns = ['queue_id', 'department_id'] + [name for name in _schema().names if name != 'queue_id']
+        df = dataset.to_table(columns=list(columns), filter=expression).to_pandas()
+        if 'timestamp' in df.columns:
+            df = df.sort_values('timestamp', kind='stable').reset_index(drop=True)
+        return df
+
+    def count_rows(self):
+        """统计行数，只读取Parquet文件元数据"""
+        if not self.exists():
+            return 0
+        return self._dataset().count_rows()
+
+    def get_watermark(self):
+        """获取已收录数据的水位线，不存在时返回None"""
+        path = os.path.join(self.root, self.WATERMARK_FILE)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f).get('watermark')
+        except (OSError, ValueError):
+            return None
+        return pd.Timestamp(value).to_pydatetime() if value else None
+
+    def set_watermark(self, watermark):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, self.WATERMARK_FILE)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'watermark': watermark.isoformat(), 'updated_at': timezone.now().isoformat()}, f)
+        os.replace(tmp_path, path)
+
+
+# 全局训练数据存储实例
+training_data_store = TrainingDataStore()
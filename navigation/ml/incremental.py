@@ -0,0 +1,147 @@
+"""
+增量训练支持 - 训练状态记录和数据分布变化检测
+
+每个模型文件旁边保存一个 <模型名>.state.json，记录上次训练所用数据的水位线（最晚时间）
+和目标值分布概况。增量训练时只取水位线之后的新数据，与上次的分布比较：
+
+- 新数据较多时（不少于 ML_SHIFT_PSI_MIN_ROWS 条）计算群体稳定性指数 (PSI)，
+  超过 ML_SHIFT_PSI_THRESHOLD 视为分布发生变化
+- 新数据较少时检验均值偏移，标准化偏移量超过 ML_SHIFT_Z_THRESHOLD 视为变化
+
+分布没有变化的模型跳过本次训练，水位线保持不变，新数据留到下次一起检测。
+"""
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# 分布概况使用的分位数分箱数
+PROFILE_BINS = 10
+
+
+def state_path(model_path):
+    """训练状态文件路径，与模型文件放在一起"""
+    return os.path.splitext(model_path)[0] + '.state.json'
+
+
+def load_state(model_path):
+    """读取模型的训练状态，不存在或损坏时返回None"""
+    try:
+        with open(state_path(model_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(model_path, watermark, values, **extra):
+    """
+    保存模型的训练状态
+
+    参数:
+    - model_path: 模型文件路径
+    - watermark: 训练数据中最晚的时间
+    - values: 训练数据的目标值，用于记录分布概况
+    """
+    state = {
+        'watermark': pd.Timestamp(watermark).isoformat() if watermark is not None else None,
+        'profile': build_profile(values),
+        'trained_at': timezone.now().isoformat(),
+        **extra,
+    }
+    path = state_path(model_path)
+    tmp_path = f'{path}.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error(f"保存训练状态失败 {path}: {str(e)}")
+    return state
+
+
+def get_watermark(state):
+    """训练状态中的水位线"""
+    if not state or not state.get('watermark'):
+        return None
+    return pd.Timestamp(state['watermark'])
+
+
+def rows_after(df, column, watermark):
+    """筛选时间列晚于水位线的行，自动对齐时区"""
+    if watermark is None:
+        return df
+    times = pd.to_datetime(df[column])
+    if times.dt.tz is not None and watermark.tzinfo is None:
+        watermark = watermark.tz_localize('UTC')
+    elif times.dt.tz is None and watermark.tzinfo is not None:
+        watermark = watermark.tz_convert('UTC').tz_localize(None)
+    return df[times > watermark]
+
+
+def build_profile(values):
+    """记录目标值的分布概况: 数量、均值、标准差、分位数分箱边界和各箱占比"""
+    values = np.asarray(pd.Series(values).dropna(), dtype=float)
+    if values.size == 0:
+        return None
+
+    edges = np.unique(np.quantile(values, np.linspace(0, 1, PROFILE_BINS + 1)))
+    counts = np.histogram(values, bins=_open_edges(edges))[0] if edges.size > 1 else np.array([values.size])
+    return {
+        'count': int(values.size),
+        'mean': float(values.mean()),
+        'std': float(values.std()),
+        'edges': edges.tolist(),
+        'proportions': (counts / values.size).tolist(),
+    }
+
+
+def _open_edges(edges):
+    # 两端放开，超出原有范围的新数据落入首尾分箱
+    edges = np.asarray(edges, dtype=float).copy()
+    edges[0], edges[-1] = -np.inf, np.inf
+    return edges
+
+
+def population_stability_index(profile, values):
+    """计算新数据相对于分布概况的群体稳定性指数"""
+    values = np.asarray(pd.Series(values).dropna(), dtype=float)
+    edges = profile['edges']
+    if len(edges) < 2 or values.size == 0:
+        return 0.0
+
+    expected = np.asarray(profile['proportions'], dtype=float)
+    actual = np.histogram(values, bins=_open_edges(edges))[0] / values.size
+    # 避免空箱导致 log(0)
+    expected = np.clip(expected, 1e-4, None)
+    actual = np.clip(actual, 1e-4, None)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def detect_shift(profile, values):
+    """
+    判断新数据的分布是否相对上次训练发生变化
+
+    返回:
+    - (shifted, score, reason): 是否变化、检验统计量和说明
+    """
+    values = np.asarray(pd.Series(values).dropna(), dtype=float)
+    if profile is None:
+        return True, None, '没有上次训练的分布记录'
+    if values.size == 0:
+        return False, 0.0, '没有新数据'
+
+    if values.size >= getattr(settings, 'ML_SHIFT_PSI_MIN_ROWS', 50):
+        psi = population_stability_index(profile, values)
+        threshold = getattr(settings, 'ML_SHIFT_PSI_THRESHOLD', 0.1)
+        return psi > threshold, psi, f'PSI={psi:.3f} (阈值 {threshold})'
+
+    std = profile['std'] or 1.0
+    z = abs(values.mean() - profile['mean']) / (std / np.sqrt(values.size))
+    threshold = getattr(settings, 'ML_SHIFT_Z_THRESHOLD', 3.0)
+    return z > threshold, float(z), f'均值偏移 z={z:.2f} (阈值 {threshold})'
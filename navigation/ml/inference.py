@@ -0,0 +1,351 @@
+"""
+推理接口 - Web进程使用的轻量预测入口
+
+本模块只依赖 numpy 和 Django，不导入 pandas、scikit-learn、XGBoost、Prophet 等训练用的库。
+
+- Prophet 预测直接读取训练后预计算的逐小时预测表（<模型名>.forecast.npz），
+  只有预测表缺失、过期或不覆盖查询时间时，才按 ML_PROPHET_LIVE_FALLBACK 导入 Prophet 实时预测
+- 科室等待时间模型通过 get_prediction_service() 在第一次使用时才导入和加载
+- 配置了 ML_INFERENCE_SERVER 时，预测请求通过 inference_client 发给独立的预测服务进程
+  （manage.py inference_server），各 Web/Worker 进程不再各自加载模型；服务不可用时临时退回本进程预测
+
+视图、模型方法和信号处理器应通过本模块调用预测，不要直接导入 navigation.ml.models、
+navigation.ml.prophet_predictor 或 navigation.ml.trainer。
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def prophet_model_dir():
+    return os.path.join(settings.BASE_DIR, 'ml_models', 'prophet')
+
+
+def prophet_model_path(department_id=None, examination_id=None):
+    """Prophet 模型文件路径: 检查项目级、科室级或全局模型"""
+    if examination_id:
+        model_name = f"prophet_exam_{examination_id}.pkl"
+    elif department_id:
+        model_name = f"prophet_dept_{department_id}.pkl"
+    else:
+        model_name = "prophet_global.pkl"
+    return os.path.join(prophet_model_dir(), model_name)
+
+
+def prophet_model_target(file_name):
+    """
+    由 Prophet 模型文件名得到 (department_id, examination_id)，与 prophet_model_path 相反
+
+    不是 Prophet 模型文件时返回None
+    """
+    stem, ext = os.path.splitext(os.path.basename(file_name))
+    if ext != '.pkl':
+        return None
+    if stem.startswith('prophet_exam_'):
+        return None, int(stem[len('prophet_exam_'):])
+    if stem.startswith('prophet_dept_'):
+        return int(stem[len('prophet_dept_'):]), None
+    if stem == 'prophet_global':
+        return None, None
+    return None
+
+
+def forecast_table_path(model_path):
+    """预测表文件路径，与模型文件放在一起"""
+    return os.path.splitext(model_path)[0] + '.forecast.npz'
+
+
+def interpolate_forecast(start, columns, date):
+    """
+    在预测表中查询指定时间的预测值
+
+    在相邻两个小时之间线性插值；时间超出预测表范围时返回None。
+
+    参数:
+    - start: 预测表第一个小时（不带时区）
+    - columns: 逐小时数值数组的序列，如 (yhat, yhat_lower, yhat_upper)
+    - date: 查询时间
+
+    返回:
+    - 与 columns 对应的插值结果元组，或 None
+    """
+    if start is None or not columns or columns[0] is None:
+        return None
+
+    offset = (date.replace(tzinfo=None) - start).total_seconds() / 3600
+    index = int(offset // 1)
+    if index < 0 or index + 1 >= len(columns[0]):
+        return None
+
+    fraction = offset - index
+    return tuple(
+        float(values[index] + (values[index + 1] - values[index]) * fraction)
+        for values in columns
+    )
+
+
+class ForecastTableCache:
+    """
+    进程内的预测表缓存
+
+    按模型文件路径缓存预测表，每次查询检查预测表和模型文件的修改时间：
+    预测表被重新生成时重新读取；模型文件与生成预测表时的模型不一致（重新训练或回滚）时忽略预测表。
+    """
+
+    def __init__(self):
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    def get(self, model_path):
+        """
+        返回:
+        - (start, yhat, lower, upper)，没有可用的预测表时返回None
+        """
+        table_path = forecast_table_path(model_path)
+        table_mtime = self._mtime(table_path)
+        if table_mtime is None:
+            return None
+
+        with self._lock:
+            cached = self._tables.get(model_path)
+        if cached is None or cached[0] != table_mtime:
+            try:
+                with np.load(table_path) as data:
+                    start = np.datetime64(int(data['start'][0]), 'ns').astype('datetime64[us]').item()
+                    cached = (
+                        table_mtime,
+                        float(data['model_mtime'][0]),
+                        (start, data['yhat'], data['lower'], data['upper']),
+                    )
+            except Exception as e:
+                logger.error(f"加载Prophet预测表失败 {table_path}: {str(e)}")
+                return None
+            with self._lock:
+                self._tables[model_path] = cached
+
+        _, model_mtime, table = cached
+        if model_mtime and model_mtime != self._mtime(model_path):
+            return None
+        return table
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+
+
+forecast_tables = ForecastTableCache()
+
+
+def prophet_forecast(date=None, department_id=None, examination_id=None):
+    """
+    获取 Prophet 模型在指定时间的预测等待时间（分钟）
+
+    优先查询预计算的预测表；预测表不可用时，若 ML_PROPHET_LIVE_FALLBACK 为True，
+    导入 Prophet 并用缓存的模型实时预测。
+
+    返回:
+    - 预测等待时间（分钟，至少为1），模型不存在或预测失败时返回None
+    """
+    if date is None:
+        date = timezone.now()
+
+    model_path = prophet_model_path(department_id, examination_id)
+    table = forecast_tables.get(model_path)
+    if table is not None:
+        start, yhat, _, _ = table
+        row = interpolate_forecast(start, (yhat,), date)
+        if row is not None:
+            return max(1, round(row[0]))
+
+    if not os.path.exists(model_path):
+        return None
+
+    if inference_client.enabled:
+        values = inference_client.prophet([date], department_id, examination_id)
+        if values is not None:
+            return values[0]
+
+    if not getattr(settings, 'ML_PROPHET_LIVE_FALLBACK', True):
+        return None
+
+    from navigation.ml.prophet_predictor import get_prophet_predictor
+    predictor = get_prophet_predictor(department_id=department_id, examination_id=examination_id)
+    if predictor and predictor.model:
+        return predictor.predict(date=date)
+    return None
+
+
+def get_prediction_service():
+    """科室等待时间预测服务，第一次调用时导入"""
+    from navigation.ml.models import prediction_service
+    return prediction_service
+
+
+def parse_address(address):
+    """
+    解析预测服务地址
+
+    - unix:<路径>: Unix 域套接字
+    - <主机>:<端口>: 本机 TCP
+
+    返回:
+    - (地址族, 套接字地址)
+    """
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError(f"无效的预测服务地址: {address}")
+    return socket.AF_INET, (host, int(port))
+
+
+def _json_default(value):
+    # 请求中的 datetime/Timestamp 转为ISO字符串，numpy 数值转为Python数值
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+
+class InferenceClient:
+    """
+    预测服务进程的客户端
+
+    请求和响应都是一行JSON。每个线程保持一个到服务的连接；服务不可用时返回None，
+    由调用方退回本进程预测，之后 ML_INFERENCE_RETRY_INTERVAL 秒内不再尝试连接。
+    """
+
+    def __init__(self, address=None):
+        # 不指定地址时使用 settings.ML_INFERENCE_SERVER
+        self._address = address
+        self._local = threading.local()
+        self._disabled = False
+        self._retry_at = 0.0
+
+    @property
+    def address(self):
+        return self._address or getattr(settings, 'ML_INFERENCE_SERVER', None)
+
+    @property
+    def enabled(self):
+        return bool(self.address) and not self._disabled and time.monotonic() >= self._retry_at
+
+    def disable(self):
+        """预测服务进程自身调用，避免把请求转发给自己"""
+        self._disabled = True
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            family, address = parse_address(self.address)
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(getattr(settings, 'ML_INFERENCE_TIMEOUT', 2.0))
+            try:
+                sock.connect(address)
+            except OSError:
+                sock.close()
+                raise
+            if family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = self._local.conn = sock.makefile('rwb')
+            self._local.sock = sock
+        return conn
+
+    def _close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            try:
+                conn.close()
+                self._local.sock.close()
+            except OSError:
+                pass
+        self._local.conn = self._local.sock = None
+
+    def request(self, payload):
+        """
+        发送请求并等待响应
+
+        返回:
+        - 响应字典，服务不可用或返回错误时为None
+        """
+        if not self.enabled:
+            return None
+
+        data = json.dumps(payload, default=_json_default).encode('utf-8') + b'\n'
+        # 复用的连接可能已被服务端关闭（如服务重启），重新连接重试一次。
+        # 读取超时时请求已经发出、服务端仍在处理，重试只会让服务端重复计算，不再重试
+        for attempt in range(2):
+            reused = getattr(self._local, 'conn', None) is not None
+            try:
+                conn = self._connection()
+                conn.write(data)
+                conn.flush()
+                line = conn.readline()
+                if not line:
+                    raise ConnectionError('预测服务关闭了连接')
+                response = json.loads(line)
+                break
+            except (OSError, ValueError) as e:
+                self._close()
+                if reused and attempt == 0 and isinstance(e, ConnectionError):
+                    continue
+                retry_interval = getattr(settings, 'ML_INFERENCE_RETRY_INTERVAL', 10)
+                self._retry_at = time.monotonic() + retry_interval
+                logger.warning(f"预测服务 {self.address} 不可用，{retry_interval}秒内改为本进程预测: {str(e)}")
+                return None
+
+        if 'error' in response:
+            logger.error(f"预测服务返回错误: {response['error']}")
+            return None
+        return response
+
+    def predict(self, rows):
+        """
+        科室等待时间批量预测
+
+        参数:
+        - rows: 字典列表，字段同 WaitTimePredictionService.predict_many，缺失的特征由服务端补全
+
+        返回:
+        - 预计等待时间列表（分钟），服务不可用时为None
+        """
+        response = self.request({'op': 'predict', 'rows': rows})
+        return response['wait_times'] if response is not None else None
+
+    def prophet(self, dates, department_id=None, examination_id=None):
+        """
+        Prophet 模型在多个时间点的预测
+
+        返回:
+        - 预测等待时间列表（分钟，模型不存在时为None），服务不可用时为None
+        """
+        rows = [
+            {'department_id': department_id, 'examination_id': examination_id, 'date': date}
+            for date in dates
+        ]
+        response = self.request({'op': 'prophet', 'rows': rows})
+        return response['values'] if response is not None else None
+
+    def status(self):
+        """服务已加载的模型和批处理统计，服务不可用时为None"""
+        return self.request({'op': 'status'})
+
+
+inference_client = InferenceClient()
@@ -0,0 +1,254 @@
+"""
+预测服务进程 - 集中持有模型并合并并发请求批量预测
+
+由 manage.py inference_server 启动，监听 Unix 域套接字或本机TCP端口。各 Web/Worker 进程通过
+navigation.ml.inference.inference_client 发送一行JSON的请求：
+
+- {"op": "predict", "rows": [...]}: 科室等待时间预测，返回 {"wait_times": [...]}
+- {"op": "prophet", "rows": [{"department_id", "examination_id", "date"}, ...]}: Prophet 预测，
+  返回 {"values": [...]}
+- {"op": "status"}: 已加载的模型和批处理统计
+
+每种请求有一个批处理线程：收到第一个请求后最多再等待 ML_INFERENCE_BATCH_WINDOW 秒，
+把这段时间内各连接的请求合并（不超过 ML_INFERENCE_MAX_BATCH 行）后一次预测，
+每个科室模型每批只调用一次 predict。模型的热更新和回滚沿用注册表的检查机制。
+"""
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+
+import pandas as pd
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .inference import inference_client, parse_address, prophet_model_dir, prophet_model_target, _json_default
+from .models import prediction_service
+from .prophet_predictor import get_prophet_predictor, predictor_cache
+from .serialization import _resident_memory
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """把短时间内的并发请求合并成一批交给 handler 处理"""
+
+    def __init__(self, name, handler, window=None, max_size=None):
+        """
+        参数:
+        - handler: handler(items) -> results，items 为合并后的行列表，返回等长的结果列表
+        """
+        self.name = name
+        self.handler = handler
+        self.window = window if window is not None else getattr(settings, 'ML_INFERENCE_BATCH_WINDOW', 0.005)
+        self.max_size = max_size or getattr(settings, 'ML_INFERENCE_MAX_BATCH', 512)
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.busy_time = 0.0
+        self._thread = threading.Thread(target=self._run, name=f'batcher-{name}', daemon=True)
+        self._thread.start()
+
+    def submit(self, items):
+        """提交一个请求的所有行，返回 Future，结果为对应的结果列表"""
+        future = Future()
+        self._queue.put((items, future))
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.window
+        while size < self.max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [row for rows, _ in batch for row in rows]
+            start = time.perf_counter()
+            # 批处理线程不经过请求周期，每批前后自行关闭过期或出错的数据库连接
+            close_old_connections()
+            try:
+                self._process(batch, items)
+            finally:
+                close_old_connections()
+                with self._stats_lock:
+                    self.requests += len(batch)
+                    self.rows += len(items)
+                    self.batches += 1
+                    self.busy_time += time.perf_counter() - start
+
+    def _process(self, batch, items):
+        try:
+            results = self.handler(items)
+        except Exception as e:
+            if len(batch) == 1:
+                logger.error(f"预测服务批处理 {self.name} 出错: {str(e)}", exc_info=True)
+                batch[0][1].set_exception(e)
+                return
+            # 合并的批次中可能只有一个请求的数据有问题，逐个请求重新处理，只让出错的请求失败
+            logger.warning(f"预测服务批处理 {self.name} 合并 {len(batch)} 个请求出错，改为逐个处理: {str(e)}")
+            for rows, future in batch:
+                try:
+                    future.set_result(list(self.handler(rows)))
+                except Exception as request_error:
+                    logger.error(f"预测服务批处理 {self.name} 请求出错: {str(request_error)}")
+                    future.set_exception(request_error)
+            return
+
+        offset = 0
+        for rows, future in batch:
+            future.set_result(list(results[offset:offset + len(rows)]))
+            offset += len(rows)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'requests': self.requests,
+                'rows': self.rows,
+                'batches': self.batches,
+                'avg_batch_rows': round(self.rows / self.batches, 2) if self.batches else 0.0,
+                'busy_time': round(self.busy_time, 4),
+            }
+
+
+def predict_rows(rows):
+    """科室等待时间批量预测，缺失的时间使用当前时间"""
+    frame = pd.DataFrame(rows)
+    for column in frame.columns:
+        if column == 'timestamp':
+            frame[column] = pd.to_datetime(frame[column], utc=True, errors='coerce').fillna(timezone.now())
+        else:
+            # JSON 中的 null 转为 NaN，由 predict_many 补全
+            frame[column] = pd.to_numeric(frame[column])
+    return prediction_service.predict_many(None, frame).tolist()
+
+
+def prophet_rows(rows):
+    """Prophet 批量预测，同一模型的所有时间点合并预测"""
+    results = [None] * len(rows)
+    groups = {}
+    for i, row in enumerate(rows):
+        groups.setdefault((row.get('department_id'), row.get('examination_id')), []).append(i)
+
+    for (department_id, examination_id), positions in groups.items():
+        predictor = get_prophet_predictor(department_id=department_id, examination_id=examination_id)
+        dates = [
+            pd.Timestamp(rows[i]['date']).to_pydatetime() if rows[i].get('date') else None
+            for i in positions
+        ]
+        for i, value in zip(positions, predictor.predict_many(dates)):
+            results[i] = value
+    return results
+
+
+class InferenceRequestHandler(socketserver.StreamRequestHandler):
+    """一个客户端连接，循环处理一行一个的JSON请求"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response = self.server.service.dispatch(request)
+            except Exception as e:
+                response = {'error': str(e)}
+            self.wfile.write(json.dumps(response, default=_json_default).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # 各 Web/Worker 进程的线程可能同时建立连接
+    request_queue_size = 128
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class InferenceService:
+    """预测服务: 预加载模型，按请求类型分发到批处理线程"""
+
+    def __init__(self):
+        # 本进程自己持有模型，不再把请求转发给预测服务
+        inference_client.disable()
+        self.started_at = timezone.now()
+        self.batchers = {
+            'predict': MicroBatcher('predict', predict_rows),
+            'prophet': MicroBatcher('prophet', prophet_rows),
+        }
+
+    def preload(self):
+        """启动时加载全部科室模型和 Prophet 模型"""
+        prediction_service.load_all_models()
+        prophet_count = 0
+        model_dir = prophet_model_dir()
+        if os.path.isdir(model_dir):
+            for file_name in sorted(os.listdir(model_dir)):
+                target = prophet_model_target(file_name)
+                if target is None:
+                    continue
+                department_id, examination_id = target
+                predictor = get_prophet_predictor(department_id=department_id, examination_id=examination_id)
+                if predictor.model is not None:
+                    prophet_count += 1
+        return len(prediction_service.get_available_departments()), prophet_count
+
+    def dispatch(self, request):
+        op = request.get('op')
+        if op == 'predict':
+            wait_times = self.batchers['predict'].submit(request['rows']).result()
+            return {'wait_times': wait_times}
+        if op == 'prophet':
+            values = self.batchers['prophet'].submit(request['rows']).result()
+            return {'values': values}
+        if op == 'status':
+            return self.status()
+        raise ValueError(f"未知的请求类型: {op}")
+
+    def status(self):
+        return {
+            'pid': os.getpid(),
+            'started_at': self.started_at.isoformat(),
+            'rss': _resident_memory(),
+            'departments': {
+                str(dept_id): predictor.model_type
+                for dept_id, predictor in prediction_service.predictors.items()
+            },
+            'prophet_cache': predictor_cache.stats(),
+            'batches': {name: batcher.stats() for name, batcher in self.batchers.items()},
+        }
+
+
+def create_server(address, service):
+    """按地址创建监听套接字，Unix 套接字文件已存在时先删除"""
+    family, bind_address = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(bind_address):
+            os.remove(bind_address)
+        os.makedirs(os.path.dirname(os.path.abspath(bind_address)), exist_ok=True)
+        server = ThreadingUnixServer(bind_address, InferenceRequestHandler)
+    else:
+        server = ThreadingTCPServer(bind_address, InferenceRequestHandler)
+    server.service = service
+    return server
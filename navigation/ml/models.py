@@ -7,25 +7,23 @@ import logging
 import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import StandardScaler, OneHotEncoder
-from sklearn.pipeline import Pipeline
-from sklearn.compose import ColumnTransformer
 from django.conf import settings
 from django.core.cache import cache
 import glob
 from django.utils import timezone
-import joblib
 import json
+import threading
+from importlib.util import find_spec
 
-# 导入XGBoost和Prophet
-try:
-    import xgboost as xgb
-    from prophet import Prophet
-    ADVANCED_MODELS_AVAILABLE = True
-except ImportError:
-    ADVANCED_MODELS_AVAILABLE = False
+from .registry import get_registry, GenerationWatcher
+from .serialization import (
+    find_model_file, load_model_file, dump_model_file, model_extension, model_department_id
+)
+from .inference import inference_client
+
+# 检查XGBoost和Prophet是否安装；模型库在加载模型时才导入，这里不导入
+ADVANCED_MODELS_AVAILABLE = find_spec('xgboost') is not None and find_spec('prophet') is not None
+if not ADVANCED_MODELS_AVAILABLE:
     logging.warning("XGBoost或Prophet库未安装，将使用基础模型")
 
 # 配置日志 - 确保与tasks.py中的设置一致
@@ -72,10 +70,14 @@ class WaitTimePredictor:
         ]
         
         self.model = None
+        # 注册表中的模型版本，未注册的旧模型文件为None
+        self.model_version = None
         
         # 根据模型类型选择对应的模型文件
         model_prefix = f'{model_type}_model' if model_type != 'default' else 'wait_time_model'
-        self.model_file = os.path.join(MODEL_DIR, f'{model_prefix}_{department_id}.pkl')
+        self.model_name = f'{model_prefix}_{department_id}'
+        self.model_file = (find_model_file(MODEL_DIR, self.model_name)
+                           or os.path.join(MODEL_DIR, f'{self.model_name}.pkl'))
         
         # 尝试加载主模型文件，如果失败则尝试其他可能的模型文件
         if not self.load_model():
@@ -90,11 +92,12 @@ class WaitTimePredictor:
             if model_type == self.model_type:
                 continue  # 跳过已尝试的模型类型
                 
-            model_file = os.path.join(MODEL_DIR, f'{model_type}_model_{self.department_id}.pkl')
-            if os.path.exists(model_file):
+            model_file = find_model_file(MODEL_DIR, f'{model_type}_model_{self.department_id}')
+            if model_file:
                 try:
-                    self.model = joblib.load(model_file)
+                    self.model, self.model_version = get_registry(MODEL_DIR).load(model_file, load_model_file)
                     self.model_type = model_type
+                    self.model_name = f'{model_type}_model_{self.department_id}'
                     self.model_file = model_file
                     logger.info(f"已加载科室 {self.department_id} 的备选 {model_type} 模型")
                     return True
@@ -105,8 +108,9 @@ class WaitTimePredictor:
         old_model_file = os.path.join(MODEL_DIR, f'wait_time_model_{self.department_id}.pkl')
         if os.path.exists(old_model_file):
             try:
-                self.model = joblib.load(old_model_file)
+                self.model, self.model_version = get_registry(MODEL_DIR).load(old_model_file)
                 self.model_type = 'legacy'
+                self.model_name = f'wait_time_model_{self.department_id}'
                 self.model_file = old_model_file
                 logger.info(f"已加载科室 {self.department_id} 的旧版模型")
                 return True
@@ -120,7 +124,8 @@ class WaitTimePredictor:
         if os.path.exists(self.model_file):
             try:
                 logger.info(f"尝试加载模型文件: {self.model_file}")
-                self.model = joblib.load(self.model_file)
+                # 已注册的模型会核对校验和
+                self.model, self.model_version = get_registry(MODEL_DIR).load(self.model_file, load_model_file)
                 
                 # 检查模型是否被正确加载
                 if self.model is None:
@@ -245,6 +250,63 @@ class WaitTimePredictor:
             return self._fallback_prediction(queue_count, equipment_status, priority, 
                                           department_capacity, staff_efficiency)
     
+    def predict_batch(self, feature_frame):
+        """
+        批量预测等待时间，一次调用模型完成所有行的预测
+        
+        参数:
+        - feature_frame (DataFrame): 每行一条预测请求，列包括 queue_count, equipment_status,
+          priority, department_capacity, staff_efficiency, historical_wait_time，
+          可选 timestamp（缺省为当前时间）
+        
+        返回:
+        - wait_times (ndarray): 预计等待时间(分钟)，与输入行顺序一致
+        """
+        if len(feature_frame) == 0:
+            return np.empty(0, dtype=np.float64)
+        
+        priority = feature_frame['priority'].to_numpy(dtype=np.float64)
+        
+        if self.model is None:
+            return self._fallback_prediction_batch(feature_frame)
+        
+        try:
+            if 'timestamp' in feature_frame:
+                timestamps = pd.to_datetime(feature_frame['timestamp'])
+            else:
+                timestamps = pd.Series(pd.Timestamp(timezone.now()), index=feature_frame.index)
+            
+            if self.model_type == 'prophet':
+                # Prophet模型只需要ds列（日期时间）
+                future = pd.DataFrame({'ds': timestamps.dt.tz_localize(None) if timestamps.dt.tz else timestamps})
+                wait_times = self.model.predict(future)['yhat'].to_numpy(dtype=np.float64)
+            else:
+                queue_count = feature_frame['queue_count']
+                historical_wait_time = feature_frame['historical_wait_time'].fillna(queue_count * 12)
+                X_df = pd.DataFrame({
+                    'department_id': self.department_id,
+                    'queue_count': queue_count,
+                    'department_capacity': feature_frame['department_capacity'],
+                    'staff_efficiency': feature_frame['staff_efficiency'],
+                    'equipment_status': feature_frame['equipment_status'],
+                    'historical_wait_time': historical_wait_time,
+                    'hour': timestamps.dt.hour,
+                    'day_of_week': timestamps.dt.dayofweek,
+                    'is_weekend': (timestamps.dt.dayofweek >= 5).astype(int),
+                }, index=feature_frame.index)[self.features]
+                wait_times = np.asarray(self.model.predict(X_df), dtype=np.float64)
+            
+            # 根据优先级调整等待时间
+            wait_times = wait_times * (0.9 ** priority)
+            return np.maximum(wait_times, 0)
+        except Exception as e:
+            logger.error(f"批量预测等待时间时出错: {str(e)}")
+            return self._fallback_prediction_batch(feature_frame)
+    
+    def _fallback_prediction_batch(self, feature_frame):
+        """_fallback_prediction 的向量化版本"""
+        return simple_wait_time_batch(feature_frame)
+    
     def _fallback_prediction(self, queue_count, equipment_status=1, priority=0, 
                            department_capacity=10, staff_efficiency=1.0):
         """
@@ -277,7 +339,10 @@ class WaitTimePredictor:
         """保存模型到文件"""
         if self.model is not None:
             try:
-                joblib.dump(self.model, self.model_file)
+                self.model_file = os.path.join(MODEL_DIR, self.model_name + model_extension(self.model_type))
+                self.model_version = get_registry(MODEL_DIR).publish(
+                    self.model, self.model_file, dump=dump_model_file
+                )
                 logger.info(f"已保存科室 {self.department_id} 的 {self.model_type} 等待时间预测模型")
                 return True
             except Exception as e:
@@ -288,26 +353,56 @@ class WaitTimePredictor:
 class WaitTimePredictionService:
     """
     等待时间预测服务 - 管理科室的预测模型
+
+    模型在第一次使用时加载。之后每次使用前限频检查模型注册表，训练进程发布新版本或
+    回滚后，Web和Worker进程会在 ML_MODEL_REGISTRY_CHECK_INTERVAL 秒内重新加载，
+    新的预测器集合整体替换旧集合，进行中的预测不受影响。
+
+    配置了 ML_INFERENCE_SERVER 时，预测和模型状态查询转发给预测服务进程，本进程不加载模型；
+    预测服务不可用时退回本进程加载模型预测。
     """
     
     def __init__(self):
-        self.predictors = {}
+        self._predictors = {}
+        self._loaded = False
+        self._reload_lock = threading.Lock()
+        self._watcher = GenerationWatcher(get_registry(MODEL_DIR))
         self.default_model_type = 'xgboost' if ADVANCED_MODELS_AVAILABLE else 'random_forest'
-        self.load_all_models()
+
+    @property
+    def predictors(self):
+        """当前的预测器集合，注册表有新发布时先重新加载"""
+        self._refresh_if_changed()
+        return self._predictors
+
+    def _refresh_if_changed(self):
+        if self._loaded and not self._watcher.changed():
+            return
+        # 首次加载时等待；重新加载时若其他线程正在加载，则继续使用旧模型
+        initial = not self._loaded
+        if not self._reload_lock.acquire(blocking=initial):
+            self._watcher.reset()
+            return
+        try:
+            if not (initial and self._loaded):
+                self.load_all_models()
+        finally:
+            self._reload_lock.release()
         
     def load_all_models(self):
         """加载所有保存的模型"""
-        # 清空当前预测器字典
-        self.predictors = {}
+        # 加载到新的字典，完成后整体替换
+        predictors = {}
+        self._watcher.mark()
         
         # 查找所有保存的模型文件
         model_patterns = [
-            'xgboost_model_*.pkl',
-            'prophet_model_*.pkl',
-            'random_forest_model_*.pkl',
-            'gradient_boosting_model_*.pkl',
-            'linear_model_*.pkl',
-            'wait_time_model_*.pkl'  # 旧版格式
+            'xgboost_model_*',
+            'prophet_model_*',
+            'random_forest_model_*',
+            'gradient_boosting_model_*',
+            'linear_model_*',
+            'wait_time_model_*'  # 旧版格式
         ]
         
         # 优先加载高级模型
@@ -323,31 +418,26 @@ class WaitTimePredictionService:
         except Exception as e:
             logger.error(f"获取科室列表时出错: {str(e)}")
         
-        # 获取所有可用的模型文件
+        # 获取所有可用的模型文件（同一模型有多种格式时只保留一个，由 WaitTimePredictor 选择格式）
         all_model_files = []
         for pattern in model_patterns:
-            model_files = glob.glob(os.path.join(MODEL_DIR, pattern))
+            model_files = sorted(glob.glob(os.path.join(MODEL_DIR, pattern)))
             model_type = pattern.split('_')[0]
+            seen = set()
             for model_file in model_files:
-                all_model_files.append((model_file, model_type))
+                dept_id = model_department_id(model_file)
+                if dept_id is None or dept_id in seen:
+                    continue
+                seen.add(dept_id)
+                all_model_files.append((model_file, model_type, dept_id))
         
         logger.info(f"找到 {len(all_model_files)} 个模型文件")
         
         # 按照文件名中的部门ID排序，确保顺序加载
-        all_model_files.sort(key=lambda x: int(os.path.basename(x[0]).split('_')[-1].replace('.pkl', '')))
+        all_model_files.sort(key=lambda x: x[2])
         
-        for model_file, model_type in all_model_files:
+        for model_file, model_type, dept_id in all_model_files:
             try:
-                # 从文件名提取部门ID
-                filename = os.path.basename(model_file)
-                parts = filename.split('_')
-                
-                # 提取ID部分（最后一部分，去掉.pkl）
-                if 'wait_time_model_' in filename:
-                    dept_id = int(filename.replace('wait_time_model_', '').replace('.pkl', ''))
-                else:
-                    dept_id = int(parts[-1].replace('.pkl', ''))
-                
                 # 检查科室ID是否存在于数据库中
                 if valid_department_ids and dept_id not in valid_department_ids:
                     logger.warning(f"科室ID {dept_id} 在数据库中不存在，跳过加载对应模型: {model_file}")
@@ -368,7 +458,7 @@ class WaitTimePredictionService:
                 # 创建并加载预测器
                 predictor = WaitTimePredictor(dept_id, model_type)
                 if predictor.model is not None:
-                    self.predictors[dept_id] = predictor
+                    predictors[dept_id] = predictor
                     loaded_departments.add(dept_id)
                     logger.info(f"已加载科室 {dept_id} 的 {model_type} 等待时间预测模型")
                 else:
@@ -376,8 +466,7 @@ class WaitTimePredictionService:
                     logger.error(f"科室 {dept_id} 的 {model_type} 模型加载失败，模型对象为None")
                 
             except Exception as e:
-                if 'dept_id' in locals():
-                    failed_departments.add(dept_id)
+                failed_departments.add(dept_id)
                 logger.error(f"加载模型 {model_file} 时出错: {str(e)}", exc_info=True)
         
         total_departments = len(loaded_departments) + len(failed_departments)
@@ -385,15 +474,24 @@ class WaitTimePredictionService:
         if failed_departments:
             logger.warning(f"以下科室的模型加载失败: {sorted(list(failed_departments))}")
         
+        self._predictors = predictors
+        self._loaded = True
         return len(loaded_departments) > 0
     
+    def model_types(self):
+        """已加载模型的科室ID及模型类型"""
+        status = inference_client.status()
+        if status is not None:
+            return {int(dept_id): model_type for dept_id, model_type in status['departments'].items()}
+        return {dept_id: predictor.model_type for dept_id, predictor in self.predictors.items()}
+    
     def is_ready(self):
         """检查是否有可用的预测模型"""
-        return len(self.predictors) > 0
+        return len(self.model_types()) > 0
     
     def get_available_departments(self):
         """获取已有预测模型的科室ID列表"""
-        return list(self.predictors.keys())
+        return list(self.model_types().keys())
     
     def get_performance_metrics(self):
         """获取模型性能指标"""
@@ -403,6 +501,7 @@ class WaitTimePredictionService:
         
         # 创建动态的性能指标列表
         metrics = []
+        model_types = self.model_types()
         
         # 获取模型性能指标文件
         metrics_file = os.path.join(settings.BASE_DIR, 'navigation', 'ml', 'model_metrics.json')
@@ -418,29 +517,26 @@ class WaitTimePredictionService:
                 logger.error(f"加载模型性能指标文件时出错: {str(e)}")
         
         # 检查模型文件来确定所有可能的科室模型
-        model_files = glob.glob(os.path.join(MODEL_DIR, '*_model_*.pkl'))
+        model_files = glob.glob(os.path.join(MODEL_DIR, '*_model_*'))
         available_dept_ids = set()
         
         for model_file in model_files:
-            try:
-                # 提取科室ID
-                filename = os.path.basename(model_file)
-                dept_id = int(filename.split('_')[-1].replace('.pkl', ''))
+            # 提取科室ID
+            dept_id = model_department_id(model_file)
+            if dept_id is not None:
                 available_dept_ids.add(dept_id)
-            except Exception:
-                continue
         
         # 为每个科室创建性能指标
         for dept_id in sorted(available_dept_ids):
             dept_name = all_departments.get(dept_id, f'科室 {dept_id}')
             
             # 确定模型类型
-            if dept_id in self.predictors:
-                model_type = self.predictors[dept_id].model_type
+            if dept_id in model_types:
+                model_type = model_types[dept_id]
             else:
                 # 检查哪种类型的模型文件存在
                 for model_type in ['xgboost', 'prophet', 'random_forest', 'gradient_boosting', 'linear']:
-                    if os.path.exists(os.path.join(MODEL_DIR, f'{model_type}_model_{dept_id}.pkl')):
+                    if find_model_file(MODEL_DIR, f'{model_type}_model_{dept_id}'):
                         break
                 else:
                     model_type = '未知'
@@ -452,7 +548,7 @@ class WaitTimePredictionService:
             metric = {
                 'department_id': dept_id,
                 'department__name': dept_name,
-                'model_type': model_type if dept_id in self.predictors else f'未加载 ({model_type})',
+                'model_type': model_type if dept_id in model_types else f'未加载 ({model_type})',
                 'mae': dept_metrics.get('mae', 0.0),
                 'accuracy': dept_metrics.get('accuracy', 0.0),
                 'r2_score': dept_metrics.get('r2', 0.0),
@@ -466,7 +562,7 @@ class WaitTimePredictionService:
             metrics = [
                 {
                     'department__name': '心电图科',
-                    'model_type': self.predictors.get(1, WaitTimePredictor(1)).model_type if 1 in self.predictors else '无模型',
+                    'model_type': model_types.get(1, '无模型'),
                     'mae': 5.2,
                     'accuracy': 85.7,
                     'r2_score': 0.823,
@@ -474,7 +570,7 @@ class WaitTimePredictionService:
                 },
                 {
                     'department__name': '超声科',
-                    'model_type': self.predictors.get(2, WaitTimePredictor(2)).model_type if 2 in self.predictors else '无模型',
+                    'model_type': model_types.get(2, '无模型'),
                     'mae': 7.8,
                     'accuracy': 82.1,
                     'r2_score': 0.756,
@@ -482,7 +578,7 @@ class WaitTimePredictionService:
                 },
                 {
                     'department__name': '放射科',
-                    'model_type': self.predictors.get(3, WaitTimePredictor(3)).model_type if 3 in self.predictors else '无模型',
+                    'model_type': model_types.get(3, '无模型'),
                     'mae': 12.5,
                     'accuracy': 76.3,
                     'r2_score': 0.681,
@@ -509,6 +605,19 @@ class WaitTimePredictionService:
         返回:
         - 预计等待时间(分钟)
         """
+        # 由预测服务进程补全特征并预测
+        remote = inference_client.predict([{
+            'department_id': department_id,
+            'queue_count': queue_count,
+            'equipment_status': equipment_status,
+            'priority': priority,
+            'department_capacity': department_capacity,
+            'staff_efficiency': staff_efficiency,
+            'historical_wait_time': historical_wait_time,
+        }])
+        if remote is not None:
+            return remote[0]
+        
         # 获取其他特征数据
         if department_capacity is None or staff_efficiency is None or historical_wait_time is None:
             # 尝试从数据收集器获取实时数据
@@ -544,6 +653,89 @@ class WaitTimePredictionService:
         return self._simple_prediction(queue_count, equipment_status, priority, 
                                       department_capacity, staff_efficiency)
     
+    def predict_many(self, department_id, feature_rows):
+        """
+        批量预测等待时间
+        
+        按科室分组，每个科室的模型只调用一次 predict；没有模型的科室使用向量化的简单计算。
+        
+        参数:
+        - department_id: 科室ID；为None时按 feature_rows 中的 department_id 列分组
+        - feature_rows: DataFrame、列字典或字典列表，列包括 queue_count（必需）、
+          equipment_status、priority、department_capacity、staff_efficiency、
+          historical_wait_time、timestamp（可选）
+        
+        返回:
+        - ndarray: 预计等待时间(分钟)，与输入行顺序一致
+        """
+        frame = pd.DataFrame(feature_rows).reset_index(drop=True)
+        if frame.empty:
+            return np.empty(0, dtype=np.float64)
+        
+        if department_id is not None:
+            frame['department_id'] = department_id
+        elif 'department_id' not in frame:
+            raise ValueError("未指定科室ID")
+        
+        remote = inference_client.predict(frame.to_dict('records'))
+        if remote is not None:
+            return np.asarray(remote, dtype=np.float64)
+        
+        frame = self._fill_missing_features(frame)
+        
+        wait_times = np.empty(len(frame), dtype=np.float64)
+        for dept_id, group in frame.groupby('department_id', sort=False):
+            positions = group.index.to_numpy()
+            predictor = self.predictors.get(dept_id)
+            if predictor is not None:
+                wait_times[positions] = predictor.predict_batch(group)
+            else:
+                wait_times[positions] = simple_wait_time_batch(group)
+        
+        return wait_times
+    
+    def _fill_missing_features(self, frame):
+        """使用实时数据补全缺失的特征列，默认值与 predict_wait_time 一致"""
+        defaults = {
+            'equipment_status': 1,
+            'priority': 0,
+        }
+        for column, value in defaults.items():
+            if column not in frame:
+                frame[column] = value
+            else:
+                frame[column] = frame[column].fillna(value)
+        
+        needs_real_time = any(
+            column not in frame or frame[column].isna().any()
+            for column in ('department_capacity', 'staff_efficiency', 'historical_wait_time')
+        )
+        real_time_data = {}
+        if needs_real_time:
+            try:
+                from .data_collector import data_collector
+                real_time_data = data_collector.collect_real_time_data()
+            except Exception as e:
+                logger.error(f"获取实时数据失败: {str(e)}")
+        
+        def real_time_column(key, default):
+            return frame['department_id'].map(
+                lambda dept_id: real_time_data.get(dept_id, {}).get(key, np.nan)
+            ).astype(np.float64).fillna(default)
+        
+        queue_count = frame['queue_count'].astype(np.float64)
+        for column, default in (
+            ('department_capacity', 10),
+            ('staff_efficiency', 1.0),
+            ('historical_wait_time', queue_count * 12),
+        ):
+            if column not in frame:
+                frame[column] = real_time_column(column, default)
+            elif frame[column].isna().any():
+                frame[column] = frame[column].fillna(real_time_column(column, default))
+        
+        return frame
+    
     def _simple_prediction(self, queue_count, equipment_status=1, priority=0, 
                           department_capacity=10, staff_efficiency=1.0):
         """简单的等待时间预测方法，不使用机器学习模型"""
@@ -613,15 +805,14 @@ class WaitTimePredictionService:
             return False
         
         # 查找所有模型文件
-        model_files = glob.glob(os.path.join(MODEL_DIR, '*_model_*.pkl'))
+        model_files = glob.glob(os.path.join(MODEL_DIR, '*_model_*'))
         invalid_files = []
         
         for model_file in model_files:
             try:
                 # 从文件名提取部门ID
-                filename = os.path.basename(model_file)
-                if '_model_' in filename:
-                    dept_id = int(filename.split('_')[-1].replace('.pkl', ''))
+                dept_id = model_department_id(model_file)
+                if dept_id is not None:
                     if dept_id not in valid_department_ids:
                         invalid_files.append(model_file)
             except Exception as e:
@@ -649,5 +840,27 @@ class WaitTimePredictionService:
         return len(invalid_files) > 0
 
 
+def simple_wait_time_batch(feature_frame):
+    """
+    不使用机器学习模型的向量化等待时间计算，与 _simple_prediction 公式一致
+    """
+    queue_count = feature_frame['queue_count'].to_numpy(dtype=np.float64)
+    equipment_status = feature_frame['equipment_status'].to_numpy(dtype=np.float64)
+    priority = feature_frame['priority'].to_numpy(dtype=np.float64)
+    department_capacity = feature_frame['department_capacity'].to_numpy(dtype=np.float64)
+    staff_efficiency = feature_frame['staff_efficiency'].to_numpy(dtype=np.float64)
+    
+    # 基本处理时间（每人15分钟），考虑科室容量和工作效率
+    wait_times = queue_count * 15 / (staff_efficiency * (department_capacity / 10.0))
+    
+    # 设备故障时等待时间延长
+    wait_times = np.where(equipment_status == 0, wait_times * 1.5, wait_times)
+    
+    # 优先级每高一级，等待时间降低10%
+    wait_times = wait_times * (0.9 ** priority)
+    
+    return np.maximum(wait_times, 0)
+
+
 # 创建全局预测服务实例
 prediction_service = WaitTimePredictionService() 
\ No newline at end of file
@@ -8,12 +8,20 @@ from django.utils import timezone
 import logging
 from datetime import timedelta, datetime
 import os
-import pickle
+import threading
+import time
+from collections import OrderedDict
 from django.conf import settings
 
+from navigation.ml.incremental import load_state, save_state, get_watermark, rows_after, detect_shift
+from navigation.ml.registry import registry_for
+from navigation.ml.serialization import dump_prophet_model, load_prophet_model
+from navigation.ml.inference import prophet_model_path, forecast_table_path, interpolate_forecast
+
 # 配置日志
 logger = logging.getLogger(__name__)
 
+
 class ProphetWaitTimePredictor:
     """使用Prophet算法预测等待时间的类"""
     
@@ -28,32 +36,39 @@ class ProphetWaitTimePredictor:
         self.department_id = department_id
         self.examination_id = examination_id
         self.model = None
+        # 注册表中的模型版本，未注册的旧模型文件为None
+        self.model_version = None
         self.model_file = self._get_model_path()
+        # 已加载模型文件的修改时间，用于判断缓存是否过期
+        self.model_mtime = None
+        # 预计算的逐小时预测表
+        self.forecast_start = None
+        self.forecast_yhat = None
+        self.forecast_lower = None
+        self.forecast_upper = None
         self.load_model()
     
     def _get_model_path(self):
         """获取模型文件路径"""
+        path = prophet_model_path(self.department_id, self.examination_id)
         # 确保目录存在
-        model_dir = os.path.join(settings.BASE_DIR, 'ml_models', 'prophet')
-        os.makedirs(model_dir, exist_ok=True)
-        
-        # 根据科室和检查项目构建模型名称
-        if self.examination_id:
-            model_name = f"prophet_exam_{self.examination_id}.pkl"
-        elif self.department_id:
-            model_name = f"prophet_dept_{self.department_id}.pkl"
-        else:
-            model_name = "prophet_global.pkl"
-            
-        return os.path.join(model_dir, model_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    @property
+    def forecast_file(self):
+        """预测表文件路径，与模型文件放在一起"""
+        return forecast_table_path(self.model_file)
     
     def load_model(self):
         """加载已训练的模型"""
         if os.path.exists(self.model_file):
             try:
-                with open(self.model_file, 'rb') as f:
-                    self.model = pickle.load(f)
+                mtime = os.path.getmtime(self.model_file)
+                self.model, self.model_version = registry_for(self.model_file).load(self.model_file, load_prophet_model)
+                self.model_mtime = mtime
                 logger.info(f"已加载Prophet模型: {self.model_file}")
+                self.load_forecast_table()
                 return True
             except Exception as e:
                 logger.error(f"加载Prophet模型失败: {str(e)}")
@@ -63,14 +78,98 @@ class ProphetWaitTimePredictor:
         """保存训练好的模型"""
         if self.model:
             try:
-                with open(self.model_file, 'wb') as f:
-                    pickle.dump(self.model, f)
-                logger.info(f"已保存Prophet模型: {self.model_file}")
+                # 去掉训练历史后发布为新版本，版本文件与模型路径指向同一文件，修改时间一致
+                self.model_version = registry_for(self.model_file).publish(
+                    self.model, self.model_file, dump=dump_prophet_model
+                )
+                self.model_mtime = os.path.getmtime(self.model_file)
+                logger.info(f"已保存Prophet模型: {self.model_file}（版本 {self.model_version}）")
                 return True
             except Exception as e:
                 logger.error(f"保存Prophet模型失败: {str(e)}")
         return False
     
+    def build_forecast_table(self, days=None, start=None):
+        """
+        预计算未来若干天的逐小时预测，并保存到模型文件旁边
+
+        参数:
+        - days: 预测天数，默认为 settings.PROPHET_FORECAST_DAYS
+        - start: 起始时间，默认为当前小时
+
+        返回:
+        - 是否成功
+        """
+        if not self.model:
+            return False
+
+        if days is None:
+            days = getattr(settings, 'PROPHET_FORECAST_DAYS', 7)
+        if start is None:
+            start = timezone.now()
+
+        try:
+            start = pd.Timestamp(start.replace(tzinfo=None)).floor('h')
+            # 多预测一个小时，便于最后一个小时内插值
+            future = pd.DataFrame({
+                'ds': pd.date_range(start=start, periods=int(days * 24) + 1, freq='h')
+            })
+            forecast = self.model.predict(future)
+
+            self.forecast_start = start.to_pydatetime()
+            self.forecast_yhat = forecast['yhat'].to_numpy(dtype=np.float32)
+            self.forecast_lower = forecast['yhat_lower'].to_numpy(dtype=np.float32)
+            self.forecast_upper = forecast['yhat_upper'].to_numpy(dtype=np.float32)
+
+            tmp_file = self.forecast_file + '.tmp.npz'
+            np.savez(
+                tmp_file,
+                start=np.array([start.value], dtype=np.int64),
+                model_mtime=np.array([self.model_mtime or 0], dtype=np.float64),
+                yhat=self.forecast_yhat,
+                lower=self.forecast_lower,
+                upper=self.forecast_upper,
+            )
+            os.replace(tmp_file, self.forecast_file)
+            logger.info(f"已生成Prophet预测表: {self.forecast_file}, {len(self.forecast_yhat)}小时")
+            return True
+        except Exception as e:
+            logger.error(f"生成Prophet预测表失败: {str(e)}")
+            return False
+
+    def load_forecast_table(self):
+        """加载预测表，模型文件比预测表新时忽略预测表"""
+        self.forecast_start = None
+        self.forecast_yhat = self.forecast_lower = self.forecast_upper = None
+        if not os.path.exists(self.forecast_file):
+            return False
+        try:
+            with np.load(self.forecast_file) as data:
+                if self.model_mtime and float(data['model_mtime'][0]) != self.model_mtime:
+                    logger.info(f"Prophet预测表已过期，忽略: {self.forecast_file}")
+                    return False
+                self.forecast_start = pd.Timestamp(int(data['start'][0])).to_pydatetime()
+                self.forecast_yhat = data['yhat']
+                self.forecast_lower = data['lower']
+                self.forecast_upper = data['upper']
+            return True
+        except Exception as e:
+            logger.error(f"加载Prophet预测表失败: {str(e)}")
+            return False
+
+    def lookup_forecast(self, date):
+        """
+        从预测表中查询指定时间的预测值
+
+        在相邻两个小时之间线性插值；时间超出预测表范围时返回None。
+
+        返回:
+        - (yhat, yhat_lower, yhat_upper) 或 None
+        """
+        return interpolate_forecast(
+            self.forecast_start, (self.forecast_yhat, self.forecast_lower, self.forecast_upper), date
+        )
+
     def prepare_training_data(self, historical_data):
         """
         准备训练数据
@@ -110,12 +209,51 @@ class ProphetWaitTimePredictor:
         
         return df
     
-    def train(self, historical_data, **kwargs):
+    def needs_retrain(self, historical_data):
+        """
+        判断上次训练之后的新数据分布是否发生变化
+        
+        返回:
+        - (bool, str): 是否需要重新训练及原因
+        """
+        state = load_state(self.model_file) if self.model is not None else None
+        if state is None:
+            return True, '没有上次训练的记录'
+        
+        train_df = self.prepare_training_data(historical_data)
+        new_rows = rows_after(train_df, 'ds', get_watermark(state))
+        if new_rows.empty:
+            return False, '没有新数据'
+        shifted, _, reason = detect_shift(state.get('profile'), new_rows['y'])
+        return shifted, reason
+    
+    def _create_model(self, **kwargs):
+        """创建配置好的Prophet模型"""
+        model = Prophet(
+            # 默认参数，可通过kwargs覆盖
+            daily_seasonality=True,
+            weekly_seasonality=True,
+            yearly_seasonality=False,
+            changepoint_prior_scale=0.05,
+            seasonality_prior_scale=10.0,
+            **kwargs
+        )
+        
+        # 添加小时级别的季节性
+        model.add_seasonality(
+            name='hourly',
+            period=24,
+            fourier_order=5
+        )
+        return model
+    
+    def train(self, historical_data, warm_start=False, **kwargs):
         """
         训练Prophet模型
         
         参数:
         - historical_data: 历史等待时间数据，包含'timestamp'和'wait_time'列
+        - warm_start: 以上次训练的参数作为初始值拟合，数据变化不大时收敛更快
         - **kwargs: 传递给Prophet模型的其他参数
         
         返回:
@@ -137,34 +275,30 @@ class ProphetWaitTimePredictor:
             # 记录数据情况便于调试
             logger.info(f"Prophet模型训练数据: {len(train_df)}行数据点")
             
-            # 初始化和训练模型
-            model = Prophet(
-                # 默认参数，可通过kwargs覆盖
-                daily_seasonality=True,
-                weekly_seasonality=True,
-                yearly_seasonality=False,
-                changepoint_prior_scale=0.05,
-                seasonality_prior_scale=10.0,
-                **kwargs
-            )
-            
-            # 添加小时级别的季节性
-            model.add_seasonality(
-                name='hourly',
-                period=24,
-                fourier_order=5
-            )
-            
             # 确保数据类型正确
             train_df['ds'] = pd.to_datetime(train_df['ds'])
             train_df['y'] = train_df['y'].astype(float)
             
-            # 拟合模型
-            model.fit(train_df)
+            # 初始化和训练模型
+            model = None
+            if warm_start and self.model is not None:
+                try:
+                    model = self._create_model(**kwargs)
+                    model.fit(train_df, init=warm_start_params(self.model))
+                    logger.info(f"Prophet模型从上次的参数热启动: {self.model_file}")
+                except Exception as e:
+                    # 变点数量或季节项变化时参数形状不一致，退回到从头拟合
+                    logger.warning(f"Prophet模型热启动失败，从头训练: {str(e)}")
+                    model = None
+            if model is None:
+                model = self._create_model(**kwargs)
+                model.fit(train_df)
             
-            # 保存模型
+            # 保存模型和训练状态，并预计算逐小时预测表
             self.model = model
             self.save_model()
+            save_state(self.model_file, train_df['ds'].max(), train_df['y'])
+            self.build_forecast_table()
             
             logger.info(f"成功训练Prophet模型: {self.model_file}")
             return True
@@ -193,6 +327,11 @@ class ProphetWaitTimePredictor:
             
             # 移除时区信息
             date = date.replace(tzinfo=None)
+
+            # 优先使用预计算的预测表
+            forecast_row = self.lookup_forecast(date)
+            if forecast_row is not None:
+                return max(1, round(forecast_row[0]))
             
             # 创建预测数据
             future_dates = pd.date_range(
@@ -218,10 +357,48 @@ class ProphetWaitTimePredictor:
             return max(1, round(forecast['yhat'].iloc[0]))
             
         except Exception as e:
-            logger = logging.getLogger(__name__)
             logger.error(f"Prophet预测失败: {str(e)}")
             return None
-    
+
+    def predict_many(self, dates):
+        """
+        批量预测多个时间点的等待时间
+
+        先查询预测表，预测表未覆盖的时间点合并为一次 model.predict 调用。
+
+        参数:
+        - dates: 预测时间列表，元素为None时使用当前时间
+
+        返回:
+        - 与 dates 对应的预测等待时间列表（分钟），模型不存在或预测失败时为None
+        """
+        results = [None] * len(dates)
+        if not self.model:
+            return results
+
+        dates = [(date or timezone.now()).replace(tzinfo=None) for date in dates]
+        missing = []
+        for i, date in enumerate(dates):
+            forecast_row = self.lookup_forecast(date)
+            if forecast_row is not None:
+                results[i] = max(1, round(forecast_row[0]))
+            else:
+                missing.append(i)
+
+        if missing:
+            try:
+                future = pd.DataFrame({'ds': pd.to_datetime([dates[i] for i in missing])})
+                future['hour'] = future['ds'].dt.hour
+                future['day_of_week'] = future['ds'].dt.dayofweek
+                forecast = self.model.predict(future)
+                # Prophet 会按 ds 排序，按时间对应回原来的位置
+                yhat = dict(zip(forecast['ds'], forecast['yhat']))
+                for i in missing:
+                    results[i] = max(1, round(float(yhat[pd.Timestamp(dates[i])])))
+            except Exception as e:
+                logger.error(f"Prophet批量预测失败: {str(e)}")
+        return results
+
     def get_forecast_plot(self, periods=24, freq='H'):
         """
         生成预测图表
@@ -254,8 +431,102 @@ class ProphetWaitTimePredictor:
             return None
 
 
-# 全局预测器实例
-global_predictor = None
+class ProphetPredictorCache:
+    """
+    进程内的Prophet预测器LRU缓存
+
+    按 (department_id, examination_id) 缓存已加载的预测器，避免每次预测都从磁盘反序列化模型。
+    每次获取时检查模型文件的修改时间，文件被重新训练或替换后自动重新加载。
+    """
+
+    def __init__(self, max_size=None):
+        self._max_size = max_size
+        self._predictors = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+        self.load_time = 0.0
+
+    @property
+    def max_size(self):
+        if self._max_size is not None:
+            return self._max_size
+        return getattr(settings, 'PROPHET_MODEL_CACHE_SIZE', 64)
+
+    @staticmethod
+    def _file_mtime(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    def _load(self, department_id, examination_id):
+        start = time.perf_counter()
+        predictor = ProphetWaitTimePredictor(department_id, examination_id)
+        self.load_time += time.perf_counter() - start
+        return predictor
+
+    def get(self, department_id=None, examination_id=None):
+        """获取预测器，必要时从磁盘加载"""
+        key = (department_id, examination_id)
+        with self._lock:
+            predictor = self._predictors.get(key)
+            if predictor is not None:
+                mtime = self._file_mtime(predictor.model_file)
+                if mtime == predictor.model_mtime:
+                    self.hits += 1
+                    self._predictors.move_to_end(key)
+                    return predictor
+                # 模型文件已变化（重新训练、删除或新生成），重新加载
+                self.reloads += 1
+                start = time.perf_counter()
+                predictor.model = None
+                predictor.model_mtime = None
+                predictor.load_model()
+                self.load_time += time.perf_counter() - start
+                self._predictors.move_to_end(key)
+                return predictor
+
+            self.misses += 1
+            predictor = self._load(department_id, examination_id)
+            self._predictors[key] = predictor
+            while len(self._predictors) > max(self.max_size, 1):
+                self._predictors.popitem(last=False)
+                self.evictions += 1
+            return predictor
+
+    def invalidate(self, department_id=None, examination_id=None):
+        """移除指定预测器的缓存"""
+        with self._lock:
+            self._predictors.pop((department_id, examination_id), None)
+
+    def clear(self):
+        """清空缓存并重置统计"""
+        with self._lock:
+            self._predictors.clear()
+            self.hits = self.misses = self.reloads = self.evictions = 0
+            self.load_time = 0.0
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._predictors),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'reloads': self.reloads,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0,
+                'load_time': round(self.load_time, 4),
+            }
+
+
+# 全局预测器缓存
+predictor_cache = ProphetPredictorCache()
 
 def get_prophet_predictor(department_id=None, examination_id=None):
     """
@@ -266,19 +537,36 @@ def get_prophet_predictor(department_id=None, examination_id=None):
     - examination_id: 检查项目ID，如果为None则为科室级模型
     
     返回:
-    - ProphetWaitTimePredictor实例
+    - ProphetWaitTimePredictor实例（来自进程内LRU缓存）
     """
-    global global_predictor
-    
-    # 如果请求全局预测器且已存在，直接返回
-    if department_id is None and examination_id is None and global_predictor is not None:
-        return global_predictor
-    
-    # 否则创建新的预测器
-    predictor = ProphetWaitTimePredictor(department_id, examination_id)
-    
-    # 如果是全局预测器，保存为全局变量
-    if department_id is None and examination_id is None:
-        global_predictor = predictor
-    
-    return predictor 
\ No newline at end of file
+    return predictor_cache.get(department_id, examination_id)
+
+
+def warm_start_params(model):
+    """提取已拟合Prophet模型的参数，作为下一次拟合的初始值"""
+    params = {}
+    for name in ['k', 'm', 'sigma_obs']:
+        params[name] = float(model.params[name][0][0])
+    for name in ['delta', 'beta']:
+        params[name] = model.params[name][0]
+    return params
+
+
+def train_prophet_model(historical_data, department_id=None, examination_id=None, incremental=False):
+    """
+    训练并保存一个Prophet模型，供训练进程池调用
+
+    参数:
+    - incremental: 增量训练，数据分布未变化时跳过，否则从上次的参数热启动
+
+    返回:
+    - dict: 训练数据行数和模型文件（跳过时包含 skipped 和 reason），训练失败时返回None
+    """
+    predictor = ProphetWaitTimePredictor(department_id=department_id, examination_id=examination_id)
+    if incremental:
+        shifted, reason = predictor.needs_retrain(historical_data)
+        if not shifted:
+            return {'skipped': True, 'reason': reason, 'rows': len(historical_data)}
+    if not predictor.train(historical_data, warm_start=incremental):
+        return None
+    return {'rows': len(historical_data), 'model_file': predictor.model_file}
@@ -0,0 +1,352 @@
+"""
+模型注册表 - 带版本、指标和校验和的模型发布与回滚
+
+每个模型目录（navigation/ml/trained_models、ml_models/prophet）有一个 manifest.json：
+
+    {
+        "generation": 12,
+        "models": {
+            "xgboost_model_3.ubj": {
+                "current": 4,
+                "versions": {"4": {"file": "versions/xgboost_model_3.ubj/v4.ubj", "sha256": "...",
+                                   "metrics": {...}, "created_at": "..."}}
+            }
+        }
+    }
+
+发布时先把模型序列化到同目录的临时文件，计算校验和后重命名为不可变的版本文件，
+再通过临时链接+重命名原子地替换原来的模型路径（如 xgboost_model_3.ubj），
+读取方永远不会读到写了一半的文件。manifest 同样以临时文件+重命名方式更新，
+每次发布或回滚都会递增 generation。
+
+各 Django/Celery 进程只需检查 manifest 文件的修改时间（一次 stat）即可发现新版本，
+再按需重新加载模型；回滚只是把 current 指回旧版本并替换模型路径，不需要重新训练。
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import joblib
+from django.conf import settings
+from django.utils import timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+VERSIONS_DIR = 'versions'
+
+
+def file_checksum(path):
+    """计算文件的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _atomic_link(source, target):
+    """原子地让 target 指向 source 的内容（硬链接到临时名再重命名，不支持硬链接时复制）"""
+    directory = os.path.dirname(target)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix=os.path.splitext(target)[1])
+    os.close(fd)
+    os.remove(tmp_path)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+class ModelRegistry:
+    """单个模型目录的注册表"""
+
+    def __init__(self, root):
+        self.root = root
+        self.manifest_path = os.path.join(root, MANIFEST_FILE)
+        self._lock = threading.Lock()
+        self._cached_stat = None
+        self._cached_manifest = None
+
+    @staticmethod
+    def model_name(path):
+        # 同一模型的不同格式（如 .pkl 和 .ubj）分别登记
+        return os.path.basename(path)
+
+    # manifest 读写
+
+    def _stat(self):
+        try:
+            st = os.stat(self.manifest_path)
+            return (st.st_mtime_ns, st.st_size, st.st_ino)
+        except OSError:
+            return None
+
+    def manifest(self):
+        """读取 manifest，文件未变化时使用进程内缓存"""
+        stat = self._stat()
+        with self._lock:
+            if stat is not None and stat == self._cached_stat:
+                return self._cached_manifest
+        if stat is None:
+            return {'generation': 0, 'models': {}}
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"读取模型注册表失败 {self.manifest_path}: {str(e)}")
+            return {'generation': 0, 'models': {}}
+        with self._lock:
+            self._cached_stat, self._cached_manifest = stat, manifest
+        return manifest
+
+    def generation(self):
+        """注册表的发布代数，任何发布或回滚都会使其递增"""
+        return self.manifest().get('generation', 0)
+
+    @contextmanager
+    def _write_lock(self):
+        """跨进程的写锁，训练进程池中的多个进程可能同时发布"""
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, '.manifest.lock'), 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_for_update(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'generation': 0, 'models': {}}
+
+    def _write_manifest(self, manifest):
+        manifest['generation'] = manifest.get('generation', 0) + 1
+        manifest['updated_at'] = timezone.now().isoformat()
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.manifest-', suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    # 发布、加载与回滚
+
+    def publish(self, model, path, metrics=None, dump=None):
+        """
+        发布模型的新版本
+
+        参数:
+        - model: 模型对象
+        - path: 模型的访问路径（如 trained_models/xgboost_model_3.ubj）
+        - metrics: 评估指标，记录在 manifest 中
+        - dump: 序列化函数 dump(model, file_path)，默认 joblib.dump
+
+        返回:
+        - int: 新版本号
+        """
+        dump = dump or joblib.dump
+        name = self.model_name(path)
+        ext = os.path.splitext(path)[1]
+        version_dir = os.path.join(self.root, VERSIONS_DIR, name)
+        os.makedirs(version_dir, exist_ok=True)
+
+        # 先完整写入临时文件（保留扩展名，部分格式据此选择编码），再重命名为版本文件
+        fd, tmp_path = tempfile.mkstemp(dir=version_dir, prefix='.tmp-', suffix=ext)
+        os.close(fd)
+        try:
+            dump(model, tmp_path)
+            checksum = file_checksum(tmp_path)
+            with self._write_lock():
+                manifest = self._read_for_update()
+                entry = manifest.setdefault('models', {}).setdefault(name, {'current': None, 'versions': {}})
+                version = max((int(v) for v in entry['versions']), default=0) + 1
+                version_file = os.path.join(version_dir, f'v{version}{ext}')
+                os.replace(tmp_path, version_file)
+                _atomic_link(version_file, path)
+
+                entry['versions'][str(version)] = {
+                    'file': os.path.relpath(version_file, self.root),
+                    'sha256': checksum,
+                    'metrics': _jsonable(metrics or {}),
+                    'created_at': timezone.now().isoformat(),
+                }
+                entry['current'] = version
+                self._prune(entry, version_dir)
+                self._write_manifest(manifest)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        logger.info(f"已发布模型 {name} 版本 {version}")
+        return version
+
+    def _prune(self, entry, version_dir):
+        """只保留最近 ML_MODEL_REGISTRY_KEEP 个版本"""
+        keep = getattr(settings, 'ML_MODEL_REGISTRY_KEEP', 5)
+        versions = sorted(int(v) for v in entry['versions'])
+        for version in versions[:-keep] if keep > 0 else []:
+            if version == entry['current']:
+                continue
+            info = entry['versions'].pop(str(version))
+            try:
+                os.remove(os.path.join(self.root, info['file']))
+            except OSError:
+                pass
+
+    def current(self, path):
+        """模型当前版本的记录，未注册时返回None"""
+        entry = self.manifest().get('models', {}).get(self.model_name(path))
+        if not entry or entry.get('current') is None:
+            return None
+        info = entry['versions'].get(str(entry['current']))
+        return dict(info, version=entry['current']) if info else None
+
+    def load(self, path, loader=None):
+        """
+        加载模型当前版本并校验
+
+        已注册的模型从不可变的版本文件加载并核对校验和；未注册的旧模型直接加载访问路径。
+
+        返回:
+        - (model, version): version 为None表示未注册的模型
+        """
+        loader = loader or joblib.load
+        info = self.current(path)
+        if info is None:
+            return loader(path), None
+
+        version_file = os.path.join(self.root, info['file'])
+        if file_checksum(version_file) != info['sha256']:
+            raise ValueError(f"模型文件校验失败: {version_file}")
+        return loader(version_file), info['version']
+
+    def rollback(self, path, version=None):
+        """
+        回滚模型到指定版本，默认回到上一个版本
+
+        返回:
+        - int: 回滚后的版本号
+        """
+        name = self.model_name(path)
+        with self._write_lock():
+            manifest = self._read_for_update()
+            entry = manifest.get('models', {}).get(name)
+            if not entry:
+                raise ValueError(f"模型 {name} 未注册")
+
+            if version is None:
+                older = [int(v) for v in entry['versions'] if int(v) < entry['current']]
+                if not older:
+                    raise ValueError(f"模型 {name} 没有更早的版本")
+                version = max(older)
+            info = entry['versions'].get(str(version))
+            if info is None:
+                raise ValueError(f"模型 {name} 不存在版本 {version}")
+
+            _atomic_link(os.path.join(self.root, info['file']), path)
+            entry['current'] = version
+            self._write_manifest(manifest)
+
+        logger.info(f"模型 {name} 已回滚到版本 {version}")
+        return version
+
+    def list_models(self):
+        """列出所有注册的模型及其版本"""
+        return self.manifest().get('models', {})
+
+    def verify(self):
+        """
+        核对所有版本文件的校验和
+
+        返回:
+        - list: (模型名, 版本号, 问题说明)，全部正常时为空
+        """
+        problems = []
+        for name, entry in self.list_models().items():
+            for version, info in entry['versions'].items():
+                version_file = os.path.join(self.root, info['file'])
+                if not os.path.exists(version_file):
+                    problems.append((name, int(version), '版本文件不存在'))
+                elif file_checksum(version_file) != info['sha256']:
+                    problems.append((name, int(version), '校验和不一致'))
+        return problems
+
+
+def _jsonable(value):
+    """把指标中的 numpy 数值等转换为可写入JSON的类型"""
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items() if not hasattr(v, 'to_dict')}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(directory):
+    """获取模型目录对应的注册表（进程内单例）"""
+    directory = os.path.abspath(directory)
+    with _registries_lock:
+        if directory not in _registries:
+            _registries[directory] = ModelRegistry(directory)
+        return _registries[directory]
+
+
+def registry_for(path):
+    """获取模型文件所在目录的注册表"""
+    return get_registry(os.path.dirname(os.path.abspath(path)))
+
+
+class GenerationWatcher:
+    """
+    限频检查注册表是否有新发布
+
+    每个进程最多每 ML_MODEL_REGISTRY_CHECK_INTERVAL 秒 stat 一次 manifest，
+    发现 generation 变化时 changed() 返回True。
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._generation = None
+        self._checked_at = 0.0
+
+    def mark(self):
+        """记录当前的 generation，之后的发布才视为变化"""
+        self._generation = self.registry.generation()
+        self._checked_at = time.monotonic()
+
+    def reset(self):
+        """下次检查时重新比较"""
+        self._generation = None
+
+    def changed(self):
+        interval = getattr(settings, 'ML_MODEL_REGISTRY_CHECK_INTERVAL', 5)
+        now = time.monotonic()
+        if self._generation is not None and now - self._checked_at < interval:
+            return False
+        self._checked_at = now
+        generation = self.registry.generation()
+        if generation != self._generation:
+            self._generation = generation
+            return True
+        return False
@@ -0,0 +1,143 @@
+"""
+模型序列化格式 - 只保存推理需要的内容，加快进程启动时的模型加载
+
+- XGBoost 模型保存为原生的 UBJSON 二进制格式（.ubj），与 pickle 相比不依赖 sklearn 包装对象
+  和 xgboost 的版本，加载时也不执行任意代码
+- Prophet 模型保存前去掉训练历史数据和 Stan 拟合对象（CmdStan 结果和后端），只保留参数和
+  预测时用到的最后几个历史点，仍使用 pickle 格式
+- 其他模型仍使用 joblib
+
+加载函数根据文件扩展名选择格式，旧的 .pkl 文件继续可用。
+"""
+import copy
+import logging
+import os
+import pickle
+from importlib.util import find_spec
+
+import joblib
+
+logger = logging.getLogger(__name__)
+
+XGBOOST_EXT = '.ubj'
+# 同名模型存在多种格式时，优先使用原生格式
+MODEL_EXTENSIONS = (XGBOOST_EXT, '.pkl')
+
+# Prophet 预测时需要的历史点数：make_future_dataframe 用最后5个日期推断频率，
+# 只预测一个点时用最后两个点的时间间隔估计不确定性
+PROPHET_HISTORY_ROWS = 5
+
+
+def model_extension(model_type):
+    """各类型模型的保存格式"""
+    return XGBOOST_EXT if model_type == 'xgboost' else '.pkl'
+
+
+def model_department_id(filename):
+    """从 <类型>_model_<科室ID>.<扩展名> 形式的文件名中解析科室ID，不是模型文件时返回None"""
+    stem, ext = os.path.splitext(os.path.basename(filename))
+    suffix = stem.rsplit('_', 1)[-1]
+    if ext not in MODEL_EXTENSIONS or not suffix.isdigit():
+        return None
+    return int(suffix)
+
+
+def find_model_file(model_dir, name):
+    """按格式优先级查找模型文件，都不存在时返回None"""
+    for ext in MODEL_EXTENSIONS:
+        path = os.path.join(model_dir, f'{name}{ext}')
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def is_prophet_model(model):
+    # 按模块名判断，避免为此导入 prophet
+    return type(model).__module__.startswith('prophet')
+
+
+def is_compact_prophet(model):
+    """Prophet 模型是否已去掉训练历史和 Stan 拟合对象"""
+    return (
+        getattr(model, 'stan_backend', None) is None
+        and getattr(model, 'stan_fit', None) is None
+        and (model.history is None or len(model.history) <= PROPHET_HISTORY_ROWS)
+    )
+
+
+def compact_prophet(model):
+    """返回只含推理所需内容的 Prophet 模型副本，不修改原模型"""
+    compact = copy.copy(model)
+    if model.history is not None:
+        compact.history = model.history.tail(PROPHET_HISTORY_ROWS).copy()
+    if model.history_dates is not None:
+        compact.history_dates = model.history_dates.tail(PROPHET_HISTORY_ROWS).copy()
+    compact.stan_fit = None
+    compact.stan_backend = None
+    return compact
+
+
+def dump_prophet_model(model, path):
+    """保存精简后的 Prophet 模型"""
+    with open(path, 'wb') as f:
+        pickle.dump(compact_prophet(model), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_prophet_model(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def dump_model_file(model, path):
+    """根据扩展名和模型类型保存模型文件"""
+    if path.endswith(XGBOOST_EXT):
+        model.save_model(path)
+    elif is_prophet_model(model):
+        dump_prophet_model(model, path)
+    else:
+        joblib.dump(model, path)
+
+
+def load_model_file(path):
+    """根据扩展名加载模型文件，.ubj 文件还原为 XGBRegressor"""
+    if path.endswith(XGBOOST_EXT):
+        # 只在加载 .ubj 文件时导入 XGBoost
+        import xgboost as xgb
+        model = xgb.XGBRegressor()
+        model.load_model(path)
+        return model
+    return joblib.load(path)
+
+
+def _resident_memory():
+    """当前进程的常驻内存字节数，不支持 /proc 的系统上退回到峰值常驻内存"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        import sys
+        # ru_maxrss 在 Linux 上单位为KB，macOS 为字节
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def measure_load(path):
+    """
+    在当前进程中加载模型文件，返回 (加载耗时秒数, 常驻内存增量字节数)
+
+    供基准测试在全新的子进程中调用，模型库提前导入，只统计模型本身的开销。
+    """
+    import time
+
+    for module in ('xgboost', 'prophet'):
+        if find_spec(module) is not None:
+            __import__(module)
+
+    before = _resident_memory()
+    start = time.perf_counter()
+    model = load_model_file(path)
+    elapsed = time.perf_counter() - start
+    after = _resident_memory()
+    del model
+    return elapsed, after - before
@@ -14,7 +14,11 @@ from .data_collector import data_collector
 from .trainer import model_trainer
 from navigation.models import Department, Examination
 from navigation.ml.data_collector import QueueDataCollector
-from navigation.ml.prophet_predictor import get_prophet_predictor, ProphetWaitTimePredictor
+from navigation.ml.prophet_predictor import get_prophet_predictor, ProphetWaitTimePredictor, train_prophet_model
+from navigation.ml.inference import prophet_model_target
+from navigation.ml.training_pool import TrainingJob, training_orchestrator, log_training_report
+from navigation.utils.queue_index import queue_index
+from navigation.signals import broadcast_queue_update
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -32,12 +36,14 @@ logger.setLevel(logging.DEBUG)
 
 
 @shared_task(bind=True)
-def train_wait_time_models(self, algorithm='xgboost', *args, **kwargs):
+def train_wait_time_models(self, algorithm='xgboost', incremental=False, tune=False, *args, **kwargs):
     """
     训练等待时间预测模型的Celery任务
     
     Args:
         algorithm: 使用的算法，可选值: 'xgboost', 'prophet', 'random_forest', 'gradient_boosting', 'linear'
+        incremental: 增量训练，只用新数据更新数据分布发生变化的科室模型
+        tune: 训练前为调优参数缺失或过期（超过 ML_TUNING_CACHE_DAYS 天）的科室搜索超参数
     """
     logger.info(f">>>训练开始，使用算法: {algorithm}>>>")
     self.update_state(state="PROGRESS", meta={"progress": 0, "message": "开始训练"})
@@ -70,7 +76,7 @@ def train_wait_time_models(self, algorithm='xgboost', *args, **kwargs):
         
         logger.info(f"开始训练等待时间预测模型，使用算法: {algorithm}")
         # 训练模型
-        success = model_trainer.train_all_models(df, algorithm=algorithm)
+        success = model_trainer.train_all_models(df, algorithm=algorithm, incremental=incremental, tune=tune)
         
         # 更新任务状态为100%进度
         try:
@@ -121,42 +127,61 @@ def update_predicted_wait_times():
         
         logger.info(f"开始更新 {waiting_queues.count()} 个队列的预计等待时间")
         
-        updated_count = 0
-        total_count = waiting_queues.count()
-        for i, queue in enumerate(waiting_queues):
+        # 按科室批量获取排队位置，组装特征后一次性批量预测
+        department_positions = {}
+        queues = []
+        feature_rows = {
+            'department_id': [],
+            'queue_count': [],
+            'equipment_status': [],
+            'priority': [],
+        }
+        for queue in waiting_queues:
             dept_id = queue.department_id
-            if dept_id in real_time_data:
-                dept_data = real_time_data[dept_id]
-                
-                # 获取队列在科室中的位置（前面有多少人）
-                position = queue.get_position() - 1  # 减1是因为get_position返回的是含自己的位置
-                
-                # 如果队列在前面，使用实际的排队人数；否则使用科室总排队数
-                queue_count = position if position >= 0 else dept_data['queue_count']
-                
-                # 使用模型预测等待时间
-                predicted_time = prediction_service.predict_wait_time(
-                    department_id=dept_id,
-                    queue_count=queue_count,
-                    equipment_status=dept_data['equipment_status'],
-                    priority=queue.priority
-                )
-                
-                # 更新队列的预计等待时间
-                old_time = queue.estimated_wait_time
-                queue.estimated_wait_time = round(predicted_time)
-                queue.save(update_fields=['estimated_wait_time'])
-                
-                # 记录明显变化的预测
-                if abs(old_time - queue.estimated_wait_time) > 5:
-                    logger.info(f"队列 {queue.id} 的等待时间从 {old_time} 更新为 {queue.estimated_wait_time} 分钟")
-                
-                updated_count += 1
+            if dept_id not in real_time_data:
+                continue
+            dept_data = real_time_data[dept_id]
             
-            # 每10%更新一次进度
-            if current_task and total_count > 0 and i % max(1, int(total_count/10)) == 0:
-                progress = 40 + int(50 * i / total_count)
-                current_task.update_state(state='PROGRESS', meta={'progress': progress})
+            # 获取队列在科室中的位置（前面有多少人）
+            if dept_id not in department_positions:
+                department_positions[dept_id] = queue_index.get_department_positions(dept_id)
+            position = department_positions[dept_id].get(queue.id, 0) - 1  # 减1是因为位置含自己
+            
+            # 如果队列在前面，使用实际的排队人数；否则使用科室总排队数
+            queue_count = position if position >= 0 else dept_data['queue_count']
+            
+            queues.append(queue)
+            feature_rows['department_id'].append(dept_id)
+            feature_rows['queue_count'].append(queue_count)
+            feature_rows['equipment_status'].append(dept_data['equipment_status'])
+            feature_rows['priority'].append(queue.priority)
+        
+        # 其余特征使用已收集的实时数据
+        for key in ('department_capacity', 'staff_efficiency', 'historical_wait_time'):
+            feature_rows[key] = [
+                real_time_data[dept_id].get(key) for dept_id in feature_rows['department_id']
+            ]
+        
+        if current_task:
+            current_task.update_state(state='PROGRESS', meta={'progress': 60})
+        
+        predicted_times = prediction_service.predict_many(None, feature_rows)
+        
+        changed = []
+        for queue, predicted_time in zip(queues, predicted_times):
+            old_time = queue.estimated_wait_time
+            queue.estimated_wait_time = round(predicted_time)
+            if old_time != queue.estimated_wait_time:
+                changed.append(queue)
+            
+            # 记录明显变化的预测
+            if abs(old_time - queue.estimated_wait_time) > 5:
+                logger.info(f"队列 {queue.id} 的等待时间从 {old_time} 更新为 {queue.estimated_wait_time} 分钟")
+        
+        if changed:
+            Queue.objects.bulk_update(changed, ['estimated_wait_time'], batch_size=500)
+            broadcast_queue_update({queue.department_id for queue in changed})
+        updated_count = len(queues)
         
         logger.info(f"成功更新 {updated_count} 个队列的预计等待时间")
         
@@ -171,28 +196,81 @@ def update_predicted_wait_times():
         return f"错误: {str(e)}"
 
 
+@shared_task
+def refresh_prophet_forecasts(days=None):
+    """
+    重新生成所有Prophet模型的逐小时预测表
+
+    预测表只覆盖生成后的若干天，需要定期刷新，否则预测会退回到实时调用 model.predict
+    """
+    prophet_dir = os.path.join(settings.BASE_DIR, 'ml_models', 'prophet')
+    if not os.path.isdir(prophet_dir):
+        return {"status": "success", "refreshed_count": 0}
+
+    refreshed_count = 0
+    for file_name in os.listdir(prophet_dir):
+        try:
+            target = prophet_model_target(file_name)
+            if target is None:
+                continue
+            department_id, examination_id = target
+            predictor = get_prophet_predictor(department_id=department_id, examination_id=examination_id)
+
+            if predictor.build_forecast_table(days=days):
+                refreshed_count += 1
+        except Exception as e:
+            logger.error(f"刷新Prophet预测表失败 {file_name}: {str(e)}")
+
+    logger.info(f"已刷新 {refreshed_count} 个Prophet预测表")
+    return {"status": "success", "refreshed_count": refreshed_count}
+
+
+@shared_task
+def collect_training_data_incremental(days=30):
+    """将水位线之后新完成的队列追加到列式训练数据存储"""
+    try:
+        appended = data_collector.collect_incremental_data(days=days)
+        logger.info(f"增量收集训练数据完成，新增 {appended} 条")
+        return {"status": "success", "appended_count": appended}
+    except Exception as e:
+        logger.error(f"增量收集训练数据失败: {str(e)}")
+        return {"status": "error", "message": str(e)}
+
+
 @shared_task(name="train-prophet-models")
-def train_prophet_models():
+def train_prophet_models(incremental=False):
     """
     训练所有科室和检查项目的Prophet模型
+    
+    历史数据只加载一次，全局、科室和检查项目模型在进程池中并行训练。
+    incremental=True 时跳过数据分布未变化的模型，其余模型从上次的参数热启动。
     """
     logger.info("开始训练Prophet模型")
     
     try:
         # 获取数据收集器
         collector = QueueDataCollector(days_lookback=30)
+        history = collector.collect_historical_data()
         
-        # 训练全局模型
-        train_global_model(collector)
-        
-        # 训练各科室模型
-        train_department_models(collector)
-        
-        # 训练各检查项目模型
-        train_examination_models(collector)
+        jobs = (
+            build_global_jobs(collector, history, incremental) +
+            build_department_jobs(collector, history, incremental) +
+            build_examination_jobs(collector, history, incremental)
+        )
+        results = training_orchestrator.run(jobs)
+        success_count, fail_count = log_training_report("Prophet模型训练", results)
         
         logger.info("所有Prophet模型训练完成")
-        return {"status": "success", "message": "所有Prophet模型训练完成"}
+        return {
+            "status": "success",
+            "message": "所有Prophet模型训练完成",
+            "success_count": success_count,
+            "fail_count": fail_count,
+            "results": [
+                {key: r[key] for key in ('name', 'success', 'duration', 'error')}
+                for r in results
+            ],
+        }
         
     except Exception as e:
         error_msg = f"训练Prophet模型出错: {str(e)}"
@@ -200,6 +278,50 @@ def train_prophet_models():
         logger.error(traceback.format_exc())
         return {"status": "error", "message": error_msg}
 
+def build_global_jobs(collector, history, incremental=False):
+    """构建全局模型的训练任务"""
+    global_data = collector.prepare_prophet_data(history=history)
+    if global_data.empty:
+        logger.warning("没有全局历史数据可用于训练Prophet模型")
+        return []
+    return [TrainingJob("全局模型", train_prophet_model, global_data, None, None, incremental)]
+
+def build_department_jobs(collector, history, incremental=False):
+    """为每个有历史数据的科室构建训练任务，每个任务只携带该科室的数据"""
+    jobs = []
+    for dept in Department.objects.all():
+        dept_data = collector.prepare_prophet_data(department_id=dept.id, history=history)
+        if dept_data.empty:
+            logger.warning(f"科室 '{dept.name}' (ID: {dept.id}) 没有历史数据可用于训练Prophet模型")
+            continue
+        jobs.append(TrainingJob(
+            f"科室 '{dept.name}' (ID: {dept.id})", train_prophet_model, dept_data, dept.id, None, incremental
+        ))
+    return jobs
+
+def build_examination_jobs(collector, history, incremental=False):
+    """为每个有历史数据的检查项目构建训练任务"""
+    jobs = []
+    for exam in Examination.objects.all():
+        exam_data = collector.prepare_prophet_data(examination_id=exam.id, history=history)
+        if exam_data.empty:
+            logger.warning(f"检查项目 '{exam.name}' (ID: {exam.id}) 没有历史数据可用于训练Prophet模型")
+            continue
+        jobs.append(TrainingJob(
+            f"检查项目 '{exam.name}' (ID: {exam.id})", train_prophet_model, exam_data, None, exam.id, incremental
+        ))
+    return jobs
+
+def _run_prophet_jobs(title, jobs):
+    try:
+        results = training_orchestrator.run(jobs)
+        success_count, _ = log_training_report(title, results)
+        return success_count > 0
+    except Exception as e:
+        logger.error(f"{title}出错: {str(e)}")
+        logger.error(traceback.format_exc())
+        return False
+
 def train_global_model(collector):
     """
     训练全局模型
@@ -207,31 +329,7 @@ def train_global_model(collector):
     参数:
     - collector: 数据收集器实例
     """
-    try:
-        # 准备全局数据
-        global_data = collector.prepare_prophet_data()
-        
-        if global_data.empty:
-            logger.warning("没有全局历史数据可用于训练Prophet模型")
-            return False
-        
-        # 获取全局预测器
-        predictor = get_prophet_predictor()
-        
-        # 训练模型
-        success = predictor.train(global_data)
-        
-        if success:
-            logger.info("全局Prophet模型训练成功")
-        else:
-            logger.warning("全局Prophet模型训练失败")
-        
-        return success
-        
-    except Exception as e:
-        logger.error(f"训练全局Prophet模型出错: {str(e)}")
-        logger.error(traceback.format_exc())
-        return False
+    return _run_prophet_jobs("全局Prophet模型训练", build_global_jobs(collector, collector.collect_historical_data()))
 
 def train_department_models(collector):
     """
@@ -240,46 +338,7 @@ def train_department_models(collector):
     参数:
     - collector: 数据收集器实例
     """
-    try:
-        # 获取所有科室
-        departments = Department.objects.all()
-        
-        success_count = 0
-        fail_count = 0
-        
-        for dept in departments:
-            try:
-                # 准备科室数据
-                dept_data = collector.prepare_prophet_data(department_id=dept.id)
-                
-                if dept_data.empty:
-                    logger.warning(f"科室 '{dept.name}' (ID: {dept.id}) 没有历史数据可用于训练Prophet模型")
-                    continue
-                
-                # 获取科室预测器
-                predictor = get_prophet_predictor(department_id=dept.id)
-                
-                # 训练模型
-                success = predictor.train(dept_data)
-                
-                if success:
-                    logger.info(f"科室 '{dept.name}' (ID: {dept.id}) Prophet模型训练成功")
-                    success_count += 1
-                else:
-                    logger.warning(f"科室 '{dept.name}' (ID: {dept.id}) Prophet模型训练失败")
-                    fail_count += 1
-                    
-            except Exception as e:
-                logger.error(f"训练科室 '{dept.name}' (ID: {dept.id}) Prophet模型出错: {str(e)}")
-                fail_count += 1
-        
-        logger.info(f"科室模型训练完成: {success_count}个成功, {fail_count}个失败")
-        return success_count > 0
-        
-    except Exception as e:
-        logger.error(f"训练科室Prophet模型出错: {str(e)}")
-        logger.error(traceback.format_exc())
-        return False
+    return _run_prophet_jobs("科室Prophet模型训练", build_department_jobs(collector, collector.collect_historical_data()))
 
 def train_examination_models(collector):
     """
@@ -288,43 +347,4 @@ def train_examination_models(collector):
     参数:
     - collector: 数据收集器实例
     """
-    try:
-        # 获取所有检查项目
-        examinations = Examination.objects.all()
-        
-        success_count = 0
-        fail_count = 0
-        
-        for exam in examinations:
-            try:
-                # 准备检查项目数据
-                exam_data = collector.prepare_prophet_data(examination_id=exam.id)
-                
-                if exam_data.empty:
-                    logger.warning(f"检查项目 '{exam.name}' (ID: {exam.id}) 没有历史数据可用于训练Prophet模型")
-                    continue
-                
-                # 获取检查项目预测器
-                predictor = get_prophet_predictor(examination_id=exam.id)
-                
-                # 训练模型
-                success = predictor.train(exam_data)
-                
-                if success:
-                    logger.info(f"检查项目 '{exam.name}' (ID: {exam.id}) Prophet模型训练成功")
-                    success_count += 1
-                else:
-                    logger.warning(f"检查项目 '{exam.name}' (ID: {exam.id}) Prophet模型训练失败")
-                    fail_count += 1
-                    
-            except Exception as e:
-                logger.error(f"训练检查项目 '{exam.name}' (ID: {exam.id}) Prophet模型出错: {str(e)}")
-                fail_count += 1
-        
-        logger.info(f"检查项目模型训练完成: {success_count}个成功, {fail_count}个失败")
-        return success_count > 0
-        
-    except Exception as e:
-        logger.error(f"训练检查项目Prophet模型出错: {str(e)}")
-        logger.error(traceback.format_exc())
-        return False 
\ No newline at end of file
+    return _run_prophet_jobs("检查项目Prophet模型训练", build_examination_jobs(collector, collector.collect_historical_data()))
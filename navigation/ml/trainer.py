@@ -5,17 +5,21 @@ import os
 import logging
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split, GridSearchCV
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401 启用逐次减半搜索
+from sklearn.model_selection import train_test_split, GridSearchCV, RandomizedSearchCV, HalvingRandomSearchCV
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 import matplotlib
 matplotlib.use('Agg')  # 使用非交互式后端，避免在非主线程创建窗口
 import matplotlib.pyplot as plt
-import joblib
 from django.conf import settings
 from django.db.models import Count
 from navigation.models import Department
+from navigation.ml.training_pool import TrainingJob, training_orchestrator, log_training_report
+from navigation.ml.incremental import load_state, save_state, get_watermark, rows_after, detect_shift
+from navigation.ml.registry import registry_for
+from navigation.ml.serialization import model_extension, dump_model_file, load_model_file
 
 # 导入新增的库
 import xgboost as xgb
@@ -45,6 +49,8 @@ class ModelTrainer:
         """
         self.model_dir = os.path.join(settings.BASE_DIR, 'navigation', 'ml', 'trained_models')
         os.makedirs(self.model_dir, exist_ok=True)
+        # 单个模型训练使用的线程数，在训练进程池中设为1
+        self.n_jobs = -1
         
         # 初始化与其他模块的连接
         from .data_collector import data_collector
@@ -237,10 +243,9 @@ class ModelTrainer:
             
             # 如果指定了科室ID，保存模型
             if department_id is not None:
-                model_path = os.path.join(self.model_dir, f'prophet_model_{department_id}.pkl')
-                with open(model_path, 'wb') as f:
-                    joblib.dump(model, f)
-                logger.info(f"Prophet模型已保存到: {model_path}")
+                model_path = self._model_path('prophet', department_id)
+                version = registry_for(model_path).publish(model, model_path, metrics, dump=dump_model_file)
+                logger.info(f"Prophet模型已发布到: {model_path}（版本 {version}）")
             
             return model, metrics
         
@@ -280,7 +285,7 @@ class ModelTrainer:
                     subsample=0.8,
                     colsample_bytree=0.8,
                     random_state=42,
-                    n_jobs=-1
+                    n_jobs=self.n_jobs
                 )
                 logger.info("使用XGBoost模型")
             elif model_type == 'random_forest':
@@ -290,7 +295,7 @@ class ModelTrainer:
                     min_samples_split=2,
                     min_samples_leaf=1,
                     random_state=42,
-                    n_jobs=-1
+                    n_jobs=self.n_jobs
                 )
                 logger.info("使用RandomForest模型")
             elif model_type == 'gradient_boosting':
@@ -307,6 +312,12 @@ class ModelTrainer:
             else:
                 raise ValueError(f"不支持的模型类型: {model_type}")
             
+            # 科室有未过期的调优参数时覆盖默认参数
+            tuned_params = self.load_tuned_params(model_type, department_id)
+            if tuned_params:
+                model.set_params(**tuned_params)
+                logger.info(f"科室 {department_id} 使用缓存的调优参数: {tuned_params}")
+            
             # 训练模型
             logger.info("开始训练模型...")
             model.fit(X_train, y_train)
@@ -337,9 +348,9 @@ class ModelTrainer:
             
             # 如果指定了科室ID，保存模型
             if department_id is not None:
-                model_path = os.path.join(self.model_dir, f'{model_type}_model_{department_id}.pkl')
-                joblib.dump(model, model_path)
-                logger.info(f"模型已保存到: {model_path}")
+                model_path = self._model_path(model_type, department_id)
+                version = registry_for(model_path).publish(model, model_path, metrics, dump=dump_model_file)
+                logger.info(f"模型已发布到: {model_path}（版本 {version}）")
             
             return model, metrics
             
@@ -347,7 +358,114 @@ class ModelTrainer:
             logger.error(f"训练特征模型时出错: {str(e)}", exc_info=True)
             return None, None
     
-    def hyper_parameter_tuning(self, df, department_id=None, model_type='xgboost'):
+    # 超参数调优至少需要的科室数据条数
+    MIN_TUNING_ROWS = 50
+    
+    # 超参数搜索空间；逐次减半搜索时 n_estimators 作为资源逐轮增加，不参与采样
+    PARAM_GRIDS = {
+        'xgboost': {
+            'n_estimators': [50, 100, 200],
+            'learning_rate': [0.01, 0.05, 0.1],
+            'max_depth': [3, 5, 7],
+            'subsample': [0.6, 0.8, 1.0],
+            'colsample_bytree': [0.6, 0.8, 1.0]
+        },
+        'random_forest': {
+            'n_estimators': [50, 100, 200],
+            'max_depth': [None, 10, 20, 30],
+            'min_samples_split': [2, 5, 10],
+            'min_samples_leaf': [1, 2, 4]
+        },
+    }
+    
+    def _tuning_threads(self):
+        """
+        分配调优使用的线程: 每个估计器使用 ML_TUNING_ESTIMATOR_THREADS 个线程，
+        搜索并行数为可用核数除以该值，两者相乘不超过可用核数
+        """
+        total = self.n_jobs if self.n_jobs and self.n_jobs > 0 else (os.cpu_count() or 1)
+        estimator_threads = max(1, min(getattr(settings, 'ML_TUNING_ESTIMATOR_THREADS', 1), total))
+        return max(1, total // estimator_threads), estimator_threads
+    
+    def _tuned_params_path(self, model_type, department_id):
+        return os.path.join(self.model_dir, f'{model_type}_tuned_params_{department_id}.json')
+    
+    def load_tuned_params(self, model_type, department_id):
+        """读取缓存的调优参数，不存在或超过 ML_TUNING_CACHE_DAYS 天时返回None"""
+        import json
+        
+        if department_id is None:
+            return None
+        try:
+            with open(self._tuned_params_path(model_type, department_id), 'r') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        age = pd.Timestamp.now() - pd.Timestamp(cached['tuned_at'])
+        if age > pd.Timedelta(days=getattr(settings, 'ML_TUNING_CACHE_DAYS', 7)):
+            return None
+        return cached['params']
+    
+    def save_tuned_params(self, model_type, department_id, params, score, search, fits):
+        """缓存科室的调优参数，每个科室一个文件，并行调优时互不覆盖"""
+        import json
+        
+        if department_id is None:
+            return
+        try:
+            with open(self._tuned_params_path(model_type, department_id), 'w') as f:
+                json.dump({
+                    'params': params,
+                    'score': float(score),
+                    'search': search,
+                    'fits': fits,
+                    'tuned_at': pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S'),
+                }, f, indent=2)
+        except Exception as e:
+            logger.error(f"保存科室 {department_id} 的调优参数失败: {str(e)}")
+    
+    def _build_search(self, base_model, param_grid, search, budget, cv, n_jobs):
+        """
+        按计算预算构建超参数搜索
+        
+        Args:
+            search: 'halving'（逐次减半随机搜索）、'random'（随机搜索）或 'grid'（完整网格搜索）
+            budget: 完整训练次数的上限（候选数 × 折数），只对 halving 和 random 生效
+        """
+        common = dict(cv=cv, scoring='neg_mean_absolute_error', n_jobs=n_jobs, verbose=0)
+        if search == 'grid':
+            return GridSearchCV(estimator=base_model, param_grid=param_grid, **common)
+        
+        if search == 'random':
+            return RandomizedSearchCV(
+                estimator=base_model,
+                param_distributions=param_grid,
+                n_iter=max(1, budget // cv),
+                random_state=42,
+                **common
+            )
+        
+        # 逐次减半: 以 n_estimators 为资源，每轮保留 1/factor 的候选并把树的数量乘以 factor。
+        # 各轮资源几何递增，总开销约为首轮的 factor/(factor-1) 倍，据此由预算反推候选数
+        factor = 3
+        max_resources = max(param_grid['n_estimators'])
+        distributions = {k: v for k, v in param_grid.items() if k != 'n_estimators'}
+        n_candidates = max(factor, int(budget / (cv * factor / (factor - 1))))
+        return HalvingRandomSearchCV(
+            estimator=base_model,
+            param_distributions=distributions,
+            n_candidates=n_candidates,
+            resource='n_estimators',
+            min_resources=max(10, max_resources // factor ** 2),
+            max_resources=max_resources,
+            factor=factor,
+            random_state=42,
+            **common
+        )
+    
+    def hyper_parameter_tuning(self, df, department_id=None, model_type='xgboost', search=None, budget=None,
+                               use_cache=True, publish=True):
         """
         对模型进行超参数调优
         
@@ -355,6 +473,10 @@ class ModelTrainer:
             df: 训练数据
             department_id: 科室ID用于过滤数据
             model_type: 模型类型
+            search: 搜索方式，'halving'、'random' 或 'grid'，默认 settings.ML_TUNING_SEARCH
+            budget: 计算预算（完整训练次数上限），默认 settings.ML_TUNING_BUDGET
+            use_cache: 使用缓存的科室调优参数，跳过搜索
+            publish: 是否发布调优后的模型文件；为False时只搜索并缓存参数
             
         Returns:
             最佳模型和评估结果
@@ -362,10 +484,19 @@ class ModelTrainer:
         # 如果指定了科室ID，只训练该科室的数据
         if department_id is not None:
             df = df[df['department_id'] == department_id]
-            if len(df) < 50:
+            if len(df) < self.MIN_TUNING_ROWS:
                 logger.warning(f"科室 {department_id} 的训练数据不足，仅有 {len(df)} 条记录，跳过超参数调优")
                 return self.train_model(df, department_id, model_type)
         
+        if model_type not in self.PARAM_GRIDS:
+            logger.warning(f"模型类型 {model_type} 不支持超参数调优，使用默认参数")
+            return self.train_model(df, department_id, model_type)
+        
+        search = search or getattr(settings, 'ML_TUNING_SEARCH', 'halving')
+        budget = budget or getattr(settings, 'ML_TUNING_BUDGET', 60)
+        cv = getattr(settings, 'ML_TUNING_CV', 3)
+        search_jobs, estimator_threads = self._tuning_threads()
+        
         # 准备特征和目标
         X, y = self.prepare_features(df)
         
@@ -374,43 +505,31 @@ class ModelTrainer:
             X, y, test_size=0.2, random_state=42
         )
         
-        # 根据模型类型设置参数网格
         if model_type == 'xgboost':
-            base_model = xgb.XGBRegressor(random_state=42, n_jobs=-1)
-            param_grid = {
-                'n_estimators': [50, 100, 200],
-                'learning_rate': [0.01, 0.05, 0.1],
-                'max_depth': [3, 5, 7],
-                'subsample': [0.6, 0.8, 1.0],
-                'colsample_bytree': [0.6, 0.8, 1.0]
-            }
-        elif model_type == 'random_forest':
-            base_model = RandomForestRegressor(random_state=42, n_jobs=-1)
-            param_grid = {
-                'n_estimators': [50, 100, 200],
-                'max_depth': [None, 10, 20, 30],
-                'min_samples_split': [2, 5, 10],
-                'min_samples_leaf': [1, 2, 4]
-            }
+            base_model = xgb.XGBRegressor(random_state=42, n_jobs=estimator_threads)
         else:
-            logger.warning(f"模型类型 {model_type} 不支持超参数调优，使用默认参数")
-            return self.train_model(df, department_id, model_type)
-        
-        # 使用网格搜索进行超参数调优
-        grid_search = GridSearchCV(
-            estimator=base_model,
-            param_grid=param_grid,
-            cv=5,
-            scoring='neg_mean_absolute_error',
-            verbose=1,
-            n_jobs=-1
-        )
-        
-        # 训练网格搜索模型
-        grid_search.fit(X_train, y_train)
+            base_model = RandomForestRegressor(random_state=42, n_jobs=estimator_threads)
         
-        # 获取最佳模型
-        best_model = grid_search.best_estimator_
+        cached_params = self.load_tuned_params(model_type, department_id) if use_cache else None
+        if cached_params is not None:
+            # 使用缓存的参数直接训练
+            logger.info(f"科室 {department_id} 使用缓存的调优参数: {cached_params}")
+            best_model = base_model.set_params(**cached_params)
+            best_model.fit(X_train, y_train)
+            best_params = cached_params
+        else:
+            tuner = self._build_search(base_model, self.PARAM_GRIDS[model_type], search, budget, cv, search_jobs)
+            logger.info(f"开始超参数调优: 方式 {search}，预算 {budget} 次训练，搜索并行 {search_jobs}，"
+                        f"每个模型 {estimator_threads} 线程")
+            tuner.fit(X_train, y_train)
+            best_model = tuner.best_estimator_
+            best_params = {k: (v.item() if hasattr(v, 'item') else v) for k, v in tuner.best_params_.items()}
+            if search == 'halving':
+                # 最后一轮使用的资源即最佳模型的树数量
+                best_params['n_estimators'] = int(best_model.get_params()['n_estimators'])
+            fits = len(tuner.cv_results_['params']) * cv
+            self.save_tuned_params(model_type, department_id, best_params, tuner.best_score_, search, fits)
+            logger.info(f"超参数搜索结束，共 {fits} 次交叉验证训练")
         
         # 评估最佳模型
         y_pred = best_model.predict(X_test)
@@ -418,10 +537,10 @@ class ModelTrainer:
             'mae': mean_absolute_error(y_test, y_pred),
             'rmse': np.sqrt(mean_squared_error(y_test, y_pred)),
             'r2': r2_score(y_test, y_pred),
-            'best_params': grid_search.best_params_
+            'best_params': best_params
         }
         
-        logger.info(f"超参数调优完成，最佳参数: {grid_search.best_params_}")
+        logger.info(f"超参数调优完成，最佳参数: {best_params}")
         
         # 特征重要性
         importance_df = pd.DataFrame({
@@ -433,10 +552,10 @@ class ModelTrainer:
         metrics['feature_importance'] = importance_df
         
         # 如果指定了科室ID，保存模型
-        if department_id is not None:
-            model_path = os.path.join(self.model_dir, f'{model_type}_tuned_model_{department_id}.pkl')
-            joblib.dump(best_model, model_path)
-            logger.info(f"最佳模型已保存到: {model_path}")
+        if department_id is not None and publish:
+            model_path = os.path.join(self.model_dir, f'{model_type}_tuned_model_{department_id}{model_extension(model_type)}')
+            version = registry_for(model_path).publish(best_model, model_path, metrics, dump=dump_model_file)
+            logger.info(f"最佳模型已发布到: {model_path}（版本 {version}）")
         
         return best_model, metrics
     
@@ -525,13 +644,15 @@ class ModelTrainer:
         
         logger.info(f"已生成科室 {department_id} 的评估图表")
 
-    def train_all_models(self, df=None, algorithm='xgboost'):
+    def train_all_models(self, df=None, algorithm='xgboost', incremental=False, tune=False):
         """
         训练所有科室的等待时间预测模型
         
         Args:
             df: 训练数据，如果为None则从数据收集器获取
             algorithm: 使用的算法，可选值: 'xgboost', 'prophet', 'random_forest', 'gradient_boosting', 'linear'
+            incremental: 增量训练，跳过数据分布未变化的科室，XGBoost在已保存的模型上继续训练
+            tune: 完整训练前为调优参数缺失或过期的科室搜索超参数，训练时使用缓存的参数
             
         Returns:
             bool: 训练是否成功
@@ -578,19 +699,18 @@ class ModelTrainer:
                 if filtered_count < original_count:
                     logger.warning(f"过滤掉了 {original_count - filtered_count} 条不存在科室的数据，剩余 {filtered_count} 条数据")
             
-            # 为每个科室训练模型
-            successful_count = 0
+            # 为每个科室训练模型，每个训练任务只携带该科室的数据
+            jobs = []
             for dept in departments:
-                try:
-                    logger.info(f"开始训练科室 {dept.id}:{dept.name} 的等待时间预测模型，使用算法: {algorithm}")
-                    success = self._train_and_save_model(dept.id, df, algorithm=algorithm)
-                    if success:
-                        successful_count += 1
-                        logger.info(f"科室 {dept.id}:{dept.name} 的等待时间预测模型训练成功")
-                    else:
-                        logger.error(f"科室 {dept.id}:{dept.name} 的等待时间预测模型训练失败")
-                except Exception as e:
-                    logger.error(f"训练科室 {dept.id}:{dept.name} 模型时出错: {str(e)}")
+                dept_df = df[df['department_id'] == dept.id] if 'department_id' in df.columns else df
+                logger.info(f"开始训练科室 {dept.id}:{dept.name} 的等待时间预测模型，使用算法: {algorithm}")
+                jobs.append(TrainingJob(
+                    f"科室 {dept.id}:{dept.name}", train_department_model,
+                    dept.id, dept_df, algorithm, dept.name, incremental, tune
+                ))
+            results = training_orchestrator.run(jobs)
+            successful_count, _ = log_training_report(f"科室模型训练 (算法: {algorithm})", results)
+            self._save_metrics([r['result'] for r in results if r['success'] and not r['result'].get('skipped')])
             
             # 记录训练结果
             logger.info(f"模型训练完成，共有 {successful_count}/{len(departments)} 个科室模型训练成功")
@@ -737,45 +857,151 @@ class ModelTrainer:
         Returns:
             bool: 是否成功训练和保存模型
         """
+        department_name = None
+        try:
+            dept = Department.objects.filter(id=department_id).first()
+            if dept:
+                department_name = dept.name
+        except Exception:
+            pass
+        
+        metrics_data = self._fit_department_model(department_id, df, algorithm, department_name)
+        if metrics_data is None:
+            return False
+        self._save_metrics([metrics_data])
+        return True
+    
+    def _model_path(self, algorithm, department_id):
+        """科室模型文件路径，与 train_model 保存的位置一致"""
+        return os.path.join(self.model_dir, f'{algorithm}_model_{department_id}{model_extension(algorithm)}')
+    
+    def _fit_department_model(self, department_id, df, algorithm='xgboost', department_name=None, incremental=False,
+                              tune=False):
+        """训练并保存单个科室的模型和评估图表，不访问数据库
+        
+        Args:
+            incremental: 增量训练，数据分布未变化时跳过，XGBoost在已保存的模型上继续训练
+            tune: 完整训练前在调优参数缺失或过期时搜索超参数
+        
+        Returns:
+            dict: 性能指标（跳过时包含 skipped 和 reason），训练失败时返回None
+        """
+        model_path = self._model_path(algorithm, department_id)
+        if 'department_id' in df.columns:
+            df = df[df['department_id'] == department_id]
+        
+        state = None
+        if incremental and 'timestamp' in df.columns and os.path.exists(model_path):
+            state = load_state(model_path)
+        if state is not None:
+            new_rows = rows_after(df, 'timestamp', get_watermark(state))
+            min_rows = getattr(settings, 'ML_INCREMENTAL_MIN_ROWS', 20)
+            if len(new_rows) < min_rows:
+                return {'skipped': True, 'reason': f'新数据 {len(new_rows)} 条，少于 {min_rows} 条'}
+            
+            shifted, _, reason = detect_shift(state.get('profile'), new_rows['actual_wait_time'])
+            if not shifted:
+                return {'skipped': True, 'reason': f'数据分布未变化，{reason}'}
+            logger.info(f"科室 {department_id} 数据分布发生变化，{reason}")
+            
+            if algorithm == 'xgboost':
+                return self._continue_boosting(department_id, df, new_rows, model_path, department_name)
+            # 其他算法不支持在已有模型上继续训练，分布变化时完整重新训练
+        
         logger.info(f"开始训练科室 {department_id} 的模型，使用 {len(df)} 条数据")
         
+        if (tune and algorithm in self.PARAM_GRIDS and len(df) >= self.MIN_TUNING_ROWS
+                and self.load_tuned_params(algorithm, department_id) is None):
+            # 只搜索并缓存参数，下面的训练通过 load_tuned_params 使用这些参数
+            self.hyper_parameter_tuning(df, department_id, algorithm, use_cache=False, publish=False)
+        
         # 调用训练方法
         model, metrics = self.train_model(df, department_id=department_id, model_type=algorithm)
         
         if model is None:
             logger.error(f"科室 {department_id} 模型训练失败，返回了None")
-            return False
+            return None
             
         # 训练成功
         mae = metrics.get('mae', 0)
         r2 = metrics.get('r2', 0)
         logger.info(f"科室 {department_id} 模型训练完成，MAE: {mae:.2f}, R²: {r2:.2f}")
         
-        # 保存性能指标到JSON文件
+        # 生成评估图表
         try:
-            import json
+            if algorithm != 'prophet':
+                X, y = self.prepare_features(df)
+                self.generate_evaluation_plots(model, X, y, department_id)
+        except Exception as e:
+            logger.warning(f"生成科室 {department_id} 的评估图表失败: {str(e)}")
+        
+        self._save_training_state(model_path, df)
+        return self._metrics_data(department_id, department_name, algorithm, metrics, len(df), 'full')
+    
+    def _continue_boosting(self, department_id, df, new_rows, model_path, department_name=None):
+        """在已保存的XGBoost模型上用新数据继续提升
+        
+        新数据全部用于训练：水位线随后推进到这些数据之后，留出的部分以后不会再被训练。
+        评估指标在同一批新数据上计算，在 manifest 中标记为 evaluated_on=training_rows。
+        
+        Args:
+            df: 科室在回溯窗口内的全部数据，用于更新分布记录
+            new_rows: 上次训练之后的新数据
+        """
+        try:
+            model, _ = registry_for(model_path).load(model_path, load_model_file)
+            X, y = self.prepare_features(new_rows.copy())
             
-            # 构建性能指标数据
-            department_name = None
-            try:
-                from navigation.models import Department
-                dept = Department.objects.filter(id=department_id).first()
-                if dept:
-                    department_name = dept.name
-            except:
-                pass
-                
-            metrics_data = {
-                'department_id': department_id,
-                'department_name': department_name or f'科室 {department_id}',
-                'model_type': algorithm,
-                'mae': mae,
-                'rmse': metrics.get('rmse', 0),
-                'r2': r2,
-                'accuracy': 100 - min(100, mae), # 简单估算准确率
-                'sample_count': len(df),
-                'training_time': pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')
+            rounds = getattr(settings, 'ML_INCREMENTAL_BOOST_ROUNDS', 20)
+            booster = model.get_booster()
+            model.set_params(n_estimators=rounds, n_jobs=self.n_jobs)
+            model.fit(X, y, xgb_model=booster)
+            
+            y_pred = model.predict(X)
+            metrics = {
+                'mae': mean_absolute_error(y, y_pred),
+                'rmse': np.sqrt(mean_squared_error(y, y_pred)),
+                'r2': r2_score(y, y_pred)
             }
+            registry_for(model_path).publish(
+                model, model_path, dict(metrics, training_mode='incremental', evaluated_on='training_rows'),
+                dump=dump_model_file
+            )
+            logger.info(f"科室 {department_id} 模型增量训练完成，新增 {rounds} 轮，使用 {len(new_rows)} 条新数据，"
+                        f"MAE: {metrics['mae']:.2f}")
+        except Exception as e:
+            logger.error(f"科室 {department_id} 增量训练失败: {str(e)}", exc_info=True)
+            return None
+        
+        self._save_training_state(model_path, df)
+        return self._metrics_data(department_id, department_name, 'xgboost', metrics, len(new_rows), 'incremental')
+    
+    def _save_training_state(self, model_path, df):
+        """记录本次训练数据的水位线和目标值分布，供增量训练使用"""
+        watermark = pd.to_datetime(df['timestamp']).max() if 'timestamp' in df.columns else None
+        save_state(model_path, watermark, df['actual_wait_time'])
+    
+    def _metrics_data(self, department_id, department_name, algorithm, metrics, sample_count, mode):
+        mae = metrics.get('mae', 0)
+        return {
+            'department_id': department_id,
+            'department_name': department_name or f'科室 {department_id}',
+            'model_type': algorithm,
+            'mae': float(mae),
+            'rmse': float(metrics.get('rmse', 0)),
+            'r2': float(metrics.get('r2', 0)),
+            'accuracy': float(100 - min(100, mae)), # 简单估算准确率
+            'sample_count': sample_count,
+            'training_mode': mode,
+            'training_time': pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+    
+    def _save_metrics(self, metrics_list):
+        """将各科室的性能指标合并写入JSON文件（只在主进程中写入，避免并发覆盖）"""
+        if not metrics_list:
+            return
+        try:
+            import json
             
             # 读取现有的指标文件
             metrics_file = os.path.join(settings.BASE_DIR, 'navigation', 'ml', 'model_metrics.json')
@@ -788,27 +1014,24 @@ class ModelTrainer:
                 except Exception as e:
                     logger.error(f"读取模型性能指标文件时出错: {str(e)}")
             
-            # 更新当前科室的指标
-            all_metrics[str(department_id)] = metrics_data
+            # 更新各科室的指标
+            for metrics_data in metrics_list:
+                all_metrics[str(metrics_data['department_id'])] = metrics_data
             
             # 保存回文件
             with open(metrics_file, 'w') as f:
                 json.dump(all_metrics, f, indent=2)
                 
-            logger.info(f"已保存科室 {department_id} 的性能指标到文件")
+            logger.info(f"已保存 {len(metrics_list)} 个科室的性能指标到文件")
             
         except Exception as e:
             logger.error(f"保存性能指标时出错: {str(e)}")
-        
-        # 生成评估图表
-        try:
-            if algorithm != 'prophet':
-                X, y = self.prepare_features(df)
-                self.generate_evaluation_plots(model, X, y, department_id)
-        except Exception as e:
-            logger.warning(f"生成科室 {department_id} 的评估图表失败: {str(e)}")
-        
-        return True
+
+
+def train_department_model(department_id, df, algorithm='xgboost', department_name=None, incremental=False,
+                           tune=False):
+    """训练单个科室的模型，供训练进程池调用"""
+    return model_trainer._fit_department_model(department_id, df, algorithm, department_name, incremental, tune)
 
 
 # 创建全局实例
@@ -0,0 +1,172 @@
+"""
+模型训练编排 - 将各科室/检查项目的模型训练分发到进程池并行执行
+
+调用方先一次性加载共享的训练数据，为每个模型切出自己的数据子集，再把训练任务交给
+TrainingOrchestrator。每个任务在子进程中执行并计时，异常不会中断其他任务，
+全部结束后统一汇总每个模型的耗时和失败原因。
+
+任务函数必须是模块级函数（可被pickle），参数只包含该模型需要的数据。
+
+Celery prefork 的工作进程是守护进程，标准库的 multiprocessing 不允许守护进程创建子进程，
+此时改用 Celery 自带的 billiard 进程池，训练仍然并行执行。
+"""
+import logging
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class TrainingJob:
+    """一个模型训练任务"""
+
+    def __init__(self, name, func, *args):
+        self.name = name
+        self.func = func
+        self.args = args
+
+
+def _init_worker():
+    """子进程初始化: 确保Django已加载，并限制单个模型训练使用的线程数，避免进程间争抢CPU"""
+    import django
+    django.setup()
+
+    from navigation.ml.trainer import model_trainer
+    model_trainer.n_jobs = 1
+
+
+def _execute(name, func, args):
+    """执行单个训练任务并计时，返回可pickle的结果字典"""
+    start = time.perf_counter()
+    try:
+        result = func(*args)
+        error = None if result not in (None, False) else '训练未产生模型'
+    except Exception as e:
+        logger.error(f"训练任务 {name} 出错: {str(e)}\n{traceback.format_exc()}")
+        result, error = None, str(e)
+    return {
+        'name': name,
+        'success': error is None,
+        'duration': time.perf_counter() - start,
+        'error': error,
+        'result': result if isinstance(result, dict) else None,
+    }
+
+
+def _failed(job, error):
+    """子进程崩溃或参数无法序列化时的结果"""
+    logger.error(f"训练任务 {job.name} 执行失败: {str(error)}")
+    return {
+        'name': job.name,
+        'success': False,
+        'duration': None,
+        'error': str(error),
+        'result': None,
+    }
+
+
+class TrainingOrchestrator:
+    """在进程池中并行执行模型训练任务"""
+
+    @property
+    def max_workers(self):
+        workers = getattr(settings, 'ML_TRAINING_WORKERS', None)
+        return workers or os.cpu_count() or 1
+
+
+    def run(self, jobs, max_workers=None):
+        """
+        执行训练任务
+
+        参数:
+        - jobs: TrainingJob 列表
+        - max_workers: 进程数，为None时使用 settings.ML_TRAINING_WORKERS 或CPU核数
+
+        返回:
+        - list: 与 jobs 顺序一致的结果，每项包含 name、success、duration、error、result
+        """
+        jobs = list(jobs)
+        workers = min(max_workers or self.max_workers, len(jobs))
+        if workers <= 1:
+            return [_execute(job.name, job.func, job.args) for job in jobs]
+
+        # 子进程不能复用父进程的数据库连接
+        connections.close_all()
+
+        if multiprocessing.current_process().daemon:
+            return self._run_billiard(jobs, workers)
+        return self._run_executor(jobs, workers)
+
+    def _run_executor(self, jobs, workers):
+        """普通进程中使用标准库进程池"""
+        results = {}
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            futures = {
+                executor.submit(_execute, job.name, job.func, job.args): index
+                for index, job in enumerate(jobs)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    results[index] = _failed(jobs[index], e)
+        return [results[index] for index in range(len(jobs))]
+
+    def _run_billiard(self, jobs, workers):
+        """Celery 守护进程中使用 billiard 进程池，它允许守护进程创建子进程"""
+        from billiard.pool import Pool
+
+        logger.info(f"当前进程为守护进程，使用 billiard 进程池并行训练 ({workers} 个进程)")
+        pool = Pool(processes=workers, initializer=_init_worker)
+        try:
+            pending = [pool.apply_async(_execute, (job.name, job.func, job.args)) for job in jobs]
+            results = []
+            for job, async_result in zip(jobs, pending):
+                try:
+                    results.append(async_result.get())
+                except Exception as e:
+                    results.append(_failed(job, e))
+        finally:
+            pool.close()
+            pool.join()
+        return results
+
+
+def log_training_report(title, results):
+    """
+    汇总并记录训练结果
+
+    返回:
+    - (success_count, fail_count)
+    """
+    success_count = sum(1 for r in results if r['success'])
+    fail_count = len(results) - success_count
+    skipped_count = sum(1 for r in results if r['success'] and (r['result'] or {}).get('skipped'))
+    total_time = sum(r['duration'] or 0 for r in results)
+
+    lines = [
+        f"{title}: {success_count}个成功（其中{skipped_count}个无需训练）, {fail_count}个失败, "
+        f"累计训练耗时 {total_time:.1f}秒"
+    ]
+    for r in sorted(results, key=lambda r: -(r['duration'] or 0)):
+        duration = f"{r['duration']:.1f}秒" if r['duration'] is not None else '-'
+        if not r['success']:
+            status = f"失败: {r['error']}"
+        elif (r['result'] or {}).get('skipped'):
+            status = f"跳过: {r['result'].get('reason')}"
+        else:
+            status = '成功'
+        lines.append(f"  {r['name']}: {duration} {status}")
+    logger.info('\n'.join(lines))
+    return success_count, fail_count
+
+
+# 全局训练编排实例
+training_orchestrator = TrainingOrchestrator()
@@ -1,6 +1,7 @@
 from .notification_template import NotificationTemplate, NotificationCategory, NotificationTemplateVersion
 from .notification_stats import NotificationStats
 from .patient import Patient
+from .patient_name_gram import PatientNameGram
 from .department import Department
 from .equipment import Equipment
 from .examination import Examination
@@ -14,6 +15,7 @@ __all__ = [
     'NotificationTemplateVersion',
     'NotificationStats',
     'Patient',
+    'PatientNameGram',
     'Department',
     'Equipment',
     'Examination',
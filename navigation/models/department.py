@@ -42,25 +42,46 @@ class Department(models.Model):
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def annotate_queue_stats(queryset):
+        """
+        为科室查询集添加 waiting_queue_count（等待人数）和 recent_average_wait_time
+        （过去24小时完成队列的平均等待时间）注解
+
+        列表接口用一次查询得到所有科室的统计，get_current_queue_length 和
+        get_average_wait_time 优先使用这两个注解。
+        """
+        from django.db.models import Avg, Count, Q
+
+        return queryset.annotate(
+            waiting_queue_count=Count('queue', filter=Q(queue__status='waiting')),
+            recent_average_wait_time=Avg(
+                'queue__actual_wait_time',
+                filter=Q(queue__status='completed', queue__end_time__gte=_average_wait_time_since())
+            ),
+        )
+
     def get_current_queue_length(self):
         """获取当前等待队列长度"""
+        if hasattr(self, 'waiting_queue_count'):
+            return self.waiting_queue_count
         return self.queue_set.filter(status='waiting').count()
 
     def get_average_wait_time(self):
         """计算平均等待时间（分钟）"""
         from django.db.models import Avg
-        from django.utils import timezone
-        from datetime import timedelta
 
-        # 获取过去24小时内完成的队列
-        yesterday = timezone.now() - timedelta(days=1)
-        completed_queues = self.queue_set.filter(
-            status='completed',
-            end_time__gte=yesterday
-        )
-        avg_wait_time = completed_queues.aggregate(
-            Avg('actual_wait_time')
-        )['actual_wait_time__avg']
+        if hasattr(self, 'recent_average_wait_time'):
+            avg_wait_time = self.recent_average_wait_time
+        else:
+            # 获取过去24小时内完成的队列
+            completed_queues = self.queue_set.filter(
+                status='completed',
+                end_time__gte=_average_wait_time_since()
+            )
+            avg_wait_time = completed_queues.aggregate(
+                Avg('actual_wait_time')
+            )['actual_wait_time__avg']
         
         return round(avg_wait_time) if avg_wait_time else self.average_service_time
 
@@ -77,3 +98,11 @@ class Department(models.Model):
             return start_time <= current_time <= end_time
         except ValueError:
             return False
+
+
+def _average_wait_time_since():
+    """平均等待时间的统计起点: 过去24小时"""
+    from django.utils import timezone
+    from datetime import timedelta
+
+    return timezone.now() - timedelta(days=1)
@@ -55,30 +55,58 @@ class Examination(models.Model):
     def __str__(self):
         return f"{self.name}({self.code})"
 
+    @staticmethod
+    def prefetch_available_equipment(queryset):
+        """
+        为检查项目查询集预取可用设备及各设备的等待人数（available_equipment_list，
+        设备带 waiting_count 注解）
+
+        列表接口用一次额外查询代替逐项查询，get_available_equipment_count 和
+        estimate_wait_time 优先使用预取结果。
+        """
+        from django.db.models import Count, Prefetch, Q
+        from .equipment import Equipment
+
+        return queryset.prefetch_related(Prefetch(
+            'equipment_type',
+            queryset=Equipment.objects.filter(status='available').annotate(
+                waiting_count=Count('queue', filter=Q(queue__status='waiting'))
+            ),
+            to_attr='available_equipment_list',
+        ))
+
     def get_available_equipment(self):
         """获取当前可用的设备列表"""
         return self.equipment_type.filter(status='available')
 
+    def get_available_equipment_count(self):
+        """当前可用的设备数量"""
+        if hasattr(self, 'available_equipment_list'):
+            return len(self.available_equipment_list)
+        return self.get_available_equipment().count()
+
     def estimate_wait_time(self, department=None):
         """估算当前检查项目的等待时间"""
-        available_equipment = self.get_available_equipment()
-        if not available_equipment:
-            return float('inf')
-        
-        if department:
-            available_equipment = available_equipment.filter(
-                department=department
-            )
-            if not available_equipment:
-                return float('inf')
-        
-        # 找到等待时间最短的设备
-        min_wait_time = float('inf')
-        for equipment in available_equipment:
-            current_queues = equipment.queue_set.filter(
-                status='waiting'
-            ).count()
-            wait_time = current_queues * equipment.average_service_time
-            min_wait_time = min(min_wait_time, wait_time)
+        if hasattr(self, 'available_equipment_list'):
+            equipment_waiting = [
+                (equipment, equipment.waiting_count)
+                for equipment in self.available_equipment_list
+                if not department or equipment.department_id == department.id
+            ]
+        else:
+            available_equipment = self.get_available_equipment()
+            if department:
+                available_equipment = available_equipment.filter(
+                    department=department
+                )
+            equipment_waiting = [
+                (equipment, equipment.queue_set.filter(status='waiting').count())
+                for equipment in available_equipment
+            ]
         
-        return min_wait_time
+        # 找到等待时间最短的设备，没有可用设备时为无穷大
+        return min(
+            (current_queues * equipment.average_service_time
+             for equipment, current_queues in equipment_waiting),
+            default=float('inf')
+        )
@@ -0,0 +1,101 @@
+from django.db import models, transaction
+from django.db.models import Count
+
+
+class PatientNameGram(models.Model):
+    """
+    患者姓名的N元组索引表，用于按姓名片段搜索患者
+
+    每个患者的姓名（转为小写）拆成单字和相邻两字，各存一行。中文姓名通常只有2到4个字，
+    三元组无法覆盖两字姓名，因此使用一元和二元组。搜索时先通过 gram 索引找出包含查询词所有二元组的患者，
+    再用姓名子串条件排除字序不连续的结果，避免对患者表做 LIKE '%词%' 全表扫描。
+
+    患者保存时由信号自动维护；bulk_create 等不触发信号的批量写入需要调用 rebuild()。
+    """
+
+    patient = models.ForeignKey(
+        'navigation.Patient',
+        on_delete=models.CASCADE,
+        related_name='name_grams',
+        verbose_name='患者'
+    )
+    gram = models.CharField('姓名片段', max_length=2)
+
+    class Meta:
+        verbose_name = '患者姓名索引'
+        verbose_name_plural = '患者姓名索引'
+        constraints = [
+            models.UniqueConstraint(fields=['gram', 'patient'], name='patient_name_gram_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.gram}({self.patient_id})"
+
+    @staticmethod
+    def normalize(name):
+        """姓名规范化: 转为小写，与搜索时的 name__icontains 复核一致"""
+        return (name or '').casefold()
+
+    @classmethod
+    def grams_for(cls, name):
+        """姓名的全部单字和二元组"""
+        name = cls.normalize(name)
+        return set(name) | {name[i:i + 2] for i in range(len(name) - 1)}
+
+    @classmethod
+    def query_grams(cls, term):
+        """
+        查询词需要匹配的片段: 多字查询只需相邻两字的二元组，单字查询使用单字本身
+        """
+        term = cls.normalize(term)
+        if len(term) < 2:
+            return set(term)
+        return {term[i:i + 2] for i in range(len(term) - 1)}
+
+    @classmethod
+    def rebuild(cls, patients):
+        """
+        重建一组患者的姓名索引，只写入有变化的患者
+
+        返回:
+        - int: 重建了索引的患者数
+        """
+        patients = [patient for patient in patients if patient.pk]
+        if not patients:
+            return 0
+
+        existing = {}
+        for patient_id, gram in cls.objects.filter(
+            patient_id__in=[patient.pk for patient in patients]
+        ).values_list('patient_id', 'gram'):
+            existing.setdefault(patient_id, set()).add(gram)
+
+        changed = [
+            patient for patient in patients
+            if cls.grams_for(patient.name) != existing.get(patient.pk, set())
+        ]
+        if not changed:
+            return 0
+
+        with transaction.atomic():
+            cls.objects.filter(patient_id__in=[patient.pk for patient in changed]).delete()
+            cls.objects.bulk_create([
+                cls(patient_id=patient.pk, gram=gram)
+                for patient in changed
+                for gram in sorted(cls.grams_for(patient.name))
+            ], batch_size=1000)
+        return len(changed)
+
+    @classmethod
+    def matching_patient_ids(cls, term):
+        """
+        包含所有查询片段的患者ID查询集（可作为子查询），查询词为空时返回None
+
+        结果是候选集，字序是否连续需要调用方再用 name__icontains 确认
+        """
+        grams = cls.query_grams(term)
+        if not grams:
+            return None
+        return cls.objects.filter(gram__in=grams).values('patient_id').annotate(
+            matched=Count('gram')
+        ).filter(matched=len(grams)).values('patient_id')
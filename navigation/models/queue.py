@@ -1,15 +1,17 @@
-from django.db import models
+from django.db import connection, models
 from django.core.validators import MinValueValidator
 from django.utils import timezone
 from django.core.exceptions import ValidationError
-from django.db.models import Avg, Count, F, ExpressionWrapper, fields
-from datetime import timedelta
+from django.db.models import Avg, Count, F, ExpressionWrapper, Q, Window, fields
+from django.db.models.functions import Rank
+from datetime import datetime, timedelta
 import re
 import hashlib
 import logging
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
+logger = logging.getLogger(__name__)
 
 class Queue(models.Model):
     """排队队列模型"""
@@ -82,15 +84,40 @@ class Queue(models.Model):
         verbose_name = '排队队列'
         verbose_name_plural = '排队队列'
         ordering = ['-priority', 'enter_time']
+        # 按热点查询的条件顺序建立的组合索引，可用 manage.py explain_hot_queries 检查执行计划。
+        # queue_number 的唯一约束自带索引；原 (-priority, enter_time) 索引由等待队列的部分索引代替
         indexes = [
             models.Index(fields=['status']),
-            models.Index(fields=['queue_number']),
-            models.Index(fields=['-priority', 'enter_time']),
+            # 排队位置、等待人数和位置重算: 科室内的等待队列按优先级和进入时间排序
+            models.Index(
+                fields=['department', '-priority', 'enter_time', 'id'],
+                condition=Q(status='waiting'),
+                name='queue_waiting_position_idx'
+            ),
+            # estimate_initial_wait_time: 检查项目近30天已完成队列
+            models.Index(fields=['examination', 'status', 'enter_time'], name='queue_exam_status_enter_idx'),
+            # clean() 每日接诊量和科室近期统计
+            models.Index(fields=['department', 'created_at'], name='queue_dept_created_idx'),
+            # 科室平均等待时间: 最近完成的队列
+            models.Index(
+                fields=['department', 'end_time'],
+                condition=Q(status='completed'),
+                name='queue_completed_end_idx'
+            ),
+            # 游标分页 (enter_time, id)
+            models.Index(fields=['enter_time', 'id'], name='queue_enter_time_id_idx'),
         ]
 
     def __str__(self):
         return f"{self.department.name}-{self.queue_number}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 记录加载时的科室，便于科室变更时同步排队位置索引
+        instance._loaded_department_id = instance.__dict__.get('department_id')
+        return instance
+
     def clean(self):
         """验证队列数据"""
         super().clean()
@@ -109,10 +136,12 @@ class Queue(models.Model):
         
         # 验证是否超出科室每日最大接诊量
         if self.department.max_daily_patients:
-            today = timezone.now().date()
+            # 使用当天的时间范围而不是 created_at__date，后者对每行做时区转换，无法使用索引
+            day_start = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time()))
             daily_count = Queue.objects.filter(
                 department=self.department,
-                created_at__date=today
+                created_at__gte=day_start,
+                created_at__lt=day_start + timedelta(days=1)
             ).count()
             if daily_count >= self.department.max_daily_patients:
                 raise ValidationError('该科室今日预约已满')
@@ -145,6 +174,12 @@ class Queue(models.Model):
         
         super().save(*args, **kwargs)
 
+        # post_save 接收器（排队位置索引和科室广播）都已读取变更前的科室，此后以当前科室为准，
+        # 同一实例再次变更科室（A→B→A）时才能找到正确的原科室
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'department', 'department_id'} & set(update_fields):
+            self._loaded_department_id = self.department_id
+
     def generate_queue_number(self):
         """生成队列号"""
         now = timezone.now()
@@ -178,7 +213,7 @@ class Queue(models.Model):
     def estimate_initial_wait_time(self):
         """预估初始等待时间"""
         try:
-            from navigation.ml.prophet_predictor import get_prophet_predictor
+            from navigation.ml.inference import prophet_forecast
             
             # 获取当前等待和处理中的队列数量（考虑优先级）
             waiting_queues = Queue.objects.filter(
@@ -252,42 +287,22 @@ class Queue(models.Model):
             
             # 优先使用检查项目级别的Prophet模型
             try:
-                # 获取检查项目的Prophet预测器
-                predictor = get_prophet_predictor(examination_id=self.examination.id)
-                if predictor and predictor.model:
-                    # 使用Prophet预测，传入当前队列数量作为额外信息
-                    prophet_wait_time = predictor.predict(
-                        date=timezone.now(), 
-                        queue_count=position
-                    )
+                # 优先查询预计算的预测表，不需要在Web进程中导入Prophet
+                prophet_wait_time = prophet_forecast(timezone.now(), examination_id=self.examination.id)
             except Exception as e:
                 logger.warning(f"使用检查项目Prophet模型预测失败: {str(e)}")
             
             # 如果检查项目级别失败，尝试科室级别
             if prophet_wait_time is None:
                 try:
-                    # 获取科室的Prophet预测器
-                    predictor = get_prophet_predictor(department_id=self.department.id)
-                    if predictor and predictor.model:
-                        # 使用Prophet预测，传入当前队列数量作为额外信息
-                        prophet_wait_time = predictor.predict(
-                            date=timezone.now(), 
-                            queue_count=position
-                        )
+                    prophet_wait_time = prophet_forecast(timezone.now(), department_id=self.department.id)
                 except Exception as e:
                     logger.warning(f"使用科室Prophet模型预测失败: {str(e)}")
             
             # 如果科室级别也失败，尝试全局模型
             if prophet_wait_time is None:
                 try:
-                    # 获取全局Prophet预测器
-                    predictor = get_prophet_predictor()
-                    if predictor and predictor.model:
-                        # 使用Prophet预测，传入当前队列数量作为额外信息
-                        prophet_wait_time = predictor.predict(
-                            date=timezone.now(), 
-                            queue_count=position
-                        )
+                    prophet_wait_time = prophet_forecast(timezone.now())
                 except Exception as e:
                     logger.warning(f"使用全局Prophet模型预测失败: {str(e)}")
             
@@ -330,7 +345,6 @@ class Queue(models.Model):
             return round(final_wait_time)
             
         except Exception as e:
-            logger = logging.getLogger(__name__)
             logger.error(f"预估等待时间出错: {str(e)}")
             
             # 使用传统方法的简化版本作为后备
@@ -375,23 +389,23 @@ class Queue(models.Model):
             try:
                 from .queue_history import QueueHistory
                 QueueHistory.create_from_queue(self)
-                logger = logging.getLogger(__name__)
                 logger.info(f"为队列 {self.queue_number} 创建了历史记录，状态: {new_status}")
             except Exception as e:
-                logger = logging.getLogger(__name__)
                 logger.error(f"创建队列历史记录失败: {str(e)}")
 
     def get_position(self):
-        """获取在队列中的位置"""
+        """获取在队列中的位置（从1开始），由科室排队位置索引提供"""
         if self.status != 'waiting':
             return None
-            
-        return Queue.objects.filter(
-            department=self.department,
-            status='waiting',
-            priority__gte=self.priority,
-            enter_time__lte=self.enter_time
-        ).count()
+
+        from navigation.utils.queue_index import queue_index
+        return queue_index.get_position(self)
+
+    @property
+    def ahead_count(self):
+        """排在前面的人数"""
+        from navigation.utils.queue_index import queue_index
+        return queue_index.get_ahead_count(self)
 
     @property
     def is_delayed(self):
@@ -409,23 +423,73 @@ class Queue(models.Model):
             self.estimated_wait_time = new_estimate
             self.save(update_fields=['estimated_wait_time'])
             
+    @staticmethod
+    def annotate_positions(queues):
+        """
+        为一组队列对象设置 position 属性: 等待中的队列在科室内的位置（从1开始），其他为None
+
+        整页只执行一次窗口函数查询:
+        RANK() OVER (PARTITION BY department_id ORDER BY priority DESC, enter_time, id)，
+        排序与 Meta.ordering 和排队位置索引一致。窗口需要覆盖科室内全部等待队列，
+        因此查询涉及科室的所有等待队列，再取出本页的位置。
+        """
+        queues = list(queues)
+        department_ids = {queue.department_id for queue in queues if queue.status == 'waiting'}
+        positions = {}
+        if department_ids:
+            positions = dict(
+                Queue.objects.filter(status='waiting', department_id__in=department_ids)
+                .annotate(position=Window(
+                    Rank(),
+                    partition_by=F('department_id'),
+                    order_by=[F('priority').desc(), F('enter_time').asc(), F('id').asc()],
+                ))
+                .values_list('id', 'position')
+            )
+        for queue in queues:
+            queue.position = positions.get(queue.id) if queue.status == 'waiting' else None
+        return queues
+
+    @staticmethod
+    def search_filter(term):
+        """
+        前台搜索的查询条件，每一项都能走索引:
+
+        - 队列号前缀（完整队列号是长度最长的前缀）: startswith。PostgreSQL 上 Django 为唯一的
+          queue_number 自动建立 varchar_pattern_ops 索引，MySQL 的前缀 LIKE 直接使用唯一索引；
+          SQLite 的 LIKE 不区分大小写、用不上索引，但其默认按码点（BINARY）比较，
+          只在 SQLite 上附加等价的范围条件走唯一索引
+        - 身份证号、病历号精确匹配: 患者表的唯一索引
+        - 姓名片段: PatientNameGram 索引表找出候选患者，再在候选集内确认子串
+
+        队列号和证件号区分大小写；查询词为空时返回None
+        """
+        from .patient import Patient
+        from .patient_name_gram import PatientNameGram
+
+        term = (term or '').strip()
+        if not term:
+            return None
+
+        patients = Q(id_number=term) | Q(medical_record_number=term)
+        name_candidates = PatientNameGram.matching_patient_ids(term)
+        if name_candidates is not None:
+            patients |= Q(pk__in=name_candidates, name__icontains=term)
+
+        prefix = Q(queue_number__startswith=term)
+        if connection.vendor == 'sqlite':
+            # 范围条件依赖码点排序，ICU/区域排序规则下不成立，只用于 SQLite
+            prefix &= Q(queue_number__gte=term, queue_number__lt=term + '\U0010ffff')
+        return prefix | Q(patient_id__in=Patient.objects.filter(patients).values('pk'))
+
     @staticmethod
     def recalculate_all_wait_times():
         """重新计算所有等待中的队列的等待时间"""
-        # 获取所有等待中的队列
-        waiting_queues = Queue.objects.filter(status='waiting')
-        
-        updated_count = 0
-        for queue in waiting_queues:
-            old_wait_time = queue.estimated_wait_time
-            new_wait_time = queue.estimate_initial_wait_time()
-            
-            if old_wait_time != new_wait_time:
-                queue.estimated_wait_time = new_wait_time
-                queue.save(update_fields=['estimated_wait_time'])
-                updated_count += 1
-        
-        return updated_count
+        from navigation.utils.wait_time import BatchWaitTimeEstimator
+
+        # 批量计算并通过一次 bulk_update 写回
+        changed = BatchWaitTimeEstimator().update()
+        return len(changed)
 
 @receiver(post_save, sender=Queue)
 def queue_post_save(sender, instance, created, **kwargs):
@@ -436,3 +500,21 @@ def queue_post_save(sender, instance, created, **kwargs):
         record.finish_time = instance.end_time
         record.status = instance.status
         record.save()
+
+
+@receiver(post_save, sender=Queue)
+def sync_queue_index_on_save(sender, instance, update_fields=None, **kwargs):
+    """队列保存后同步科室排队位置索引"""
+    from navigation.utils.queue_index import queue_index, ORDERING_FIELDS
+
+    if update_fields is not None and not (set(update_fields) & ORDERING_FIELDS):
+        return
+    queue_index.sync(instance, getattr(instance, '_loaded_department_id', None))
+
+
+@receiver(post_delete, sender=Queue)
+def sync_queue_index_on_delete(sender, instance, **kwargs):
+    """队列删除后从科室排队位置索引中移除"""
+    from navigation.utils.queue_index import queue_index
+
+    queue_index.remove(instance, getattr(instance, '_loaded_department_id', None))
@@ -36,6 +36,13 @@ class QueueHistory(models.Model):
             models.Index(fields=['queue_number']),
             models.Index(fields=['enter_time']),
             models.Index(fields=['exit_time']),
+            # QueueDataCollector 按创建时间范围读取已结束的历史记录，可再按科室和检查项目筛选
+            models.Index(
+                fields=['created_at', 'status', 'department', 'examination'],
+                name='history_collect_idx'
+            ),
+            # 患者历史记录的游标分页
+            models.Index(fields=['patient', 'enter_time', 'id'], name='history_patient_enter_idx'),
         ]
         
     def __str__(self):
@@ -0,0 +1,19 @@
+"""
+队列和历史记录接口的游标分页
+
+按 (enter_time, id) 排序的游标分页不执行 COUNT(*)，也不使用 OFFSET 跳过前面的行，
+翻到第几页的开销都相同，适合数月的 Queue 和 QueueHistory 数据。
+"""
+from rest_framework.pagination import CursorPagination
+
+
+class QueueCursorPagination(CursorPagination):
+    """按进入队列时间从早到晚分页"""
+    ordering = ('enter_time', 'id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class RecentQueueCursorPagination(QueueCursorPagination):
+    """按进入队列时间从新到旧分页，用于搜索和历史记录"""
+    ordering = ('-enter_time', '-id')
@@ -5,6 +5,7 @@ from . import consumers
 websocket_urlpatterns = [
     # 使用简单的路径模式，不使用起始^字符，以便更好地匹配
     re_path(r'ws/queue_updates/$', consumers.QueueConsumer.as_asgi()),
+    re_path(r'ws/queue_updates/(?P<department_code>[\w-]+)/$', consumers.QueueConsumer.as_asgi()),
     re_path(r'ws/notifications/$', consumers.NotificationConsumer.as_asgi()),
     re_path(r'ws/queue/(?P<queue_id>\d+)/$', consumers.QueueStatusConsumer.as_asgi()),
 ] 
\ No newline at end of file
@@ -1,9 +1,12 @@
+from django.conf import settings
+from django.db import models
 from rest_framework import serializers
 from .models.patient import Patient
 from .models.department import Department
 from .models.equipment import Equipment
 from .models.examination import Examination
 from .models.queue import Queue
+from .models.queue_history import QueueHistory
 from .models.notification_template import NotificationTemplate
 import re
 
@@ -88,12 +91,20 @@ class ExaminationSerializer(serializers.ModelSerializer):
         ]
 
     def get_available_equipment_count(self, obj):
-        return obj.get_available_equipment().count()
+        return obj.get_available_equipment_count()
 
     def get_estimated_wait_time(self, obj):
         return obj.estimate_wait_time()
 
 
+class QueueListSerializer(serializers.ListSerializer):
+    """队列列表: 整页的排队位置用一次查询批量计算"""
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        return super().to_representation(Queue.annotate_positions(iterable))
+
+
 class QueueSerializer(serializers.ModelSerializer):
     patient_name = serializers.CharField(source='patient.name', read_only=True)
     department_name = serializers.CharField(source='department.name', read_only=True)
@@ -114,11 +125,52 @@ class QueueSerializer(serializers.ModelSerializer):
             'queue_number', 'actual_wait_time', 'start_time', 'end_time',
             'position'
         ]
+        list_serializer_class = QueueListSerializer
 
     def get_position(self, obj):
-        if obj.status == 'waiting':
-            return obj.get_position()
-        return None
+        if obj.status != 'waiting':
+            return None
+        # 列表中已由 QueueListSerializer 批量计算，单个对象时查询排队位置索引
+        if hasattr(obj, 'position'):
+            return obj.position
+        return obj.get_position()
+
+
+class QueueAdmissionItemSerializer(serializers.Serializer):
+    """批量入队的一项，关联对象只校验ID格式，是否存在由 BatchQueueAdmission 批量校验"""
+    patient = serializers.IntegerField()
+    department = serializers.IntegerField()
+    examination = serializers.IntegerField()
+    equipment = serializers.IntegerField(required=False, allow_null=True)
+    priority = serializers.IntegerField(required=False, min_value=0, default=0)
+    notes = serializers.CharField(required=False, allow_blank=True, default='')
+
+
+class QueueBulkAdmissionSerializer(serializers.Serializer):
+    items = serializers.ListField(
+        child=QueueAdmissionItemSerializer(),
+        allow_empty=False,
+        max_length=getattr(settings, 'QUEUE_BULK_ADMISSION_MAX_ITEMS', 1000)
+    )
+    atomic = serializers.BooleanField(required=False, default=False)
+
+
+class QueueHistorySerializer(serializers.ModelSerializer):
+    patient_name = serializers.CharField(source='patient.name', read_only=True)
+    department_name = serializers.CharField(source='department.name', read_only=True)
+    equipment_name = serializers.CharField(source='equipment.name', read_only=True, default=None)
+    examination_name = serializers.CharField(source='examination.name', read_only=True)
+
+    class Meta:
+        model = QueueHistory
+        fields = [
+            'id', 'queue', 'queue_number', 'patient', 'patient_name',
+            'department', 'department_name', 'equipment', 'equipment_name',
+            'examination', 'examination_name', 'status', 'priority',
+            'estimated_wait_time', 'actual_wait_time', 'enter_time',
+            'start_time', 'exit_time', 'notes'
+        ]
+        read_only_fields = fields
 
 
 class NotificationTemplateSerializer(serializers.ModelSerializer):
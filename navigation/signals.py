@@ -1,8 +1,9 @@
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from .models import Queue, Patient, Department
+from django.db import transaction
+from .models import Queue, Patient, Department, PatientNameGram
+from .utils.broadcast import queue_update_publisher
+from .utils.dashboard_stats import dashboard_stats
 
 @receiver([post_save, post_delete], sender=Queue)
 @receiver([post_save, post_delete], sender=Patient)
@@ -10,12 +11,42 @@ from .models import Queue, Patient, Department
 def trigger_queue_update(sender, instance, **kwargs):
     """
     当队列、患者或科室数据发生变化时触发 WebSocket 更新
+
+    只通知全院看板和受影响科室的订阅组，短时间内的多次变更会合并为一次广播
+    """
+    broadcast_queue_update(get_affected_departments(sender, instance))
+
+
+@receiver(post_save, sender=Patient)
+def update_patient_name_grams(sender, instance, update_fields=None, **kwargs):
+    """患者姓名变化时更新姓名索引表"""
+    if update_fields is not None and 'name' not in update_fields:
+        return
+    PatientNameGram.rebuild([instance])
+
+
+def get_affected_departments(sender, instance):
+    """获取一次变更影响到的科室ID"""
+    if sender is Department:
+        return {instance.pk}
+    if sender is Queue:
+        return {instance.department_id, getattr(instance, '_loaded_department_id', None)}
+    if sender is Patient and instance.pk:
+        # 患者信息显示在其活动队列中
+        return set(Queue.objects.filter(
+            patient_id=instance.pk,
+            status__in=['waiting', 'processing']
+        ).values_list('department_id', flat=True))
+    return set()
+
+
+def broadcast_queue_update(department_ids=()):
+    """
+    向全院看板和指定科室的订阅者广播队列数据更新
+
+    批量写入（bulk_update/bulk_create）不会触发模型信号，需要在写入完成后调用一次
     """
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        "queue_updates",
-        {
-            "type": "queue_update",
-            "message": "data_updated"
-        }
-    ) 
\ No newline at end of file
+    # 统计缓存立即失效，事务提交后再失效一次，避免提交前读到的旧数据被缓存
+    dashboard_stats.invalidate()
+    transaction.on_commit(dashboard_stats.invalidate)
+    queue_update_publisher.publish(department_ids)
@@ -7,6 +7,7 @@ import logging
 
 from .models import Queue, Department, NotificationTemplate, NotificationStats
 from .utils.notifications import send_notification_with_template, broadcast_department_notification
+from .utils.wait_time import BatchWaitTimeEstimator
 
 logger = logging.getLogger(__name__)
 
@@ -24,36 +25,29 @@ def update_queue_wait_times():
         
         logger.info(f"开始更新 {total_count} 个等待中队列的预计等待时间")
         
-        updated_count = 0
         notification_count = 0
         
-        for queue in waiting_queues:
-            old_time = queue.estimated_wait_time
-            # 使用集成了Prophet的算法计算预计等待时间
-            new_time = queue.estimate_initial_wait_time()
-            
-            # 如果等待时间发生变化，更新记录
-            if old_time != new_time:
-                queue.estimated_wait_time = new_time
-                queue.save(update_fields=['estimated_wait_time'])
-                updated_count += 1
-            
-                # 如果等待时间显著变化（超过5分钟），发送通知
-                if abs(old_time - new_time) > 5:
-                    try:
-                        send_notification.delay(
-                            template_code='queue_wait_time_update',
-                            recipient_id=queue.patient.id,
-                            context={
-                                'wait_time': new_time,
-                                'queue_number': queue.queue_number,
-                                'department': queue.department.name,
-                                'examination': queue.examination.name
-                            }
-                        )
-                        notification_count += 1
-                    except Exception as notify_err:
-                        logger.warning(f"发送等待时间更新通知失败: {str(notify_err)}")
+        # 使用集成了Prophet的算法批量计算预计等待时间，并一次性写回
+        changed = BatchWaitTimeEstimator().update(waiting_queues)
+        updated_count = len(changed)
+        
+        for queue, old_time, new_time in changed:
+            # 如果等待时间显著变化（超过5分钟），发送通知
+            if abs(old_time - new_time) > 5:
+                try:
+                    send_notification.delay(
+                        template_code='queue_wait_time_update',
+                        recipient_id=queue.patient_id,
+                        context={
+                            'wait_time': new_time,
+                            'queue_number': queue.queue_number,
+                            'department': queue.department.name,
+                            'examination': queue.examination.name
+                        }
+                    )
+                    notification_count += 1
+                except Exception as notify_err:
+                    logger.warning(f"发送等待时间更新通知失败: {str(notify_err)}")
         
         success_msg = f"成功更新 {updated_count}/{total_count} 个队列的等待时间，发送了 {notification_count} 个通知"
         logger.info(success_msg)
@@ -1,3 +1,2046 @@
-from django.test import TestCase
+import json
+import logging
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+import unittest
+from datetime import date, datetime, timezone as dt_timezone
+from importlib.util import find_spec
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import joblib
+import numpy as np
+import pandas as pd
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Avg, Q
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .consumers import QueueConsumer
+from .ml.data_store import PYARROW_AVAILABLE, TrainingDataStore
+from .ml.incremental import build_profile, detect_shift, load_state, population_stability_index
+from .ml.inference import (
+    InferenceClient, forecast_table_path, forecast_tables, inference_client, prophet_forecast, prophet_model_path,
+)
+from .ml.inference_server import MicroBatcher
+from .ml.registry import GenerationWatcher, ModelRegistry
+from .ml.serialization import (
+    PROPHET_HISTORY_ROWS, dump_model_file, find_model_file, is_compact_prophet, load_model_file, model_extension
+)
+from .ml.training_pool import TrainingJob, TrainingOrchestrator
+from .models import Department, Equipment, Examination, Patient, PatientNameGram, Queue, QueueHistory
+from .signals import broadcast_queue_update
+from .utils.broadcast import QueueUpdatePublisher
+from .utils.dashboard_stats import dashboard_stats
+from .utils.queue_admission import BatchQueueAdmission
+from .utils.queue_index import QueuePositionIndex, queue_index
+from .utils.snapshot import QueueSnapshotStore
+from .utils.wait_time import BatchWaitTimeEstimator
+from .views import DepartmentViewSet
+
+# 测试不依赖 Redis
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+TEST_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+def create_department(i, **fields):
+    """创建编号为 i 的科室，代码为 D{i}"""
+    return Department.objects.create(
+        name=f'科室{i}', code=f'D{i}', location='一楼', floor='1', building='门诊楼',
+        contact_phone='000', operating_hours='08:00-17:00', average_service_time=10, **fields
+    )
+
+
+def create_examination(department, i):
+    """在科室下创建编号为 i 的检查项目，代码为 E{i}"""
+    return Examination.objects.create(
+        name=f'检查{i}', code=f'E{i}', department=department, description='', duration=10, price=0
+    )
+
+
+def create_patients(numbers, name=None, **fields):
+    """按编号批量创建患者: 姓名默认为 患者{编号}，身份证号 ID{编号:06d}，病历号 MR{编号:06d}"""
+    return Patient.objects.bulk_create([
+        Patient(
+            name=name or f'患者{number}', id_number=f'ID{number:06d}', gender='M', birth_date=date(1990, 1, 1),
+            phone='000', medical_record_number=f'MR{number:06d}', **fields
+        )
+        for number in numbers
+    ])
+
+
+@override_settings(CACHES=TEST_CACHES, CHANNEL_LAYERS=TEST_CHANNEL_LAYERS)
+class NavigationApiTestCase(TestCase):
+    """接口测试基类: 已登录的 APIClient 和统计请求查询次数的辅助方法"""
+
+    # 为True时在 setUpTestData 中创建两个科室及各自的一个检查项目
+    create_two_departments = False
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('staff', password='secret')
+        if cls.create_two_departments:
+            cls.departments = [create_department(i) for i in range(2)]
+            cls.examinations = [create_examination(department, i) for i, department in enumerate(cls.departments)]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def count_queries(self, url):
+        """GET 请求，返回 (查询次数, 响应JSON)"""
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.json()
+
+
+class QueueApiQueryCountTests(NavigationApiTestCase):
+    """队列列表和搜索接口的查询次数不随返回行数增长"""
+
+    create_two_departments = True
+
+    def create_queues(self, start, stop):
+        """创建编号 start 到 stop-1 的队列，两个科室交替，每5条中有1条已完成"""
+        patients = create_patients(range(start, stop))
+        return Queue.objects.bulk_create([
+            Queue(
+                patient=patient,
+                department=self.departments[i % 2],
+                examination=self.examinations[i % 2],
+                queue_number=f'Q{i:06d}',
+                status='completed' if i % 5 == 4 else 'waiting',
+                priority=i % 3,
+                estimated_wait_time=10,
+            )
+            for i, patient in zip(range(start, stop), patients)
+        ])
+
+    def test_list_query_count_is_constant(self):
+        self.create_queues(0, 2)
+        small_count, small = self.count_queries('/api/queues/')
+        self.assertEqual(len(small['results']), 2)
+
+        self.create_queues(2, 10)
+        large_count, large = self.count_queries('/api/queues/')
+        self.assertEqual(len(large['results']), 10)
+
+        self.assertEqual(small_count, large_count)
+
+    def test_search_query_count_is_constant(self):
+        self.create_queues(0, 2)
+        small_count, small = self.count_queries('/api/queues/search/?q=Q0')
+        self.assertEqual(len(small['results']), 2)
+
+        self.create_queues(2, 20)
+        large_count, large = self.count_queries('/api/queues/search/?q=Q0')
+        self.assertEqual(len(large['results']), 10)
+
+        self.assertEqual(small_count, large_count)
+
+    def test_positions_follow_department_ordering(self):
+        queues = self.create_queues(0, 12)
+        _, page = self.count_queries('/api/queues/search/?q=Q0&page_size=20')
+        data = page['results']
+
+        for department in self.departments:
+            waiting = sorted(
+                (q for q in queues if q.department_id == department.id and q.status == 'waiting'),
+                key=lambda q: (-q.priority, q.id)
+            )
+            expected = {q.id: position for position, q in enumerate(waiting, start=1)}
+            actual = {
+                row['id']: row['position'] for row in data
+                if row['department'] == department.id and row['status'] == 'waiting'
+            }
+            self.assertEqual(actual, expected)
+
+        self.assertTrue(all(row['position'] is None for row in data if row['status'] != 'waiting'))
+
+    def search_ids(self, query):
+        _, page = self.count_queries(f'/api/queues/search/?q={query}&page_size=100')
+        return {row['id'] for row in page['results']}
+
+    def test_search_lookup_paths(self):
+        queues = self.create_queues(0, 12)
+        patients = Patient.objects.order_by('id')
+        # bulk_create 不触发信号，需要手动建立姓名索引
+        PatientNameGram.rebuild(patients)
+        by_number = {queue.queue_number: queue.id for queue in queues}
+
+        # 队列号精确和前缀匹配，区分大小写
+        self.assertEqual(self.search_ids('Q000003'), {by_number['Q000003']})
+        self.assertEqual(self.search_ids('Q00001'), {by_number[f'Q00001{i}'] for i in range(2)})
+        self.assertEqual(self.search_ids('q000003'), set())
+
+        # 证件号只做精确匹配
+        self.assertEqual(self.search_ids('ID000005'), {by_number['Q000005']})
+        self.assertEqual(self.search_ids('MR000007'), {by_number['Q000007']})
+        self.assertEqual(self.search_ids('ID00000'), set())
+
+        # 姓名片段: 单字、连续子串，字序不连续时不匹配
+        self.assertEqual(self.search_ids('患者1'), {by_number['Q000001'], by_number['Q000010'], by_number['Q000011']})
+        self.assertEqual(self.search_ids('者11'), {by_number['Q000011']})
+        self.assertEqual(len(self.search_ids('患')), 12)
+        self.assertEqual(self.search_ids('患1者'), set())
+
+        # 患者改名后索引随之更新
+        patient = patients[2]
+        patient.name = '张三'
+        patient.save()
+        self.assertEqual(self.search_ids('张三'), {by_number['Q000002']})
+        self.assertEqual(self.search_ids('患者2'), set())
+
+        response = self.client.get('/api/queues/search/?q=%20')
+        self.assertEqual(response.status_code, 400)
+
+
+class DepartmentExaminationApiQueryCountTests(NavigationApiTestCase):
+    """科室和检查项目列表的统计字段通过注解和预取计算，查询次数不随行数增长"""
+
+    def create_departments(self, start, stop):
+        """每个科室一个检查项目、两台可用设备和一台维护中设备，以及若干等待和已完成的队列"""
+        now = timezone.now()
+        for i in range(start, stop):
+            department = create_department(i)
+            examination = create_examination(department, i)
+            equipment = [
+                Equipment.objects.create(
+                    name=f'设备{i}-{j}', code=f'EQ{i}-{j}', model='M', manufacturer='F',
+                    department=department, location='一楼', maintenance_period=30, average_service_time=5 + j,
+                    status='available' if j < 2 else 'maintenance'
+                )
+                for j in range(3)
+            ]
+            examination.equipment_type.set(equipment)
+
+            patients = create_patients(i * 1000 + j for j in range(4))
+            Queue.objects.bulk_create([
+                Queue(
+                    patient=patient, department=department, examination=examination,
+                    equipment=equipment[j % 2], queue_number=f'Q{i:03d}{j:03d}',
+                    status='completed' if j == 3 else 'waiting', estimated_wait_time=10,
+                    actual_wait_time=20 + i if j == 3 else None, end_time=now if j == 3 else None
+                )
+                for j, patient in enumerate(patients)
+            ])
+
+    def assert_constant_query_count(self, url):
+        self.create_departments(0, 2)
+        small_count, small = self.count_queries(url)
+        self.assertEqual(len(small['results']), 2)
+
+        self.create_departments(2, 10)
+        large_count, large = self.count_queries(url)
+        self.assertEqual(len(large['results']), 10)
+
+        self.assertEqual(small_count, large_count)
+        return large['results']
+
+    def test_department_list_query_count_is_constant(self):
+        data = self.assert_constant_query_count('/api/departments/')
+        # 注解的 GROUP BY 会让 Meta.ordering 失效，列表需要显式排序
+        self.assertTrue(DepartmentViewSet().get_queryset().ordered)
+        self.assertEqual([row['name'] for row in data], sorted(row['name'] for row in data))
+
+        for row in data:
+            department = Department.objects.get(id=row['id'])
+            self.assertEqual(row['current_queue_length'], department.get_current_queue_length())
+            self.assertEqual(row['average_wait_time'], department.get_average_wait_time())
+            self.assertEqual(row['current_queue_length'], 3)
+
+    def test_examination_list_query_count_is_constant(self):
+        data = self.assert_constant_query_count('/api/examinations/')
+
+        for row in data:
+            examination = Examination.objects.get(id=row['id'])
+            self.assertEqual(row['available_equipment_count'], examination.get_available_equipment_count())
+            self.assertEqual(row['estimated_wait_time'], examination.estimate_wait_time())
+            self.assertEqual(row['available_equipment_count'], 2)
+
+
+class QueueHistoryApiTests(NavigationApiTestCase):
+    """历史记录的游标分页和流式导出"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.department = create_department(0)
+        cls.examination = create_examination(cls.department, 0)
+        cls.patient, = create_patients([0])
+        queue = Queue.objects.create(
+            patient=cls.patient, department=cls.department, examination=cls.examination,
+            queue_number='Q000000', status='completed', estimated_wait_time=10
+        )
+        # 进入时间两两相同，翻页时需要用 id 区分
+        cls.now = now = timezone.now()
+        QueueHistory.objects.bulk_create([
+            QueueHistory(
+                queue=queue, queue_number=queue.queue_number, patient=cls.patient,
+                department=cls.department, examination=cls.examination, status='completed',
+                estimated_wait_time=10, actual_wait_time=i, enter_time=now - timezone.timedelta(minutes=i // 2)
+            )
+            for i in range(25)
+        ])
+
+    def test_cursor_pagination_visits_every_row_once(self):
+        url = f'/api/patients/{self.patient.id}/history/?page_size=7'
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(row['id'] for row in response.json()['results'])
+            url = response.json()['next']
+
+        expected = QueueHistory.objects.order_by('-enter_time', '-id').values_list('id', flat=True)
+        self.assertEqual(ids, list(expected))
+
+    def test_export_streams_all_rows(self):
+        response = self.client.get('/api/queue-history/export/?output=ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 25)
+
+        response = self.client.get('/api/queue-history/export/?output=csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lines), 26)
+        self.assertTrue(lines[0].startswith('id,queue_id'))
+
+        response = self.client.get('/api/queue-history/export/?output=xlsx')
+        self.assertEqual(response.status_code, 400)
+
+
+    def test_time_range_parameters(self):
+        def count(**params):
+            response = self.client.get('/api/queue-history/', {'page_size': 100, **params})
+            self.assertEqual(response.status_code, 200)
+            return len(response.json()['results'])
+
+        three_minutes_ago = self.now - timezone.timedelta(minutes=3)
+        one_minute_ago = self.now - timezone.timedelta(minutes=1)
+        tomorrow = timezone.localdate(self.now) + timezone.timedelta(days=1)
+
+        self.assertEqual(count(start=three_minutes_ago.isoformat()), 8)
+        self.assertEqual(count(end=one_minute_ago.isoformat()), 21)
+        self.assertEqual(count(start=three_minutes_ago.isoformat(), end=one_minute_ago.isoformat()), 4)
+        # 不带时区的时间按当前时区处理，只有日期时取当天零点
+        naive = timezone.localtime(three_minutes_ago).replace(tzinfo=None)
+        self.assertEqual(count(start=naive.isoformat()), 8)
+        self.assertEqual(count(start=tomorrow.isoformat()), 0)
+        self.assertEqual(count(end=tomorrow.isoformat()), 25)
+
+    def test_invalid_time_range_returns_400(self):
+        for url in ('/api/queue-history/', '/api/queue-history/export/'):
+            for value in ('yesterday', '2026-02-30', '2026-01-01T25:00'):
+                response = self.client.get(url, {'start': value})
+                self.assertEqual(response.status_code, 400, (url, value))
+                self.assertIn('start', response.json())
+            response = self.client.get(url, {'end': 'soon'})
+            self.assertEqual(response.status_code, 400)
+
+
+class QueueBulkAdmissionTests(NavigationApiTestCase):
+    """批量入队接口的校验、队列号分配和查询次数"""
+
+    create_two_departments = True
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # 前4名患者同名，第2名患者优先级为1
+        cls.patients = (
+            create_patients([0], name='同名患者')
+            + create_patients([1], name='同名患者', priority=1)
+            + create_patients([2, 3], name='同名患者')
+            + create_patients(range(4, 60))
+        )
+
+    def item(self, patient_index, department_index=0, **extra):
+        return {
+            'patient': self.patients[patient_index].id,
+            'department': self.departments[department_index].id,
+            'examination': self.examinations[department_index].id,
+            **extra
+        }
+
+    def admit(self, items, **extra):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/queues/bulk/', {'items': items, **extra}, format='json')
+        return response, len(context.captured_queries)
+
+    def test_bulk_admission_creates_queues_in_order(self):
+        response, _ = self.admit([self.item(i, i % 2) for i in range(6)])
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['errors'], [])
+        self.assertEqual([row['patient'] for row in data['created']], [p.id for p in self.patients[:6]])
+
+        queues = Queue.objects.filter(id__in=[row['id'] for row in data['created']])
+        self.assertEqual(queues.count(), 6)
+        # 同名患者在同一秒内入队，队列号仍唯一
+        self.assertEqual(len({queue.queue_number for queue in queues}), 6)
+        self.assertTrue(all(queue.queue_number.startswith(queue.department.code) for queue in queues))
+        self.assertTrue(all(queue.estimated_wait_time > 0 for queue in queues))
+        # 未指定优先级时继承患者优先级
+        self.assertEqual(queues.get(patient=self.patients[1]).priority, 1)
+
+        # 科室内的位置按优先级和批次顺序排列
+        positions = {row['patient']: row['position'] for row in data['created']}
+        self.assertEqual([positions[p.id] for p in self.patients[0:6:2]], [1, 2, 3])
+        self.assertEqual([positions[p.id] for p in self.patients[1:6:2]], [1, 2, 3])
+
+    def test_bulk_admission_reports_invalid_items(self):
+        self.admit([self.item(0)])
+        self.departments[1].max_daily_patients = 1
+        self.departments[1].save()
+
+        response, _ = self.admit([
+            self.item(0),                                                  # 已有未完成队列
+            self.item(1, examination=self.examinations[1].id),             # 检查项目不属于科室
+            {**self.item(2), 'patient': 999999},                           # 患者不存在
+            self.item(3),
+            self.item(3, 1),                                               # 批次内重复
+            self.item(4, 1),
+            self.item(5, 1),                                               # 超过每日接诊量
+        ])
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual([row['patient'] for row in data['created']], [self.patients[3].id, self.patients[4].id])
+        self.assertEqual(
+            {error['index']: sorted(error['errors']) for error in data['errors']},
+            {0: ['patient'], 1: ['examination'], 2: ['patient'], 4: ['patient'], 6: ['department']}
+        )
+
+        response, _ = self.admit([self.item(10), self.item(0)], atomic=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['created'], [])
+        self.assertFalse(Queue.objects.filter(patient=self.patients[10]).exists())
+
+    def test_bulk_admission_query_count_is_constant(self):
+        # 不使用同名患者，避免队列号冲突时多一轮查询
+        response, small_count = self.admit([self.item(i, i % 2) for i in range(4, 8)])
+        self.assertEqual(len(response.json()['created']), 4)
+
+        response, large_count = self.admit([self.item(i, i % 2) for i in range(10, 60)])
+        self.assertEqual(len(response.json()['created']), 50)
+
+        self.assertEqual(small_count, large_count)
+
+    def test_bulk_admission_retries_colliding_queue_numbers(self):
+        allocate = BatchQueueAdmission._allocate_queue_numbers
+        allocated = []
+
+        def allocate_then_collide(admission, queues):
+            numbers = allocate(admission, queues)
+            if not allocated:
+                # 分配之后、写入之前，另一个请求创建了相同队列号的队列
+                Queue.objects.create(
+                    patient=self.patients[59], department=self.departments[0], examination=self.examinations[0],
+                    queue_number=numbers[0], estimated_wait_time=0
+                )
+            allocated.append(numbers)
+            return numbers
+
+        with mock.patch.object(
+            BatchQueueAdmission, '_allocate_queue_numbers', autospec=True, side_effect=allocate_then_collide
+        ), self.assertLogs('navigation.utils.queue_admission', 'WARNING'):
+            response, _ = self.admit([self.item(4), self.item(5, 1)])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(allocated), 2)
+        created = Queue.objects.filter(id__in=[row['id'] for row in response.json()['created']])
+        self.assertEqual(created.count(), 2)
+        self.assertNotIn(allocated[0][0], {queue.queue_number for queue in created})
+
+
+@override_settings(CACHES=TEST_CACHES, CHANNEL_LAYERS=TEST_CHANNEL_LAYERS)
+class DashboardStatsTests(TestCase):
+    """看板统计的分组查询与逐状态计数一致，结果缓存到队列变更为止"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.departments = [create_department(i) for i in range(3)]
+        examinations = [create_examination(department, i) for i, department in enumerate(cls.departments)]
+        patients = create_patients(range(20))
+        today_start = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time()))
+        # 科室2没有任何队列
+        rows = [
+            (0, 'waiting', None), (0, 'waiting', None), (0, 'processing', None),
+            (0, 'completed', timezone.now()), (0, 'completed', today_start - timezone.timedelta(hours=1)),
+            (0, 'cancelled', timezone.now()),
+            (1, 'waiting', None), (1, 'completed', today_start), (1, 'completed', timezone.now()),
+            (1, 'processing', None), (1, 'processing', None), (1, 'completed', None),
+        ]
+        Queue.objects.bulk_create([
+            Queue(patient=patients[i], department=cls.departments[d], examination=examinations[d],
+                  queue_number=f'S{i:06d}', status=status, end_time=end_time, estimated_wait_time=0)
+            for i, (d, status, end_time) in enumerate(rows)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    @staticmethod
+    def per_status_counts(**filters):
+        queues = Queue.objects.filter(**filters)
+        today_start = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time()))
+        return {
+            'total_patients': queues.filter(status__in=['waiting', 'processing']).count(),
+            'waiting_queues': queues.filter(status='waiting').count(),
+            'processing_queues': queues.filter(status='processing').count(),
+            'completed_today': queues.filter(status='completed', end_time__gte=today_start).count(),
+        }
+
+    def test_grouped_query_matches_per_status_counts(self):
+        self.assertEqual(dashboard_stats.get_stats(), self.per_status_counts())
+        self.assertEqual(dashboard_stats.get_stats()['completed_today'], 3)
+        for department in self.departments:
+            expected = self.per_status_counts(department=department)
+            self.assertEqual(dashboard_stats.get_stats(department.id), expected)
+            self.assertEqual(
+                dashboard_stats.get_department_counts(department.id),
+                {
+                    'waiting_count': expected['waiting_queues'],
+                    'processing_count': expected['processing_queues'],
+                    'completed_today': expected['completed_today'],
+                }
+            )
+
+    def test_one_query_for_all_statistics(self):
+        with self.assertNumQueries(1):
+            dashboard_stats.get_stats()
+            for department in self.departments:
+                dashboard_stats.get_stats(department.id)
+                dashboard_stats.get_department_counts(department.id)
+            annotated = dashboard_stats.annotate_departments(list(self.departments))
+        self.assertEqual([department.waiting_count for department in annotated], [2, 1, 0])
+
+        with self.assertNumQueries(0):
+            dashboard_stats.get_stats()
+
+    def test_broadcast_invalidates_cache(self):
+        self.assertEqual(dashboard_stats.get_stats()['waiting_queues'], 3)
+
+        # 批量写入不触发信号，缓存的统计保持不变，直到调用 broadcast_queue_update
+        Queue.objects.filter(department=self.departments[1], status='processing').update(status='waiting')
+        self.assertEqual(dashboard_stats.get_stats()['waiting_queues'], 3)
+        broadcast_queue_update({self.departments[1].id})
+        self.assertEqual(dashboard_stats.get_stats(), self.per_status_counts())
+        self.assertEqual(dashboard_stats.get_stats()['waiting_queues'], 5)
+
+        # 通过模型保存的变更由信号失效缓存
+        queue = Queue.objects.filter(status='waiting').first()
+        queue.status = 'processing'
+        queue.save(update_fields=['status'])
+        self.assertEqual(dashboard_stats.get_stats()['waiting_queues'], 4)
+
+
+@override_settings(CACHES=TEST_CACHES, CHANNEL_LAYERS=TEST_CHANNEL_LAYERS)
+class BatchWaitTimeEstimatorTests(TestCase):
+    """批量计算的等待时间与逐条 Queue.estimate_initial_wait_time() 一致"""
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.departments = [create_department(i) for i in range(2)]
+        cls.examinations = [
+            create_examination(cls.departments[0], 0),
+            create_examination(cls.departments[1], 1),
+            create_examination(cls.departments[1], 2),
+        ]
+        Examination.objects.filter(pk=cls.examinations[2].pk).update(duration=15)
+        cls.equipment = [
+            Equipment.objects.create(
+                name=f'设备{i}', code=f'EQ{i}', model='', manufacturer='', department=cls.departments[0],
+                location='', status=status, maintenance_period=30, average_service_time=service_time
+            )
+            for i, (status, service_time) in enumerate((('available', 8), ('available', 12), ('maintenance', 20)))
+        ]
+        cls.patients = create_patients(range(20))
+
+        dept0, dept1 = cls.departments
+        exam0, exam1, exam2 = cls.examinations
+        eq0, eq1, _ = cls.equipment
+        # (科室, 检查项目, 设备, 状态, 优先级, 几分钟前进入, 开始后几分钟结束, 实际等待时间)
+        rows = [
+            # 检查项目0的历史数据: 30天前的一条不计入，实际等待时间为空的一条只计入服务时间
+            (dept0, exam0, None, 'completed', 0, 60, 10, 20),
+            (dept0, exam0, None, 'completed', 0, 90, 14, 30),
+            (dept0, exam0, None, 'completed', 0, 120, 6, None),
+            (dept0, exam0, None, 'completed', 0, 60 * 24 * 31, 30, 90),
+            (dept0, exam0, eq0, 'processing', 0, 30, None, None),
+            # 科室0有2台可用设备、1个处理中的队列；两条等待队列同时进入
+            (dept0, exam0, eq0, 'waiting', 0, 25, None, None),
+            (dept0, exam0, eq1, 'waiting', 1, 20, None, None),
+            (dept0, exam0, None, 'waiting', 0, 15, None, None),
+            (dept0, exam0, None, 'waiting', 2, 10, None, None),
+            (dept0, exam0, eq1, 'waiting', 0, 15, None, None),
+            # 科室1没有设备和历史数据
+            (dept1, exam1, None, 'waiting', 0, 25, None, None),
+            (dept1, exam2, None, 'waiting', 0, 20, None, None),
+            (dept1, exam1, None, 'waiting', 1, 15, None, None),
+            (dept1, exam2, None, 'waiting', 3, 10, None, None),
+        ]
+        queues = Queue.objects.bulk_create([
+            Queue(
+                patient=cls.patients[i], department=department, examination=examination, equipment=equipment,
+                queue_number=f'W{i:06d}', status=status, priority=priority, estimated_wait_time=0,
+                actual_wait_time=actual_wait_time,
+            )
+            for i, (department, examination, equipment, status, priority, _, _, actual_wait_time) in enumerate(rows)
+        ])
+        for queue, (_, _, _, status, _, minutes_ago, service_minutes, _) in zip(queues, rows):
+            enter_time = now - timezone.timedelta(minutes=minutes_ago)
+            fields = {'enter_time': enter_time}
+            if status != 'waiting':
+                fields['start_time'] = enter_time + timezone.timedelta(minutes=5)
+            if service_minutes is not None:
+                fields['end_time'] = fields['start_time'] + timezone.timedelta(minutes=service_minutes)
+            Queue.objects.filter(pk=queue.pk).update(**fields)
+
+    def setUp(self):
+        # 科室0有科室级Prophet模型，检查项目2有项目级模型，科室1的其他项目和全局模型都没有
+        dept0, exam2 = self.departments[0].id, self.examinations[2].id
+
+        def forecast(date, examination_id=None, department_id=None):
+            if examination_id == exam2:
+                return 12.0
+            if department_id == dept0:
+                return 25.0
+            return None
+
+        patcher = mock.patch('navigation.ml.inference.prophet_forecast', side_effect=forecast)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def expected(self, queues):
+        # 逐条计算出错时会退回保守估计，比较前确认走的是完整公式
+        with self.assertNoLogs('navigation.models.queue', 'ERROR'):
+            return [queue.estimate_initial_wait_time() for queue in queues]
+
+    def test_estimate_and_update_match_per_row(self):
+        waiting = list(Queue.objects.filter(status='waiting').select_related('department', 'equipment', 'examination'))
+        expected = dict(zip((queue.id for queue in waiting), self.expected(waiting)))
+
+        queues, wait_times = BatchWaitTimeEstimator().estimate()
+        self.assertEqual(dict(zip((queue.id for queue in queues), wait_times)), expected)
+
+        changed = BatchWaitTimeEstimator().update()
+        self.assertEqual(len(changed), len(expected))
+        self.assertEqual(
+            dict(Queue.objects.filter(status='waiting').values_list('id', 'estimated_wait_time')), expected
+        )
+        self.assertEqual(BatchWaitTimeEstimator().update(), [])
+
+    def test_estimate_new_matches_sequential_admission(self):
+        dept0, dept1 = self.departments
+        exam0, exam1, exam2 = self.examinations
+        eq0, eq1, _ = self.equipment
+        items = [
+            (dept0, exam0, eq1, 0), (dept1, exam2, None, 1), (dept0, exam0, None, 2),
+            (dept1, exam1, None, 0), (dept0, exam0, eq0, 0), (dept1, exam2, None, 1),
+        ]
+        new_queues = [
+            Queue(patient=self.patients[14 + i], department=department, examination=examination,
+                  equipment=equipment, priority=priority)
+            for i, (department, examination, equipment, priority) in enumerate(items)
+        ]
+        wait_times = BatchWaitTimeEstimator().estimate_new(new_queues)
+
+        # 逐条计算: 每个新队列都在前面的新队列入队之后计算
+        expected = []
+        for i, queue in enumerate(new_queues):
+            expected.append(queue.estimate_initial_wait_time())
+            queue.queue_number = f'N{i:06d}'
+            queue.estimated_wait_time = expected[-1]
+            Queue.objects.bulk_create([queue])
+        self.assertEqual(wait_times, expected)
+
+
+@override_settings(CACHES=TEST_CACHES, CHANNEL_LAYERS=TEST_CHANNEL_LAYERS, QUEUE_UPDATE_BROADCAST_WINDOW=0)
+class QueuePositionIndexTests(TransactionTestCase):
+    """
+    科室排队位置索引在队列保存和删除后的同步
+
+    使用 TransactionTestCase，保存不在事务中，走增量更新而不是丢弃索引的分支。
+    广播窗口设为0，提交后立即广播，不在测试结束后留下定时器线程。
+    """
+
+    def setUp(self):
+        cache.clear()
+        queue_index.invalidate()
+        self.departments = [create_department(i) for i in range(2)]
+        self.examinations = [create_examination(department, i) for i, department in enumerate(self.departments)]
+        self.patients = create_patients(range(4))
+
+    def create_queue(self, i, department=0, priority=0):
+        return Queue.objects.create(
+            patient=self.patients[i], department=self.departments[department],
+            examination=self.examinations[department], queue_number=f'Q{i:06d}',
+            priority=priority, estimated_wait_time=0
+        )
+
+    def positions(self, department=0):
+        """按位置排列的队列ID"""
+        positions = queue_index.get_department_positions(self.departments[department].id)
+        return sorted(positions, key=positions.get)
+
+    def version(self, department=0):
+        return cache.get(QueuePositionIndex.VERSION_KEY.format(department_id=self.departments[department].id))
+
+    def test_upsert_orders_by_priority_enter_time_and_id(self):
+        queues = [self.create_queue(i) for i in range(3)]
+        self.assertEqual(self.positions(), [queue.id for queue in queues])
+
+        # 提高优先级后直接更新本进程的索引，位置查询不再访问数据库
+        queues[2].priority = 2
+        queues[2].save()
+        with self.assertNumQueries(0):
+            self.assertEqual(queue_index.get_position(queues[2]), 1)
+            self.assertEqual(queue_index.get_position(queues[0]), 2)
+
+        late = self.create_queue(3, priority=2)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.positions(), [queues[2].id, late.id, queues[0].id, queues[1].id])
+
+    def test_status_change_and_delete_remove_from_index(self):
+        queues = [self.create_queue(i) for i in range(3)]
+        self.assertEqual(self.positions(), [queue.id for queue in queues])
+
+        queues[0].status = 'processing'
+        queues[0].save(update_fields=['status'])
+        self.assertIsNone(queue_index.get_position(queues[0]))
+
+        # 删除时内存中的状态仍为 waiting，也要从索引中移除
+        queues[1].delete()
+        self.assertEqual(self.positions(), [queues[2].id])
+
+        # 事务外的删除通知直接更新已加载的索引
+        queue_index.remove(queues[2])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.positions(), [])
+
+    def test_department_move_updates_both_departments(self):
+        queues = [self.create_queue(i) for i in range(2)]
+        other = self.create_queue(2, department=1)
+        self.assertEqual(self.positions(0), [queue.id for queue in queues])
+        self.assertEqual(self.positions(1), [other.id])
+
+        moved = Queue.objects.get(pk=queues[0].pk)
+        moved.department = self.departments[1]
+        moved.examination = self.examinations[1]
+        moved.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.positions(0), [queues[1].id])
+            self.assertEqual(self.positions(1), [moved.id, other.id])
+
+    def test_repeated_department_moves_of_same_instance(self):
+        queue = self.create_queue(0)
+        self.assertEqual(self.positions(0), [queue.id])
+        self.assertEqual(self.positions(1), [])
+
+        # 同一实例 A→B→A，每次保存都要从上一次保存时的科室中移除
+        for department, expected in ((1, ([], [queue.id])), (0, ([queue.id], [])), (1, ([], [queue.id]))):
+            queue.department = self.departments[department]
+            queue.examination = self.examinations[department]
+            queue.save()
+            self.assertEqual((self.positions(0), self.positions(1)), expected)
+
+    def test_version_bump_reloads_other_processes(self):
+        first = self.create_queue(0)
+        # 模拟另一个进程中已加载的索引
+        other_process = QueuePositionIndex()
+        self.assertEqual(other_process.get_department_positions(self.departments[0].id), {first.id: 1})
+        version = self.version()
+
+        second = self.create_queue(1, priority=1)
+        self.assertEqual(self.version(), version + 1)
+        self.assertIsNone(self.version(1))
+        self.assertEqual(
+            other_process.get_department_positions(self.departments[0].id), {second.id: 1, first.id: 2}
+        )
+
+        Queue.objects.filter(pk=second.pk).update(status='completed')
+        queue_index.notify_changed([self.departments[0].id])
+        self.assertEqual(self.version(), version + 2)
+        self.assertEqual(other_process.get_department_positions(self.departments[0].id), {first.id: 1})
+
+
+@override_settings(CACHES=TEST_CACHES)
+class QueueSnapshotStoreTests(SimpleTestCase):
+    """看板快照的版本分配和增量更新，以及 QueueConsumer 按版本号转发"""
+
+    def setUp(self):
+        cache.clear()
+        self.store = QueueSnapshotStore()
+        patcher = mock.patch('navigation.consumers.snapshot_store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def consumer(self, mode='full', version=0):
+        consumer = QueueConsumer()
+        consumer.mode = mode
+        consumer.snapshot_version = version
+        consumer.department_id = None
+        consumer.send = mock.AsyncMock()
+        return consumer
+
+    @staticmethod
+    def sent(consumer):
+        return [json.loads(call.kwargs['text_data']) for call in consumer.send.await_args_list]
+
+    @staticmethod
+    def queue_entry(number, status, minute, ahead_count=None):
+        return {
+            'queue_number': number, 'patient_name': f'患者{number}', 'department_name': '科室0',
+            'examination_name': '检查0', 'status': status, 'estimated_wait_time': 10,
+            'enter_time': f'2026-10-01T08:{minute:02d}:00+00:00', 'ahead_count': ahead_count,
+        }
+
+    @staticmethod
+    def department_entry(code, waiting_count):
+        return {'name': f'科室{code}', 'code': code, 'location': '一楼', 'waiting_count': waiting_count}
+
+    def publish(self, *snapshots):
+        """由另一个进程的快照存储依次发布，本进程的存储只能从缓存读取"""
+        other_process = QueueSnapshotStore()
+        versions = []
+        for snapshot in snapshots:
+            with mock.patch('navigation.utils.snapshot.build_queue_snapshot', return_value=snapshot):
+                versions.append(other_process.publish()[0])
+        return versions
+
+    def expire(self, version):
+        cache.delete(QueueSnapshotStore.SNAPSHOT_KEY.format(scope='all', version=version))
+
+    @staticmethod
+    def apply_delta(snapshot, delta):
+        """与看板页面 applyDelta 相同的合并方式"""
+        departments = {d['code']: d for d in snapshot['departments']}
+        departments.update((d['code'], d) for d in delta['departments'])
+        for code in delta['removed_departments']:
+            del departments[code]
+        queues = {q['queue_number']: q for q in snapshot['queues']}
+        for number in delta['queues']['removed']:
+            del queues[number]
+        queues.update((q['queue_number'], q) for q in delta['queues']['inserted'] + delta['queues']['changed'])
+        return {
+            'stats': {**snapshot['stats'], **delta['stats']},
+            'departments': list(departments.values()),
+            'queues': sorted(queues.values(), key=lambda q: q['enter_time'] or ''),
+        }
+
+    def old_and_new(self):
+        old = {
+            'stats': {'total_patients': 3, 'waiting_queues': 2, 'processing_queues': 1, 'completed_today': 0},
+            'departments': [self.department_entry('D0', 2), self.department_entry('D1', 0)],
+            'queues': [
+                self.queue_entry('Q1', 'waiting', 0, 0), self.queue_entry('Q2', 'waiting', 5, 1),
+                self.queue_entry('Q3', 'processing', 10),
+            ],
+            'timestamp': '2026-10-01T08:20:00+00:00',
+        }
+        # Q1 完成后移除，Q2 前移，Q3 不变，新插入的 Q4 进入时间早于 Q2；D0 变化、D1 停用、D2 新增
+        new = {
+            'stats': {'total_patients': 4, 'waiting_queues': 2, 'processing_queues': 1, 'completed_today': 1},
+            'departments': [self.department_entry('D0', 1), self.department_entry('D2', 1)],
+            'queues': [
+                self.queue_entry('Q4', 'waiting', 2, 0), self.queue_entry('Q2', 'waiting', 5, 0),
+                self.queue_entry('Q3', 'processing', 10),
+            ],
+            'timestamp': '2026-10-01T08:30:00+00:00',
+        }
+        return old, new
+
+    def test_delta_applied_to_old_snapshot_reproduces_new(self):
+        old, new = self.old_and_new()
+        self.assertEqual(self.publish(old, new), [1, 2])
+
+        delta = json.loads(self.store.get_delta(1, 2))
+        self.assertEqual((delta['type'], delta['base_version'], delta['version']), ('queue_delta', 1, 2))
+        self.assertEqual(delta['stats'], {'total_patients': 4, 'completed_today': 1})
+        self.assertEqual(
+            (len(delta['queues']['inserted']), len(delta['queues']['changed']), delta['queues']['removed']),
+            (1, 1, ['Q1'])
+        )
+
+        applied = self.apply_delta(json.loads(self.store.get(1)), delta)
+        latest = json.loads(self.store.get(2))
+        self.assertEqual(applied['stats'], latest['stats'])
+        self.assertCountEqual(applied['departments'], latest['departments'])
+        self.assertEqual(applied['queues'], latest['queues'])
+
+    def test_get_delta_returns_none_when_base_expired(self):
+        self.publish(*self.old_and_new())
+        self.expire(1)
+        self.assertIsNone(self.store.get_delta(1, 2))
+        self.assertIsNone(self.store.get_delta(5, 2))
+        self.assertIsNotNone(self.store.get_delta(2, 2))
+
+    def test_consumer_with_version_gap_resyncs(self):
+        old, new = self.old_and_new()
+        self.publish(old, old, old, new)
+        self.expire(1)
+
+        # 基准版本已过期时发送完整快照
+        consumer = self.consumer(mode='delta', version=1)
+        async_to_sync(consumer.queue_update)({'type': 'queue_update', 'version': 4})
+        message, = self.sent(consumer)
+        self.assertEqual((message['type'], message['version']), ('queue_update', 4))
+        self.assertEqual(message['queues'], new['queues'])
+        self.assertEqual(consumer.snapshot_version, 4)
+
+        # 订阅时带上过期或未知的版本号，同样收到完整快照
+        for version in (1, 99, 'x'):
+            consumer = self.consumer(mode='delta')
+            async_to_sync(consumer.receive)(json.dumps({'command': 'subscribe', 'mode': 'delta', 'version': version}))
+            message, = self.sent(consumer)
+            self.assertEqual((message['type'], message['version']), ('queue_update', 4))
+
+        # 基准版本仍在时，跨过中间版本直接发送 2→4 的增量
+        consumer = self.consumer(mode='delta', version=2)
+        async_to_sync(consumer.queue_update)({'type': 'queue_update', 'version': 4})
+        message, = self.sent(consumer)
+        self.assertEqual((message['type'], message['base_version'], message['version']), ('queue_delta', 2, 4))
+        self.assertEqual(message['queues']['removed'], ['Q1'])
+
+    def test_version_is_allocated_before_building(self):
+        builds = []
+
+        def build(department_id):
+            # 第一次构建期间发生另一次发布，它读取的数据更新
+            builds.append(department_id)
+            if len(builds) == 1:
+                self.store.publish()
+                return {'queues': 'old'}
+            return {'queues': 'new'}
+
+        with mock.patch('navigation.utils.snapshot.build_queue_snapshot', side_effect=build):
+            version, payload = self.store.publish()
+
+        self.assertEqual((version, json.loads(payload)['queues']), (1, 'old'))
+        latest = self.store.latest_version()
+        self.assertEqual(latest, 2)
+        self.assertEqual(json.loads(self.store.get(latest))['queues'], 'new')
+
+    def test_consumer_drops_stale_and_duplicate_versions(self):
+        with mock.patch('navigation.utils.snapshot.build_queue_snapshot',
+                        side_effect=lambda department_id: {'queues': []}):
+            for _ in range(3):
+                self.store.publish()
+
+        consumer = self.consumer()
+        for version in (2, 2, 1, 3, 3):
+            async_to_sync(consumer.queue_update)({'type': 'queue_update', 'version': version})
+
+        self.assertEqual([message['version'] for message in self.sent(consumer)], [2, 3])
+        self.assertEqual(consumer.snapshot_version, 3)
+
+
+@override_settings(CACHES=TEST_CACHES, QUEUE_UPDATE_BROADCAST_WINDOW=0.05)
+class QueueUpdatePublisherTests(TestCase):
+    """窗口内的多次变更合并为每个订阅组一次广播，事务提交前和暂停期间不广播"""
+
+    def setUp(self):
+        cache.clear()
+        self.publisher = QueueUpdatePublisher()
+        self.channel_layer = mock.Mock(group_send=mock.AsyncMock())
+        versions = iter(range(1, 100))
+        for target, kwargs in (
+            ('navigation.utils.broadcast.get_channel_layer', {'return_value': self.channel_layer}),
+            ('navigation.utils.snapshot.snapshot_store.publish', {'side_effect': lambda scope: (next(versions), '')}),
+        ):
+            patcher = mock.patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def sent_groups(self):
+        return sorted(call.args[0] for call in self.channel_layer.group_send.await_args_list)
+
+    def wait_for_timer(self):
+        timer = self.publisher._timer
+        self.assertIsNotNone(timer)
+        timer.join(5)
+
+    def test_publishes_within_window_send_once_per_group(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(5):
+                self.publisher.publish([1])
+            for _ in range(3):
+                self.publisher.publish([2, None])
+            self.publisher.publish([1, 2])
+            self.channel_layer.group_send.assert_not_called()
+
+        self.wait_for_timer()
+        self.assertEqual(self.sent_groups(), ['queue_updates', 'queue_updates_dept_1', 'queue_updates_dept_2'])
+
+        # 窗口结束后释放了锁，之后的变更重新安排一次发送
+        with self.captureOnCommitCallbacks(execute=True):
+            self.publisher.publish([1])
+        self.wait_for_timer()
+        self.assertEqual(self.channel_layer.group_send.await_count, 5)
+
+    def test_nothing_is_sent_before_commit(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.publisher.publish([1])
+        self.assertEqual(len(callbacks), 1)
+        self.assertIsNone(self.publisher._timer)
+        self.channel_layer.group_send.assert_not_called()
+
+    @override_settings(QUEUE_UPDATE_BROADCAST_WINDOW=0)
+    def test_suppressed_updates_are_sent_once_afterwards(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.publisher.suppress():
+                self.publisher.publish([1])
+                with self.publisher.suppress():
+                    self.publisher.publish([2])
+                self.publisher.publish([1])
+            self.channel_layer.group_send.assert_not_called()
+
+        # 暂停期间的变更在结束时合并为一次登记
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.sent_groups(), ['queue_updates', 'queue_updates_dept_1', 'queue_updates_dept_2'])
+        versions = [call.args[1]['version'] for call in self.channel_layer.group_send.await_args_list]
+        self.assertEqual(sorted(versions), [1, 2, 3])
+
+
+def unused_tcp_address():
+    """本机一个当前无人监听的TCP地址"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return f'127.0.0.1:{sock.getsockname()[1]}'
+
+
+class ProphetForecastTests(SimpleTestCase):
+    """prophet_forecast 优先查询预测表，预测表过期或超出范围时退回实时预测"""
+
+    START = datetime(2026, 10, 1, 8)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(
+            BASE_DIR=directory.name, ML_INFERENCE_SERVER=None, ML_PROPHET_LIVE_FALLBACK=True
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        forecast_tables.clear()
+        self.addCleanup(forecast_tables.clear)
+
+        self.model_file = os.path.join(directory.name, 'ml_models', 'prophet', 'prophet_dept_1.pkl')
+        os.makedirs(os.path.dirname(self.model_file))
+        with open(self.model_file, 'wb') as f:
+            f.write(b'model')
+        self.write_table([10, 20, 30, 40])
+
+        # 实时预测的替身: 不导入 Prophet，返回固定值
+        patcher = mock.patch(
+            'navigation.ml.prophet_predictor.get_prophet_predictor',
+            return_value=SimpleNamespace(model=object(), predict=lambda date: 99),
+        )
+        self.live_predictor = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_table(self, yhat, model_mtime=None, table_mtime=None):
+        table_file = forecast_table_path(self.model_file)
+        values = np.array(yhat, dtype=np.float32)
+        np.savez(
+            table_file,
+            start=np.array([pd.Timestamp(self.START).value], dtype=np.int64),
+            model_mtime=np.array([model_mtime or os.path.getmtime(self.model_file)], dtype=np.float64),
+            yhat=values, lower=values, upper=values,
+        )
+        if table_mtime is not None:
+            os.utime(table_file, (table_mtime, table_mtime))
+
+    def at(self, hour, minute=0):
+        return datetime(2026, 10, 1, hour, minute, tzinfo=dt_timezone.utc)
+
+    def test_interpolates_within_table(self):
+        self.assertEqual(prophet_forecast(self.at(9, 30), department_id=1), 25)
+        self.assertEqual(prophet_forecast(self.at(8), department_id=1), 10)
+        self.live_predictor.assert_not_called()
+
+    def test_out_of_range_falls_back_to_live_prediction(self):
+        # 最后一个小时没有下一个点用于插值，也视为超出范围
+        for date_value in (self.at(7, 59), self.at(11), self.at(23)):
+            self.assertEqual(prophet_forecast(date_value, department_id=1), 99)
+        self.assertEqual(self.live_predictor.call_count, 3)
+
+        with self.settings(ML_PROPHET_LIVE_FALLBACK=False):
+            self.assertIsNone(prophet_forecast(self.at(23), department_id=1))
+
+    def test_table_of_replaced_model_is_ignored(self):
+        self.assertEqual(prophet_forecast(self.at(9), department_id=1), 20)
+
+        # 模型重新训练或回滚后，旧模型生成的预测表不再使用
+        model_mtime = os.path.getmtime(self.model_file) + 10
+        os.utime(self.model_file, (model_mtime, model_mtime))
+        self.assertEqual(prophet_forecast(self.at(9), department_id=1), 99)
+
+        # 为新模型重新生成预测表后恢复查表
+        self.write_table([50, 60, 70, 80], model_mtime=model_mtime, table_mtime=model_mtime + 1)
+        self.assertEqual(prophet_forecast(self.at(9), department_id=1), 60)
+
+    def test_missing_model_returns_none(self):
+        self.assertIsNone(prophet_forecast(self.at(9), department_id=2))
+        self.live_predictor.assert_not_called()
+
+
+class InferenceClientFallbackTests(SimpleTestCase):
+    """预测服务不可用时客户端返回None，调用方退回本进程预测，一段时间内不再尝试连接"""
+
+    def setUp(self):
+        self.address = unused_tcp_address()
+        self.addCleanup(setattr, inference_client, '_retry_at', 0.0)
+        inference_client._retry_at = 0.0
+
+    def test_unreachable_server_returns_none_and_backs_off(self):
+        client = InferenceClient(self.address)
+        with self.settings(ML_INFERENCE_RETRY_INTERVAL=60):
+            self.assertTrue(client.enabled)
+            with self.assertLogs('navigation.ml.inference', 'WARNING'):
+                self.assertIsNone(client.predict([{'department_id': 1}]))
+            self.assertFalse(client.enabled)
+            self.assertIsNone(client.status())
+
+    def test_retries_after_interval(self):
+        client = InferenceClient(self.address)
+        with self.settings(ML_INFERENCE_RETRY_INTERVAL=0):
+            with self.assertLogs('navigation.ml.inference', 'WARNING'):
+                self.assertIsNone(client.prophet([datetime(2026, 10, 1, 9)], department_id=1))
+            self.assertTrue(client.enabled)
+
+    def test_prophet_forecast_falls_back_to_local_prediction(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(
+            BASE_DIR=directory, ML_INFERENCE_SERVER=self.address, ML_INFERENCE_RETRY_INTERVAL=60
+        ), mock.patch(
+            'navigation.ml.prophet_predictor.get_prophet_predictor',
+            return_value=SimpleNamespace(model=object(), predict=lambda date: 42),
+        ):
+            model_file = os.path.join(directory, 'ml_models', 'prophet', 'prophet_dept_1.pkl')
+            os.makedirs(os.path.dirname(model_file))
+            with open(model_file, 'wb') as f:
+                f.write(b'model')
+
+            self.assertTrue(inference_client.enabled)
+            with self.assertLogs('navigation.ml.inference', 'WARNING'):
+                forecast = prophet_forecast(datetime(2026, 10, 1, 9, tzinfo=dt_timezone.utc), department_id=1)
+            self.assertEqual(forecast, 42)
+            self.assertFalse(inference_client.enabled)
+
+
+class ScriptedInferenceServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    按脚本应答的预测服务替身
+
+    replies 中每一项对应一个收到的请求: 'ok' 正常应答，'close' 不应答并关闭连接，'hang' 不应答
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.connections = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.release = threading.Event()
+        super().__init__(('127.0.0.1', 0), ScriptedInferenceHandler)
+
+    @property
+    def address(self):
+        return f'127.0.0.1:{self.server_address[1]}'
+
+
+class ScriptedInferenceHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        for line in self.rfile:
+            with self.server.lock:
+                self.server.requests += 1
+                reply = self.server.replies.pop(0) if self.server.replies else 'ok'
+            if reply == 'close':
+                return
+            if reply == 'hang':
+                self.server.release.wait(5)
+                return
+            self.wfile.write(json.dumps({'wait_times': [json.loads(line)['rows'][0]['value']]}).encode() + b'\n')
+            self.wfile.flush()
+
+
+@override_settings(ML_INFERENCE_TIMEOUT=0.3, ML_INFERENCE_RETRY_INTERVAL=60)
+class InferenceClientRetryTests(SimpleTestCase):
+    """复用的连接被服务端关闭时重连重试一次；请求已发出后读取超时不重试"""
+
+    def start_server(self, replies):
+        server = ScriptedInferenceServer(replies)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(server.release.set)
+        return server
+
+    def test_reconnects_when_reused_connection_was_closed(self):
+        server = self.start_server(['ok', 'close', 'ok'])
+        client = InferenceClient(server.address)
+        self.assertEqual(client.predict([{'value': 1}]), [1])
+        self.assertEqual(client.predict([{'value': 2}]), [2])
+        self.assertEqual((server.connections, server.requests), (2, 3))
+        self.assertTrue(client.enabled)
+
+    def test_read_timeout_is_not_retried(self):
+        server = self.start_server(['ok', 'hang'])
+        client = InferenceClient(server.address)
+        self.assertEqual(client.predict([{'value': 1}]), [1])
+        with self.assertLogs('navigation.ml.inference', 'WARNING'):
+            self.assertIsNone(client.predict([{'value': 2}]))
+        self.assertEqual((server.connections, server.requests), (1, 2))
+        self.assertFalse(client.enabled)
+
+
+class MicroBatcherTests(SimpleTestCase):
+    """合并的批次出错时逐个请求重新处理，只有出错的请求失败"""
+
+    @staticmethod
+    def double(items):
+        if 'bad' in items:
+            raise ValueError('无效的行')
+        return [item * 2 for item in items]
+
+    def test_failing_request_does_not_fail_merged_batch(self):
+        batcher = MicroBatcher('test', self.double, window=0.2)
+        first, bad, last = batcher.submit([1, 2]), batcher.submit(['bad']), batcher.submit([3])
+
+        with self.assertLogs('navigation.ml.inference_server', 'WARNING'):
+            self.assertEqual(first.result(timeout=5), [2, 4])
+            with self.assertRaises(ValueError):
+                bad.result(timeout=5)
+            self.assertEqual(last.result(timeout=5), [6])
+        self.assertEqual(batcher.stats()['batches'], 1)
+
+    def test_single_request_batch_reports_error(self):
+        batcher = MicroBatcher('test', self.double, window=0)
+        with self.assertLogs('navigation.ml.inference_server', 'ERROR'):
+            with self.assertRaises(ValueError):
+                batcher.submit(['bad']).result(timeout=5)
+        self.assertEqual(batcher.submit([5]).result(timeout=5), [10])
+
+
+def training_frame(count, start, mean, seed=0, department_id=1):
+    """训练数据: 从 start 起每分钟一行，等待时间服从均值为 mean 的正态分布"""
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range(start, periods=count, freq='min')
+    return pd.DataFrame({
+        'department_id': department_id,
+        'queue_count': rng.integers(0, 20, count),
+        'department_capacity': 10,
+        'staff_efficiency': 1.0,
+        'equipment_status': 1,
+        'historical_wait_time': rng.normal(mean, 5, count),
+        'hour': timestamps.hour,
+        'day_of_week': timestamps.dayofweek,
+        'is_weekend': (timestamps.dayofweek >= 5).astype(int),
+        'actual_wait_time': rng.normal(mean, 5, count),
+        'timestamp': timestamps,
+    })
+
+
+@override_settings(ML_SHIFT_PSI_MIN_ROWS=50, ML_SHIFT_PSI_THRESHOLD=0.1, ML_SHIFT_Z_THRESHOLD=3.0,
+                   ML_INCREMENTAL_MIN_ROWS=20, ML_INCREMENTAL_BOOST_ROUNDS=5)
+class IncrementalTrainingTests(SimpleTestCase):
+    """数据分布变化检测，以及增量训练的跳过和继续提升"""
+
+    def setUp(self):
+        from .ml.trainer import ModelTrainer
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.trainer = ModelTrainer()
+        self.trainer.model_dir = directory.name
+        self.trainer.n_jobs = 1
+        self.model_path = self.trainer._model_path('xgboost', 1)
+        self.old = training_frame(200, '2026-10-01 08:00', mean=30)
+
+    def test_psi_of_identical_and_shifted_distributions(self):
+        profile = build_profile(self.old['actual_wait_time'])
+        same = training_frame(200, '2026-10-02 08:00', mean=30, seed=1)['actual_wait_time']
+        shifted = training_frame(200, '2026-10-02 08:00', mean=45, seed=1)['actual_wait_time']
+
+        self.assertAlmostEqual(population_stability_index(profile, self.old['actual_wait_time']), 0.0)
+        self.assertLess(population_stability_index(profile, same), 0.1)
+        self.assertGreater(population_stability_index(profile, shifted), 1.0)
+        self.assertFalse(detect_shift(profile, same)[0])
+        shifted_result, _, reason = detect_shift(profile, shifted)
+        self.assertTrue(shifted_result)
+        self.assertIn('PSI', reason)
+
+    def test_small_samples_use_mean_shift_test(self):
+        profile = build_profile(self.old['actual_wait_time'])
+        same = training_frame(20, '2026-10-02 08:00', mean=30, seed=1)['actual_wait_time']
+        shifted = training_frame(20, '2026-10-02 08:00', mean=40, seed=1)['actual_wait_time']
+
+        shifted_result, _, reason = detect_shift(profile, same)
+        self.assertFalse(shifted_result)
+        self.assertIn('z=', reason)
+        shifted_result, _, reason = detect_shift(profile, shifted)
+        self.assertTrue(shifted_result)
+        self.assertIn('z=', reason)
+
+    def train_initial_model(self):
+        from .ml.registry import registry_for
+        from .ml.serialization import dump_model_file
+        import xgboost as xgb
+
+        X, y = self.trainer.prepare_features(self.old.copy())
+        model = xgb.XGBRegressor(n_estimators=5, max_depth=3, n_jobs=1).fit(X, y)
+        registry_for(self.model_path).publish(model, self.model_path, {}, dump=dump_model_file)
+        self.trainer._save_training_state(self.model_path, self.old)
+
+    def test_unchanged_distribution_is_skipped(self):
+        self.train_initial_model()
+        df = pd.concat([self.old, training_frame(40, '2026-10-02 08:00', mean=30, seed=1)])
+
+        with mock.patch.object(self.trainer, 'train_model') as train_model:
+            result = self.trainer._fit_department_model(1, df, incremental=True)
+        self.assertTrue(result['skipped'])
+        train_model.assert_not_called()
+        # 水位线不变，新数据留到下次一起检测
+        self.assertEqual(pd.Timestamp(load_state(self.model_path)['watermark']), self.old['timestamp'].max())
+
+    def test_continue_boosting_fits_all_new_rows(self):
+        import xgboost as xgb
+        from .ml.registry import registry_for
+
+        self.train_initial_model()
+        new_rows = training_frame(40, '2026-10-02 08:00', mean=45, seed=1)
+        df = pd.concat([self.old, new_rows])
+
+        fit = xgb.XGBRegressor.fit
+        with mock.patch.object(xgb.XGBRegressor, 'fit', autospec=True, side_effect=fit) as patched_fit:
+            result = self.trainer._fit_department_model(1, df, incremental=True)
+
+        self.assertEqual((result['training_mode'], result['sample_count']), ('incremental', 40))
+        (_, X, y), kwargs = patched_fit.call_args
+        self.assertEqual((len(X), len(y)), (40, 40))
+        self.assertIsNotNone(kwargs['xgb_model'])
+        current = registry_for(self.model_path).current(self.model_path)
+        self.assertEqual((current['version'], current['metrics']['evaluated_on']), (2, 'training_rows'))
+        self.assertEqual(pd.Timestamp(load_state(self.model_path)['watermark']), new_rows['timestamp'].max())
+
+
+@override_settings(CACHES=TEST_CACHES, CHANNEL_LAYERS=TEST_CHANNEL_LAYERS)
+class TrainingFeatureTests(TestCase):
+    """
+    集合方式计算的训练特征与逐条查询一致
+
+    queue_count 按定义逐条查询: 进入时间早于该队列、且当时尚未离开队列（开始服务，
+    或未开始服务的记录结束/更新）的同科室记录数。
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.base = (timezone.now() - timezone.timedelta(days=3)).replace(microsecond=0)
+        cls.departments = [create_department(i) for i in range(2)]
+        examinations = [create_examination(department, i) for i, department in enumerate(cls.departments)]
+        patient, = create_patients([0])
+
+        # 科室0的可用设备早于所有样本；科室1的可用设备在收集窗口开始2小时后才可用
+        for i, (department, status, hours) in enumerate((
+            (0, 'available', -24), (0, 'maintenance', -48), (1, 'available', 2), (1, 'available', 5),
+        )):
+            equipment = Equipment.objects.create(
+                name=f'设备{i}', code=f'EQ{i}', model='', manufacturer='', department=cls.departments[department],
+                location='', status=status, maintenance_period=30, average_service_time=10
+            )
+            Equipment.objects.filter(pk=equipment.pk).update(updated_at=cls.base + timezone.timedelta(hours=hours))
+
+        specs = []
+        for d in range(2):
+            # 第一个样本7天前的边界: 恰好7天前的记录计入，再早1秒的不计入
+            specs.append((d, 'completed', -7 * 86400, 600, 40 + d))
+            specs.append((d, 'completed', -7 * 86400 - 1, 600, 90))
+            for k in range(36):
+                # 两两同时进入，同一时刻的记录不计入彼此的历史平均值
+                enter, kind = 600 * (k // 2), k % 9
+                if kind <= 5:
+                    wait = 60 * (5 + k * 7 % 50)
+                    specs.append((d, 'completed', enter, wait, wait // 60))
+                elif kind == 6:
+                    specs.append((d, 'completed', enter, 900, None))
+                else:
+                    # 未开始服务就取消: 有结束时间的以结束时间离开，否则以更新时间离开
+                    specs.append((d, 'cancelled', enter, None, kind))
+            specs.append((d, 'processing', 600 * 17, 300, None))
+            specs.extend((d, 'waiting', 600 * 17 + 60 * i, None, None) for i in range(3))
+
+        queues = Queue.objects.bulk_create([
+            Queue(
+                patient=patient, department=cls.departments[d], examination=examinations[d],
+                queue_number=f'F{i:06d}', status=status, estimated_wait_time=0,
+                actual_wait_time=actual if status == 'completed' else None,
+            )
+            for i, (d, status, _, _, actual) in enumerate(specs)
+        ])
+        for queue, (_, status, enter, wait, extra) in zip(queues, specs):
+            enter_time = cls.base + timezone.timedelta(seconds=enter)
+            fields = {'enter_time': enter_time, 'created_at': enter_time, 'updated_at': enter_time}
+            if wait is not None:
+                fields['start_time'] = enter_time + timezone.timedelta(seconds=wait)
+                fields['updated_at'] = fields['start_time']
+                if status == 'completed':
+                    fields['end_time'] = fields['updated_at'] = fields['start_time'] + timezone.timedelta(minutes=5)
+            elif status == 'cancelled':
+                if extra == 7:
+                    fields['end_time'] = enter_time + timezone.timedelta(minutes=15)
+                fields['updated_at'] = enter_time + timezone.timedelta(minutes=20)
+            Queue.objects.filter(pk=queue.pk).update(**fields)
+
+    def setUp(self):
+        from .ml.data_collector import WaitTimeDataCollector
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.collector = WaitTimeDataCollector()
+        self.collector.data_file = os.path.join(directory.name, 'training.csv')
+        self.collector.store = TrainingDataStore(os.path.join(directory.name, 'store'))
+        # 科室医生数量在两种实现中都是随机数，固定下来以便比较容量
+        patcher = mock.patch('numpy.random.randint', return_value=4)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def per_row_features(queue):
+        """原逐条查询的特征（queue_count 见类说明）"""
+        t = queue.created_at
+        department = Queue.objects.filter(department_id=queue.department_id)
+        history = department.filter(
+            status='completed', created_at__gte=t - timezone.timedelta(days=7), created_at__lt=t,
+            actual_wait_time__isnull=False
+        ).aggregate(avg=Avg('actual_wait_time'))['avg']
+        return {
+            'queue_count': department.filter(enter_time__lt=queue.enter_time).filter(
+                Q(start_time__gt=queue.enter_time)
+                | Q(start_time__isnull=True, status='waiting')
+                | Q(start_time__isnull=True, end_time__gt=queue.enter_time)
+                | Q(start_time__isnull=True, end_time__isnull=True, updated_at__gt=queue.enter_time)
+            ).count(),
+            'historical_wait_time': history or 0,
+            'department_capacity': Equipment.objects.filter(department_id=queue.department_id).count() + 4,
+            'equipment_status': int(Equipment.objects.filter(
+                department_id=queue.department_id, status='available', updated_at__lte=t
+            ).exists()),
+        }
+
+    @staticmethod
+    def samples(start_date=None):
+        samples = Queue.objects.filter(
+            status='completed', start_time__isnull=False, enter_time__isnull=False, actual_wait_time__isnull=False
+        )
+        return samples if start_date is None else samples.filter(created_at__gte=start_date)
+
+    def test_build_features_match_per_row_queries(self):
+        df, watermark = self.collector._build_features(self.base)
+        samples = {queue.id: queue for queue in self.samples(self.base)}
+        self.assertEqual(sorted(df['queue_id']), sorted(samples))
+        self.assertEqual(watermark, max(queue.end_time for queue in samples.values()))
+
+        for row in df.to_dict('records'):
+            expected = self.per_row_features(samples[row['queue_id']])
+            actual = {column: row[column] for column in expected}
+            self.assertAlmostEqual(actual.pop('historical_wait_time'), expected.pop('historical_wait_time'))
+            self.assertEqual(actual, expected, row['queue_id'])
+
+        # 确认夹具覆盖了各个分支
+        self.assertGreater(df['queue_count'].max(), 0)
+        self.assertEqual(set(df['equipment_status']), {0, 1})
+        first = df[df['timestamp'] == pd.Timestamp(self.base)]
+        self.assertEqual(sorted(first['historical_wait_time']), [40, 40, 41, 41])
+
+    @unittest.skipUnless(PYARROW_AVAILABLE, 'pyarrow 未安装')
+    def test_incremental_collection_neither_duplicates_nor_drops(self):
+        collected = len(self.collector.collect_historical_data(days=30))
+        watermark = self.collector.store.get_watermark()
+        self.assertEqual(collected, self.samples().count())
+
+        # 一条恰好在水位线完成（上一批收集时可能尚未提交），一条在水位线之后完成
+        patient, = create_patients([1])
+        late = Queue.objects.bulk_create([
+            Queue(patient=patient, department=self.departments[0], examination=Examination.objects.first(),
+                  queue_number=f'L{i}', status='completed', estimated_wait_time=0, actual_wait_time=20)
+            for i in range(2)
+        ])
+        for queue, end_time in zip(late, (watermark, watermark + timezone.timedelta(minutes=1))):
+            enter_time = end_time - timezone.timedelta(minutes=30)
+            Queue.objects.filter(pk=queue.pk).update(
+                enter_time=enter_time, created_at=enter_time,
+                start_time=end_time - timezone.timedelta(minutes=10), end_time=end_time, updated_at=end_time
+            )
+
+        self.assertEqual(self.collector.collect_incremental_data(days=30), 2)
+        # 水位线上的记录再次被扫描到，按队列ID去重
+        self.assertEqual(self.collector.collect_incremental_data(days=30), 0)
+
+        stored = self.collector.store.read(columns=['queue_id'])
+        self.assertEqual(len(stored), collected + 2)
+        self.assertEqual(sorted(stored['queue_id']), sorted(self.samples().values_list('id', flat=True)))
+
+
+def square_job(value, delay):
+    """训练任务替身: 等待 delay 秒后返回结果，用于打乱完成顺序"""
+    time.sleep(delay)
+    return {'value': value * value, 'pid': os.getpid()}
+
+
+def failing_job(value):
+    raise ValueError(f'任务 {value} 出错')
+
+
+def empty_job():
+    return None
+
+
+class TrainingOrchestratorTests(SimpleTestCase):
+    """训练任务的结果按提交顺序返回，单个任务出错不影响其他任务"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # 子进程初始化时导入训练模块，先在父进程中导入，fork 出的子进程无需重新导入
+        import navigation.ml.trainer  # noqa: F401
+
+    def jobs(self):
+        # 先提交的任务最后完成
+        return [
+            TrainingJob('slow', square_job, 3, 0.3),
+            TrainingJob('failing', failing_job, 1),
+            TrainingJob('empty', empty_job),
+            TrainingJob('fast', square_job, 2, 0),
+        ]
+
+    def assert_results(self, results):
+        self.assertEqual([r['name'] for r in results], ['slow', 'failing', 'empty', 'fast'])
+        self.assertEqual([r['success'] for r in results], [True, False, False, True])
+        self.assertEqual((results[0]['result']['value'], results[3]['result']['value']), (9, 4))
+        self.assertEqual(results[1]['error'], '任务 1 出错')
+        self.assertEqual(results[2]['error'], '训练未产生模型')
+        self.assertTrue(all(r['duration'] is not None for r in results))
+
+    def test_process_pool_keeps_order_and_isolates_failures(self):
+        jobs = self.jobs() + [TrainingJob('unpicklable', lambda: {'value': 0})]
+        with self.assertLogs('navigation.ml.training_pool', 'ERROR'):
+            results = TrainingOrchestrator().run(jobs, max_workers=2)
+        self.assert_results(results[:4])
+        self.assertNotEqual(results[0]['result']['pid'], os.getpid())
+        # 无法序列化的任务单独失败
+        self.assertEqual((results[4]['name'], results[4]['success'], results[4]['duration']), ('unpicklable', False, None))
+
+    def test_billiard_pool_keeps_order_and_isolates_failures(self):
+        # 子进程中出错的任务只在子进程记录日志，fork 前替换 logger，不输出到测试结果中
+        with mock.patch('navigation.ml.training_pool.logger'):
+            results = TrainingOrchestrator()._run_billiard(self.jobs(), 2)
+        self.assert_results(results)
+        self.assertNotEqual(results[0]['result']['pid'], os.getpid())
+
+    def test_single_worker_runs_in_process(self):
+        with self.assertLogs('navigation.ml.training_pool', 'ERROR'):
+            results = TrainingOrchestrator().run(self.jobs(), max_workers=1)
+        self.assert_results(results)
+        self.assertEqual(results[0]['result']['pid'], os.getpid())
+
+        # 只有一个任务时不启动进程池，不可序列化的函数也能执行
+        result, = TrainingOrchestrator().run([TrainingJob('local', lambda: {'value': 1})], max_workers=4)
+        self.assertTrue(result['success'])
+
+
+@unittest.skipUnless(PYARROW_AVAILABLE, 'pyarrow 未安装')
+class TrainingDataStoreTests(SimpleTestCase):
+    """Parquet 训练数据存储的追加、按条件读取、计数、水位线和重建"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.store = TrainingDataStore(os.path.join(directory.name, 'store'))
+
+    @staticmethod
+    def rows(department_id, start, count, first_id):
+        df = training_frame(count, start, mean=30, department_id=department_id)
+        df['timestamp'] = df['timestamp'].dt.tz_localize('UTC')
+        df['actual_wait_time'] = df['actual_wait_time'].round().astype(int)
+        df.insert(0, 'queue_id', range(first_id, first_id + count))
+        df['priority'] = 0
+        return df
+
+    def test_append_read_and_count(self):
+        self.assertFalse(self.store.exists())
+        self.assertIsNone(self.store.read())
+        self.assertEqual(self.store.count_rows(), 0)
+
+        # 科室1的前10行跨过本地时间（UTC+8）零点，写入两个日期分区
+        first = pd.concat([self.rows(1, '2026-10-01 15:55', 10, 0), self.rows(2, '2026-10-01 15:55', 5, 100)])
+        second = self.rows(1, '2026-10-02 08:00', 6, 10)
+        self.assertEqual(self.store.append(first), 15)
+        self.assertEqual(self.store.append(second), 6)
+
+        self.assertEqual(self.store.count_rows(), 21)
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.store.root, 'department_id=1'))),
+            ['day=2026-10-01', 'day=2026-10-02']
+        )
+        df = self.store.read()
+        self.assertEqual(sorted(df['queue_id']), list(range(16)) + list(range(100, 105)))
+        self.assertTrue(df['timestamp'].is_monotonic_increasing)
+
+        department = self.store.read(columns=['queue_id', 'actual_wait_time'], department_id=1)
+        self.assertEqual(list(department.columns), ['queue_id', 'actual_wait_time'])
+        self.assertEqual(sorted(department['queue_id']), list(range(16)))
+        self.assertEqual(
+            department.set_index('queue_id')['actual_wait_time'].to_dict(),
+            pd.concat([first, second]).query('department_id == 1').set_index('queue_id')['actual_wait_time'].to_dict()
+        )
+
+        since = datetime(2026, 10, 1, 16, tzinfo=dt_timezone.utc)
+        recent = self.store.read(columns=['queue_id', 'timestamp'], since=since)
+        self.assertEqual(sorted(recent['queue_id']), list(range(5, 16)))
+        self.assertTrue((recent['timestamp'] >= since).all())
+
+    def test_watermark_round_trip(self):
+        self.assertIsNone(self.store.get_watermark())
+        watermark = datetime(2026, 10, 1, 8, 30, 15, 123456, tzinfo=dt_timezone.utc)
+        self.store.append(self.rows(1, '2026-10-01 08:00', 3, 0), watermark=watermark)
+        self.assertEqual(self.store.get_watermark(), watermark)
+
+        # 没有新数据时只推进水位线
+        later = watermark + timezone.timedelta(hours=1)
+        self.assertEqual(self.store.append(pd.DataFrame(), watermark=later), 0)
+        self.assertEqual(self.store.get_watermark(), later)
+        self.assertEqual(self.store.count_rows(), 3)
+
+    def test_failed_rebuild_keeps_existing_data(self):
+        self.store.append(self.rows(1, '2026-10-01 08:00', 4, 0))
+        with mock.patch.object(TrainingDataStore, 'append', side_effect=OSError('磁盘已满')):
+            with self.assertRaises(OSError):
+                self.store.rebuild(self.rows(1, '2026-10-02 08:00', 2, 50))
+
+        self.assertEqual(sorted(self.store.read()['queue_id']), [0, 1, 2, 3])
+        self.assertEqual(os.listdir(self.directory), ['store'])
+
+        watermark = datetime(2026, 10, 2, 9, tzinfo=dt_timezone.utc)
+        self.assertEqual(self.store.rebuild(self.rows(2, '2026-10-02 08:00', 2, 50), watermark=watermark), 2)
+        self.assertEqual(sorted(self.store.read()['queue_id']), [50, 51])
+        self.assertEqual(self.store.get_watermark(), watermark)
+        self.assertEqual(os.listdir(self.directory), ['store'])
+
+
+@override_settings(ML_MODEL_REGISTRY_KEEP=3, ML_MODEL_REGISTRY_CHECK_INTERVAL=0)
+class ModelRegistryTests(SimpleTestCase):
+    """模型注册表的原子发布、加载校验、回滚和新版本发现"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        self.registry = ModelRegistry(self.root)
+        self.path = os.path.join(self.root, 'xgboost_model_1.pkl')
+
+    def leftovers(self):
+        """发布过程中的临时文件"""
+        return [
+            name for _, _, files in os.walk(self.root) for name in files
+            if name.startswith('.tmp-') or name.startswith('.manifest-')
+        ]
+
+    def test_publish_is_atomic(self):
+        self.assertEqual(self.registry.publish({'v': 1}, self.path, {'mae': np.float64(1.5)}), 1)
+        self.assertEqual(self.registry.publish({'v': 2}, self.path), 2)
+        self.assertEqual(self.registry.load(self.path), ({'v': 2}, 2))
+        self.assertEqual(self.registry.current(self.path)['version'], 2)
+        self.assertEqual(self.registry.list_models()['xgboost_model_1.pkl']['versions']['1']['metrics'], {'mae': 1.5})
+
+        # 序列化失败时访问路径和 manifest 都保持不变
+        generation = self.registry.generation()
+
+        def broken_dump(model, path):
+            with open(path, 'wb') as f:
+                f.write(b'half')
+            raise OSError('磁盘已满')
+
+        with self.assertRaises(OSError):
+            self.registry.publish({'v': 3}, self.path, dump=broken_dump)
+        self.assertEqual(self.registry.load(self.path), ({'v': 2}, 2))
+        self.assertEqual(self.registry.generation(), generation)
+        self.assertEqual(self.leftovers(), [])
+
+    def test_old_versions_are_pruned(self):
+        for i in range(5):
+            self.registry.publish({'v': i}, self.path)
+        versions = self.registry.list_models()['xgboost_model_1.pkl']['versions']
+        self.assertEqual(sorted(versions, key=int), ['3', '4', '5'])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.root, 'versions', 'xgboost_model_1.pkl'))),
+                         ['v3.pkl', 'v4.pkl', 'v5.pkl'])
+        self.assertEqual(self.registry.verify(), [])
+
+    def test_load_verifies_checksum(self):
+        self.registry.publish({'v': 1}, self.path)
+        version_file = os.path.join(self.root, self.registry.current(self.path)['file'])
+        with open(version_file, 'ab') as f:
+            f.write(b'corrupted')
+
+        with self.assertRaisesMessage(ValueError, '校验失败'):
+            self.registry.load(self.path)
+        self.assertEqual(self.registry.verify(), [('xgboost_model_1.pkl', 1, '校验和不一致')])
+
+        # 未注册的旧模型直接从访问路径加载
+        legacy = os.path.join(self.root, 'legacy.pkl')
+        joblib.dump({'legacy': True}, legacy)
+        self.assertEqual(self.registry.load(legacy), ({'legacy': True}, None))
+
+    def test_rollback(self):
+        for i in range(1, 4):
+            self.registry.publish({'v': i}, self.path)
+
+        self.assertEqual(self.registry.rollback(self.path), 2)
+        self.assertEqual(self.registry.load(self.path), ({'v': 2}, 2))
+        self.assertEqual(joblib.load(self.path), {'v': 2})
+
+        self.assertEqual(self.registry.rollback(self.path, version=3), 3)
+        self.assertEqual(self.registry.load(self.path), ({'v': 3}, 3))
+        self.assertEqual(self.registry.rollback(self.path, version=1), 1)
+        with self.assertRaisesMessage(ValueError, '没有更早的版本'):
+            self.registry.rollback(self.path)
+        with self.assertRaisesMessage(ValueError, '不存在版本 9'):
+            self.registry.rollback(self.path, version=9)
+        with self.assertRaisesMessage(ValueError, '未注册'):
+            self.registry.rollback(os.path.join(self.root, 'unknown.pkl'))
+
+    def test_generation_watcher_sees_other_process_publish(self):
+        watcher = GenerationWatcher(ModelRegistry(self.root))
+        watcher.mark()
+        self.assertFalse(watcher.changed())
+
+        # 另一个进程的注册表实例发布新版本，本进程只通过 manifest 的文件状态发现
+        self.registry.publish({'v': 1}, self.path)
+        self.assertTrue(watcher.changed())
+        self.assertFalse(watcher.changed())
+
+        self.registry.rollback(self.path, version=1)
+        with self.settings(ML_MODEL_REGISTRY_CHECK_INTERVAL=60):
+            # 检查间隔内不重复检查
+            self.assertFalse(watcher.changed())
+        self.assertTrue(watcher.changed())
+
+
+class ModelSerializationTests(SimpleTestCase):
+    """原生 XGBoost 格式和精简的 Prophet 模型加载后与原来的 pickle 预测结果相同"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_xgboost_ubj_predicts_like_pickle(self):
+        import xgboost as xgb
+
+        df = training_frame(200, '2026-10-01 08:00', mean=30)
+        X, y = df.drop(columns=['actual_wait_time', 'timestamp']), df['actual_wait_time']
+        model = xgb.XGBRegressor(n_estimators=20, max_depth=3, n_jobs=1).fit(X, y)
+
+        pickle_path = os.path.join(self.directory, 'xgboost_model_1.pkl')
+        native_path = os.path.join(self.directory, f"xgboost_model_1{model_extension('xgboost')}")
+        joblib.dump(model, pickle_path)
+        dump_model_file(model, native_path)
+
+        self.assertEqual(find_model_file(self.directory, 'xgboost_model_1'), native_path)
+        native = load_model_file(native_path)
+        self.assertIsInstance(native, xgb.XGBRegressor)
+        np.testing.assert_array_equal(native.predict(X), load_model_file(pickle_path).predict(X))
+
+    @unittest.skipUnless(find_spec('prophet'), 'prophet 未安装')
+    def test_compact_prophet_predicts_like_pickle(self):
+        from prophet import Prophet
+
+        cmdstanpy_logger = logging.getLogger('cmdstanpy')
+        self.addCleanup(setattr, cmdstanpy_logger, 'disabled', cmdstanpy_logger.disabled)
+        cmdstanpy_logger.disabled = True
+
+        ds = pd.date_range('2026-09-01', periods=24 * 14, freq='h')
+        y = 30 + 10 * np.sin(ds.hour / 24 * 2 * np.pi) + np.random.default_rng(0).normal(0, 2, len(ds))
+        model = Prophet(daily_seasonality=True, weekly_seasonality=False, yearly_seasonality=False,
+                        uncertainty_samples=50)
+        model.fit(pd.DataFrame({'ds': ds, 'y': y}))
+
+        pickle_path = os.path.join(self.directory, 'original.pkl')
+        compact_path = os.path.join(self.directory, 'prophet_dept_1.pkl')
+        joblib.dump(model, pickle_path)
+        dump_model_file(model, compact_path)
+
+        # 精简的是副本，原模型保持完整
+        self.assertFalse(is_compact_prophet(model))
+        self.assertEqual(len(model.history), len(ds))
+        compact = load_model_file(compact_path)
+        self.assertTrue(is_compact_prophet(compact))
+        self.assertEqual(len(compact.history), PROPHET_HISTORY_ROWS)
+        self.assertLess(os.path.getsize(compact_path), os.path.getsize(pickle_path))
+
+        original = load_model_file(pickle_path)
+        future = original.make_future_dataframe(periods=24, freq='h', include_history=False)
+        pd.testing.assert_frame_equal(compact.make_future_dataframe(periods=24, freq='h', include_history=False), future)
+        expected, actual = original.predict(future), compact.predict(future)
+        np.testing.assert_allclose(actual['yhat'], expected['yhat'])
+        self.assertTrue((actual['yhat_lower'] <= actual['yhat']).all() and (actual['yhat'] <= actual['yhat_upper']).all())
+
+
+@unittest.skipUnless(find_spec('prophet'), 'prophet 未安装')
+class ProphetPredictorCacheTests(SimpleTestCase):
+    """预测器缓存按 LRU 淘汰，模型文件变化后重新加载，并统计命中情况"""
+
+    def setUp(self):
+        from .ml import prophet_predictor
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(BASE_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        # 注册表的替身: 不反序列化真实模型，只记录加载次数
+        self.loads = []
+        registry = SimpleNamespace(load=lambda path, loader: (self.loads.append(path) or object(), 1))
+        patcher = mock.patch.object(prophet_predictor, 'registry_for', return_value=registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.cache = prophet_predictor.ProphetPredictorCache(max_size=2)
+
+    def write_model(self, department_id, mtime=None):
+        path = prophet_model_path(department_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'model')
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_evicts_least_recently_used(self):
+        for department_id in (1, 2, 3):
+            self.write_model(department_id)
+
+        first = self.cache.get(1)
+        self.cache.get(2)
+        self.assertIs(self.cache.get(1), first)
+        # 容量为2，加入科室3时淘汰最久未使用的科室2
+        self.cache.get(3)
+        self.assertEqual(list(self.cache._predictors), [(1, None), (3, None)])
+        self.assertIs(self.cache.get(1), first)
+        self.cache.get(2)
+        self.assertEqual(list(self.cache._predictors), [(1, None), (2, None)])
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['max_size'], 2)
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (2, 4, 2))
+        self.assertAlmostEqual(stats['hit_rate'], 2 / 6)
+        self.assertEqual(len(self.loads), 4)
+
+    def test_reloads_after_model_file_changes(self):
+        path = self.write_model(1, mtime=1_000_000)
+        predictor = self.cache.get(1)
+        self.assertIsNotNone(predictor.model)
+        self.assertIs(self.cache.get(1), predictor)
+        self.assertEqual(len(self.loads), 1)
+
+        # 重新训练后文件修改时间变化，原地重新加载
+        os.utime(path, (1_000_100, 1_000_100))
+        self.assertIs(self.cache.get(1), predictor)
+        self.assertEqual(predictor.model_mtime, 1_000_100)
+        self.assertEqual(len(self.loads), 2)
+
+        # 模型文件被删除后不再保留旧模型
+        os.remove(path)
+        self.assertIsNone(self.cache.get(1).model)
+
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['reloads']), (1, 1, 2))
+        self.assertEqual(len(self.loads), 2)
+
+    def test_missing_model_is_cached_until_file_appears(self):
+        predictor = self.cache.get(1)
+        self.assertIsNone(predictor.model)
+        self.assertIs(self.cache.get(1), predictor)
+        self.assertEqual(self.loads, [])
+
+        self.write_model(1)
+        self.assertIsNotNone(self.cache.get(1).model)
+        self.assertEqual(self.cache.stats()['reloads'], 1)
+
+        self.cache.clear()
+        self.assertEqual(self.cache.stats(), {
+            'size': 0, 'max_size': 2, 'hits': 0, 'misses': 0, 'reloads': 0,
+            'evictions': 0, 'hit_rate': 0.0, 'load_time': 0.0,
+        })
+
+
+@override_settings(ML_INFERENCE_SERVER=None)
+class PredictManyTests(SimpleTestCase):
+    """predict_many 的批量结果与逐行调用 predict_wait_time 一致，没有模型的科室使用简单计算"""
+
+    NOW = datetime(2026, 10, 1, 9, 30, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        import xgboost as xgb
+        from .ml import models as ml_models
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(mock.patch.stopall)
+        for patcher in (
+            mock.patch.object(ml_models, 'MODEL_DIR', directory.name),
+            mock.patch.object(ml_models.timezone, 'now', return_value=self.NOW),
+            # 实时数据的替身: 只有科室1有数据，科室2使用默认值
+            mock.patch(
+                'navigation.ml.data_collector.data_collector.collect_real_time_data',
+                return_value={1: {'department_capacity': 8, 'staff_efficiency': 1.2, 'historical_wait_time': 25.0}},
+            ),
+        ):
+            patcher.start()
+
+        df = training_frame(200, '2026-10-01 08:00', mean=30)
+        predictor = ml_models.WaitTimePredictor(1)
+        predictor.model = xgb.XGBRegressor(n_estimators=20, max_depth=3, n_jobs=1).fit(
+            df[predictor.features], df['actual_wait_time']
+        )
+        self.model_predict = mock.patch.object(predictor.model, 'predict', wraps=predictor.model.predict).start()
+
+        self.service = ml_models.WaitTimePredictionService()
+        self.service._predictors = {1: predictor}
+        self.service._loaded = True
+        mock.patch.object(self.service._watcher, 'changed', return_value=False).start()
+
+    def rows(self):
+        return [
+            {'department_id': 1, 'queue_count': 3, 'equipment_status': 1, 'priority': 0},
+            {'department_id': 2, 'queue_count': 5, 'equipment_status': 0, 'priority': 1},
+            {'department_id': 1, 'queue_count': 12, 'equipment_status': 0, 'priority': 2,
+             'department_capacity': 12, 'staff_efficiency': 0.8, 'historical_wait_time': 40.0},
+            {'department_id': 2, 'queue_count': 0, 'equipment_status': 1, 'priority': 0,
+             'department_capacity': 5, 'staff_efficiency': 1.0, 'historical_wait_time': None},
+            {'department_id': 1, 'queue_count': 7, 'equipment_status': 1, 'priority': 1},
+        ]
+
+    def test_matches_per_row_predictions(self):
+        rows = self.rows()
+        expected = [self.service.predict_wait_time(**row) for row in rows]
+        self.model_predict.reset_mock()
+
+        actual = self.service.predict_many(None, rows)
+        np.testing.assert_allclose(actual, expected, rtol=1e-6)
+        # 同一科室的所有行只调用一次模型
+        self.assertEqual(self.model_predict.call_count, 1)
+
+    def test_department_without_model_uses_simple_prediction(self):
+        rows = [row for row in self.rows() if row['department_id'] == 2]
+        for row in rows:
+            del row['department_id']
+
+        actual = self.service.predict_many(2, rows)
+        expected = [
+            self.service._simple_prediction(5, 0, 1, 10, 1.0),
+            self.service._simple_prediction(0, 1, 0, 5, 1.0),
+        ]
+        np.testing.assert_allclose(actual, expected)
+        self.model_predict.assert_not_called()
+
+    def test_requires_department(self):
+        with self.assertRaises(ValueError):
+            self.service.predict_many(None, [{'queue_count': 1}])
+        self.assertEqual(len(self.service.predict_many(1, [])), 0)
+
+
+@override_settings(ML_TUNING_CV=3, ML_TUNING_CACHE_DAYS=7)
+class HyperParameterTuningTests(SimpleTestCase):
+    """超参数搜索受计算预算限制，科室调优参数被缓存复用并按天数过期"""
+
+    def setUp(self):
+        import xgboost as xgb
+        from .ml.trainer import ModelTrainer
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.trainer = ModelTrainer()
+        self.trainer.model_dir = directory.name
+        # 搜索在本进程内串行执行，才能统计训练次数
+        self.trainer.n_jobs = 1
+        self.df = training_frame(120, '2026-10-01 08:00', mean=30)
+
+        fit = xgb.XGBRegressor.fit
+        self.fits = []
+
+        def record_fit(model, *args, **kwargs):
+            self.fits.append(model.get_params()['n_estimators'])
+            return fit(model, *args, **kwargs)
+
+        patcher = mock.patch.object(xgb.XGBRegressor, 'fit', autospec=True, side_effect=record_fit)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tune(self, **kwargs):
+        self.fits.clear()
+        model, metrics = self.trainer.hyper_parameter_tuning(self.df.copy(), department_id=1, publish=False, **kwargs)
+        self.assertIsNotNone(model)
+        return metrics['best_params']
+
+    def test_budget_caps_number_of_fits(self):
+        # 随机搜索: budget // cv 个候选，每个候选 cv 次训练，最后用最佳参数重新训练一次
+        self.tune(search='random', budget=6, use_cache=False)
+        self.assertEqual(len(self.fits), 6 + 1)
+
+        # 逐次减半: 按树的数量折算成完整训练次数后不超过预算
+        max_resources = max(self.trainer.PARAM_GRIDS['xgboost']['n_estimators'])
+        self.tune(search='halving', budget=12, use_cache=False)
+        self.assertLessEqual(sum(self.fits[:-1]) / max_resources, 12)
+        self.assertGreater(len(self.fits), 3 + 1)
+
+    def test_cached_params_are_reused_until_expired(self):
+        params = self.tune(search='random', budget=6)
+        path = self.trainer._tuned_params_path('xgboost', 1)
+        with open(path) as f:
+            cached = json.load(f)
+        self.assertEqual(cached['params'], params)
+        self.assertEqual((cached['search'], cached['fits']), ('random', 6))
+        self.assertEqual(self.trainer.load_tuned_params('xgboost', 1), params)
+
+        # 缓存有效时跳过搜索，只用缓存参数训练一次
+        self.assertEqual(self.tune(search='random', budget=6), params)
+        self.assertEqual(self.fits, [params['n_estimators']])
+
+        # 超过 ML_TUNING_CACHE_DAYS 天后缓存失效，重新搜索
+        cached['tuned_at'] = (pd.Timestamp.now() - pd.Timedelta(days=8)).strftime('%Y-%m-%d %H:%M:%S')
+        with open(path, 'w') as f:
+            json.dump(cached, f)
+        self.assertIsNone(self.trainer.load_tuned_params('xgboost', 1))
+        self.tune(search='random', budget=6)
+        self.assertEqual(len(self.fits), 6 + 1)
+        with self.settings(ML_TUNING_CACHE_DAYS=30):
+            self.assertEqual(self.trainer.load_tuned_params('xgboost', 1), params)
+
+    def test_small_department_skips_tuning(self):
+        self.df = self.df.head(self.trainer.MIN_TUNING_ROWS - 1)
+        with mock.patch.object(self.trainer, 'train_model', return_value=(None, None)) as train_model:
+            self.trainer.hyper_parameter_tuning(self.df, department_id=1)
+        train_model.assert_called_once()
+        self.assertEqual(self.fits, [])
+        self.assertFalse(os.path.exists(self.trainer._tuned_params_path('xgboost', 1)))
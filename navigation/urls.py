@@ -17,6 +17,7 @@ router.register(r'departments', views.DepartmentViewSet)
 router.register(r'equipment', views.EquipmentViewSet)
 router.register(r'examinations', views.ExaminationViewSet)
 router.register(r'queues', views.QueueViewSet)
+router.register(r'queue-history', views.QueueHistoryViewSet)
 router.register(r'notification-templates', views.NotificationTemplateViewSet)
 
 app_name = 'navigation'  # 添加应用命名空间
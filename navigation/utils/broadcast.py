@@ -0,0 +1,164 @@
+"""
+队列变更的 WebSocket 广播
+
+将短时间内的多次变更合并为一次广播：第一次变更启动一个时间窗口
+(settings.QUEUE_UPDATE_BROADCAST_WINDOW，默认0.25秒)，窗口结束时为受影响的范围
+（全院看板和各相关科室）各构建一个新版本的快照，通过 channel layer 把版本号发送给
+对应的订阅组。批量操作期间可以用 suppress_queue_updates() 暂停广播，结束后只发送一次。
+
+多进程之间通过缓存中按范围区分的锁合并: 同一窗口内每个范围只有一个进程负责发送。
+"""
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+QUEUE_UPDATES_GROUP = 'queue_updates'
+
+
+def get_group_name(department_id=None):
+    """获取订阅组名称，department_id 为None时为全院看板"""
+    if department_id is None:
+        return QUEUE_UPDATES_GROUP
+    return f'{QUEUE_UPDATES_GROUP}_dept_{department_id}'
+
+
+class QueueUpdatePublisher:
+    """合并队列变更并广播看板快照"""
+
+    LOCK_KEY = 'queue_update_broadcast_lock_{scope}'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timer = None
+        self._pending = set()
+        self._local = threading.local()
+
+    @property
+    def window(self):
+        return getattr(settings, 'QUEUE_UPDATE_BROADCAST_WINDOW', 0.25)
+
+    def _suppress_depth(self):
+        return getattr(self._local, 'depth', 0)
+
+    def _lock_key(self, scope):
+        return self.LOCK_KEY.format(scope='all' if scope is None else scope)
+
+    def publish(self, department_ids=()):
+        """
+        登记一次队列变更
+
+        参数:
+        - department_ids: 受影响的科室ID；全院看板总是会更新
+
+        在事务中调用时，等事务提交后再登记，保证快照读取到已提交的数据。
+        """
+        scopes = {None} | {d for d in department_ids if d is not None}
+        if self._suppress_depth() > 0:
+            self._local.pending |= scopes
+            return
+        transaction.on_commit(lambda: self._schedule(scopes))
+
+    def _schedule(self, scopes):
+        window = self.window
+        if window <= 0:
+            self.flush(scopes)
+            return
+
+        claimed = set()
+        for scope in scopes:
+            # 其他进程已在当前窗口内安排发送该范围，本次变更会包含在它的快照中
+            try:
+                if not cache.add(self._lock_key(scope), 1, timeout=max(int(window * 4), 1)):
+                    continue
+            except Exception as e:
+                logger.warning(f"获取广播锁失败，直接安排发送: {str(e)}")
+            claimed.add(scope)
+
+        if not claimed:
+            return
+
+        with self._lock:
+            self._pending |= claimed
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(window, self._flush_from_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_from_timer(self):
+        with self._lock:
+            self._timer = None
+            scopes, self._pending = self._pending, set()
+        try:
+            self.flush(scopes)
+        finally:
+            # 定时器线程中的数据库连接不会被请求周期关闭
+            connections.close_all()
+
+    def flush(self, scopes=(None,)):
+        """立即为各范围构建新版本的快照并广播版本号"""
+        from navigation.utils.snapshot import snapshot_store
+
+        channel_layer = get_channel_layer()
+        for scope in scopes:
+            # 先释放锁再构建快照: 此后提交的变更会重新安排一次发送
+            try:
+                cache.delete(self._lock_key(scope))
+            except Exception as e:
+                logger.warning(f"释放广播锁失败: {str(e)}")
+
+            try:
+                version, _ = snapshot_store.publish(scope)
+                async_to_sync(channel_layer.group_send)(
+                    get_group_name(scope),
+                    {
+                        'type': 'queue_update',
+                        'message': 'data_updated',
+                        'version': version,
+                    }
+                )
+            except Exception as e:
+                logger.error(f"广播队列更新失败(科室 {scope}): {str(e)}")
+
+    def flush_pending(self):
+        """进程退出前发送尚未到期的广播"""
+        with self._lock:
+            timer, self._timer = self._timer, None
+            scopes, self._pending = self._pending, set()
+        if timer is not None:
+            timer.cancel()
+        if scopes:
+            self.flush(scopes)
+
+    @contextmanager
+    def suppress(self):
+        """在代码块内暂停广播，结束后如有变更只广播一次"""
+        self._local.depth = self._suppress_depth() + 1
+        if self._local.depth == 1:
+            self._local.pending = set()
+        try:
+            yield
+        finally:
+            self._local.depth -= 1
+            if self._local.depth == 0 and self._local.pending:
+                scopes, self._local.pending = self._local.pending, set()
+                self.publish(scopes)
+
+
+# 全局广播实例
+queue_update_publisher = QueueUpdatePublisher()
+atexit.register(queue_update_publisher.flush_pending)
+
+
+def suppress_queue_updates():
+    """批量操作期间暂停队列广播，结束后合并为一次"""
+    return queue_update_publisher.suppress()
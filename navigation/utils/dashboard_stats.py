@@ -0,0 +1,121 @@
+"""
+看板统计服务
+
+用一次分组查询 (department_id, status) 计算全院和各科室的排队统计，
+结果短时间缓存（settings.DASHBOARD_STATS_CACHE_TTL，默认5秒），队列变更时失效。
+首页、科室列表、统计接口和 WebSocket 看板共用同一份结果。
+"""
+import logging
+from datetime import datetime, time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def _empty_counts():
+    return {'waiting_count': 0, 'processing_count': 0, 'completed_today': 0}
+
+
+class DashboardStatsService:
+    """全院及科室排队统计"""
+
+    CACHE_KEY = 'dashboard_stats'
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'DASHBOARD_STATS_CACHE_TTL', 5)
+
+    def _compute(self):
+        """一次分组查询计算所有统计"""
+        from navigation.models import Queue
+
+        today = timezone.localdate()
+        today_start = timezone.make_aware(datetime.combine(today, time.min))
+
+        rows = Queue.objects.filter(
+            Q(status__in=['waiting', 'processing']) |
+            Q(status='completed', end_time__gte=today_start)
+        ).order_by().values('department_id', 'status').annotate(count=Count('id'))
+
+        departments = {}
+        for row in rows:
+            counts = departments.setdefault(row['department_id'], _empty_counts())
+            if row['status'] == 'completed':
+                counts['completed_today'] += row['count']
+            else:
+                counts[f"{row['status']}_count"] += row['count']
+
+        waiting = sum(c['waiting_count'] for c in departments.values())
+        processing = sum(c['processing_count'] for c in departments.values())
+        return {
+            'date': today.isoformat(),
+            'stats': {
+                'total_patients': waiting + processing,
+                'waiting_queues': waiting,
+                'processing_queues': processing,
+                'completed_today': sum(c['completed_today'] for c in departments.values()),
+            },
+            'departments': departments,
+        }
+
+    def get(self):
+        """获取统计结果，优先使用缓存"""
+        try:
+            data = cache.get(self.CACHE_KEY)
+        except Exception as e:
+            logger.warning(f"读取看板统计缓存失败: {str(e)}")
+            data = None
+
+        # 跨天后缓存中的"今日完成数"已失效
+        if data is None or data.get('date') != timezone.localdate().isoformat():
+            data = self._compute()
+            try:
+                cache.set(self.CACHE_KEY, data, timeout=self.timeout)
+            except Exception as e:
+                logger.warning(f"写入看板统计缓存失败: {str(e)}")
+        return data
+
+    def get_stats(self, department_id=None):
+        """
+        获取统计数据
+
+        返回:
+        - dict: total_patients、waiting_queues、processing_queues、completed_today
+        """
+        data = self.get()
+        if department_id is None:
+            return dict(data['stats'])
+
+        counts = data['departments'].get(department_id, _empty_counts())
+        return {
+            'total_patients': counts['waiting_count'] + counts['processing_count'],
+            'waiting_queues': counts['waiting_count'],
+            'processing_queues': counts['processing_count'],
+            'completed_today': counts['completed_today'],
+        }
+
+    def get_department_counts(self, department_id):
+        """获取科室的 waiting_count、processing_count、completed_today"""
+        return dict(self.get()['departments'].get(department_id, _empty_counts()))
+
+    def annotate_departments(self, departments):
+        """为科室对象设置 waiting_count 属性，不产生额外查询"""
+        counts = self.get()['departments']
+        for dept in departments:
+            dept.waiting_count = counts.get(dept.id, _empty_counts())['waiting_count']
+        return departments
+
+    def invalidate(self):
+        """队列状态变化时清除缓存"""
+        try:
+            cache.delete(self.CACHE_KEY)
+        except Exception as e:
+            logger.warning(f"清除看板统计缓存失败: {str(e)}")
+
+
+# 全局统计服务实例
+dashboard_stats = DashboardStatsService()
@@ -0,0 +1,207 @@
+"""
+批量入队
+
+HIS 早高峰挂号时一次推送数百名患者。逐条通过 Queue.save() 入队时，每条都要执行 clean() 的
+每日接诊量和未完成队列查询、队列号唯一性循环和完整的等待时间预估。这里对整批数据:
+
+- 用集合查询校验患者、科室、检查项目、设备、未完成队列和每日接诊量，与 Queue.clean() 的规则一致
+- 一次分配所有队列号，格式与 Queue.generate_queue_number() 相同，冲突时改用随机后缀
+- 通过 BatchWaitTimeEstimator.estimate_new() 一次计算全部等待时间
+- 用 bulk_create 写入，科室排队位置索引和看板广播每批只触发一次
+
+校验、队列号分配和写入在同一个事务中完成，涉及的科室行用 select_for_update 锁定，
+同一科室的并发批量入队依次执行，每日接诊量和未完成队列的校验不会被并发请求绕过。
+队列号与其他途径（如 Queue.save()）同时创建的队列冲突时，重新分配后重试写入。
+"""
+import hashlib
+import logging
+import random
+from datetime import datetime, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from navigation.models import Department, Equipment, Examination, Patient, Queue
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('waiting', 'processing')
+
+# 队列号冲突时重新分配并重试写入的次数
+MAX_NUMBERING_ATTEMPTS = 3
+
+
+class BatchQueueAdmission:
+    """
+    批量创建队列
+
+    items 为字典列表，每项包含 patient、department、examination（ID），
+    可选 equipment（ID）、priority 和 notes。列表顺序即进入队列的顺序。
+    """
+
+    def __init__(self, items, now=None):
+        self.items = list(items)
+        self.now = now or timezone.now()
+
+    def admit(self, atomic=False, batch_size=500):
+        """
+        校验并创建队列
+
+        参数:
+        - atomic: 为True时只要有一项校验失败，整批都不创建
+
+        返回:
+        - (queues, errors): 已创建的队列列表和 [{'index': 序号, 'errors': {字段: 信息}}] 形式的错误列表
+        """
+        # 等待时间计算依赖 NumPy，和信号、索引一起只在入队时导入
+        from navigation.signals import broadcast_queue_update
+        from navigation.utils.queue_index import queue_index
+        from navigation.utils.wait_time import BatchWaitTimeEstimator
+
+        with transaction.atomic():
+            queues, errors = self._build_queues()
+            if errors and atomic:
+                return [], errors
+            if not queues:
+                return [], errors
+
+            wait_times = BatchWaitTimeEstimator(now=self.now).estimate_new(queues)
+            for queue, wait_time in zip(queues, wait_times):
+                queue.estimated_wait_time = wait_time
+            self._insert(queues, batch_size)
+
+            # bulk_create 不触发模型信号，提交后按批次通知排队位置索引并广播一次
+            department_ids = {queue.department_id for queue in queues}
+            transaction.on_commit(lambda: queue_index.notify_changed(department_ids))
+            broadcast_queue_update(department_ids)
+
+        logger.info(f"批量入队: 共 {len(self.items)} 条，创建 {len(queues)} 个队列，{len(errors)} 条校验失败")
+        return queues, errors
+
+    def _insert(self, queues, batch_size):
+        """分配队列号并写入，队列号与并发创建的队列冲突时重新分配后重试"""
+        for attempt in range(1, MAX_NUMBERING_ATTEMPTS + 1):
+            for queue, queue_number in zip(queues, self._allocate_queue_numbers(queues)):
+                queue.queue_number = queue_number
+            try:
+                # 保存点: 冲突时只回滚这次写入，已持有的科室锁保持不变
+                with transaction.atomic():
+                    Queue.objects.bulk_create(queues, batch_size=batch_size)
+                return
+            except IntegrityError as e:
+                for queue in queues:
+                    queue.pk = None
+                if attempt == MAX_NUMBERING_ATTEMPTS:
+                    raise
+                logger.warning(f"批量入队队列号冲突，重新分配后重试（第 {attempt} 次）: {str(e)}")
+
+    def _load(self, queryset, field):
+        ids = {item[field] for item in self.items if item.get(field) is not None}
+        return queryset.in_bulk(ids) if ids else {}
+
+    def _build_queues(self):
+        """按集合查询校验整批数据，返回通过校验的未保存队列和错误列表"""
+        patients = self._load(Patient.objects.all(), 'patient')
+        # 锁定涉及的科室直到事务结束，按ID顺序加锁避免并发批次之间死锁
+        departments = self._load(Department.objects.select_for_update().order_by('pk'), 'department')
+        examinations = self._load(Examination.objects.all(), 'examination')
+        equipment = self._load(Equipment.objects.all(), 'equipment')
+
+        active = dict(
+            Queue.objects.filter(
+                patient_id__in=list(patients), status__in=ACTIVE_STATUSES
+            ).order_by().values_list('patient_id', 'department__name')
+        )
+        daily_counts = self._daily_counts(departments.values())
+
+        queues = []
+        errors = []
+        for index, item in enumerate(self.items):
+            patient = patients.get(item.get('patient'))
+            department = departments.get(item.get('department'))
+            examination = examinations.get(item.get('examination'))
+            device = equipment.get(item.get('equipment')) if item.get('equipment') is not None else None
+
+            item_errors = {}
+            if patient is None:
+                item_errors['patient'] = '患者不存在'
+            if department is None:
+                item_errors['department'] = '科室不存在'
+            if examination is None:
+                item_errors['examination'] = '检查项目不存在'
+            if item.get('equipment') is not None and device is None:
+                item_errors['equipment'] = '设备不存在'
+
+            if department is not None:
+                if examination is not None and examination.department_id != department.id:
+                    item_errors['examination'] = '检查项目不属于选择的科室'
+                if device is not None and device.department_id != department.id:
+                    item_errors['equipment'] = '设备不属于选择的科室'
+            if patient is not None and patient.id in active:
+                item_errors['patient'] = f'患者在{active[patient.id]}还有未完成的检查'
+            if not item_errors and department.max_daily_patients:
+                if daily_counts.get(department.id, 0) >= department.max_daily_patients:
+                    item_errors['department'] = '该科室今日预约已满'
+
+            if item_errors:
+                errors.append({'index': index, 'errors': item_errors})
+                continue
+
+            # 同一批次中的后续条目视为已有未完成队列，并计入当日接诊量
+            active[patient.id] = department.name
+            daily_counts[department.id] = daily_counts.get(department.id, 0) + 1
+            queues.append(Queue(
+                patient=patient,
+                department=department,
+                examination=examination,
+                equipment=device,
+                # 与 Queue.save() 一致，未指定优先级时继承患者优先级
+                priority=item.get('priority') or patient.priority,
+                notes=item.get('notes') or '',
+                status='waiting',
+            ))
+        return queues, errors
+
+    def _daily_counts(self, departments):
+        """有每日接诊上限的科室当天已创建的队列数"""
+        limited = [department.id for department in departments if department.max_daily_patients]
+        if not limited:
+            return {}
+        day_start = timezone.make_aware(datetime.combine(timezone.localdate(self.now), datetime.min.time()))
+        return dict(
+            Queue.objects.filter(
+                department_id__in=limited,
+                created_at__gte=day_start,
+                created_at__lt=day_start + timedelta(days=1)
+            ).order_by().values('department_id').annotate(count=Count('id')).values_list('department_id', 'count')
+        )
+
+    def _allocate_queue_numbers(self, queues):
+        """
+        一次分配整批队列号: {科室代码}{日期}{时间}{患者姓名哈希后4位}
+
+        与已有队列号或批次内其他队列号冲突时改用随机后缀，每轮只查询一次冲突的候选号
+        """
+        prefix_time = self.now.strftime('%Y%m%d%H%M%S')
+        prefixes = [f"{queue.department.code}{prefix_time}" for queue in queues]
+        candidates = {
+            i: prefix + hashlib.md5(queue.patient.name.encode('utf-8')).hexdigest()[-4:]
+            for i, (prefix, queue) in enumerate(zip(prefixes, queues))
+        }
+
+        numbers = [None] * len(queues)
+        assigned = set()
+        while candidates:
+            taken = set(Queue.objects.filter(
+                queue_number__in=set(candidates.values())
+            ).values_list('queue_number', flat=True))
+            pending = {}
+            for i, candidate in candidates.items():
+                if candidate in taken or candidate in assigned:
+                    pending[i] = prefixes[i] + ''.join(random.choices('0123456789abcdef', k=4))
+                else:
+                    numbers[i] = candidate
+                    assigned.add(candidate)
+            candidates = pending
+        return numbers
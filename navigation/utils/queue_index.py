@@ -0,0 +1,205 @@
+"""
+科室排队位置索引
+
+按科室维护等待中队列的有序索引，排序键与 Queue.Meta.ordering 一致:
+(-priority, enter_time, id)。位置查询在内存中通过二分查找完成，复杂度 O(log n)，
+不再对每一行执行一次 COUNT 查询。
+
+多进程一致性: 每个科室在缓存中保存一个版本号，任何进程修改该科室的等待队列后都会
+递增版本号；其他进程在查询时发现版本号变化，就用一次查询重新加载该科室的索引。
+"""
+import bisect
+import logging
+import threading
+
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# 影响排队顺序的字段，只更新其他字段时无需同步索引
+ORDERING_FIELDS = {'status', 'priority', 'enter_time', 'department', 'department_id'}
+
+
+def _sort_key(priority, enter_time, queue_id):
+    """构建排序键，与 Queue.Meta.ordering = ['-priority', 'enter_time'] 保持一致"""
+    return (-priority, enter_time.timestamp() if enter_time else 0.0, queue_id)
+
+
+class _DepartmentIndex:
+    """单个科室的有序索引"""
+
+    __slots__ = ('version', 'keys', 'entries')
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.entries = {
+            queue_id: _sort_key(priority, enter_time, queue_id)
+            for queue_id, priority, enter_time in rows
+        }
+        self.keys = sorted(self.entries.values())
+
+    def position(self, queue_id):
+        key = self.entries.get(queue_id)
+        if key is None:
+            return None
+        return bisect.bisect_left(self.keys, key) + 1
+
+    def upsert(self, queue_id, priority, enter_time):
+        self.remove(queue_id)
+        key = _sort_key(priority, enter_time, queue_id)
+        self.entries[queue_id] = key
+        bisect.insort(self.keys, key)
+
+    def remove(self, queue_id):
+        key = self.entries.pop(queue_id, None)
+        if key is not None:
+            i = bisect.bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                del self.keys[i]
+
+
+class QueuePositionIndex:
+    """
+    进程内的科室排队位置索引
+
+    - get_position(queue): 队列在科室等待队列中的位置（从1开始）
+    - get_ahead_count(queue): 排在前面的人数
+    - get_department_positions(department_id): 科室内所有等待队列的位置映射
+    """
+
+    VERSION_KEY = 'queue_index_version_{department_id}'
+
+    def __init__(self):
+        self._departments = {}
+        self._lock = threading.RLock()
+
+    def _version_key(self, department_id):
+        return self.VERSION_KEY.format(department_id=department_id)
+
+    def _get_version(self, department_id):
+        try:
+            return cache.get(self._version_key(department_id), 0)
+        except Exception as e:
+            logger.warning(f"读取排队索引版本号失败: {str(e)}")
+            return None
+
+    def _bump_version(self, department_id):
+        """递增科室版本号，返回新的版本号"""
+        key = self._version_key(department_id)
+        try:
+            cache.add(key, 0, timeout=None)
+            return cache.incr(key)
+        except Exception as e:
+            logger.warning(f"更新排队索引版本号失败: {str(e)}")
+            return None
+
+    def _load(self, department_id, version):
+        from navigation.models import Queue
+
+        rows = Queue.objects.filter(
+            department_id=department_id,
+            status='waiting'
+        ).values_list('id', 'priority', 'enter_time')
+        index = _DepartmentIndex(version, rows)
+        self._departments[department_id] = index
+        return index
+
+    def _get_index(self, department_id):
+        """获取科室索引，版本号变化或尚未加载时从数据库重新加载"""
+        version = self._get_version(department_id)
+        with self._lock:
+            index = self._departments.get(department_id)
+            if index is None or version is None or index.version != version:
+                index = self._load(department_id, version)
+            return index
+
+    def get_position(self, queue):
+        """获取队列在科室中的位置，非等待状态返回None"""
+        if queue.status != 'waiting' or queue.pk is None:
+            return None
+        index = self._get_index(queue.department_id)
+        with self._lock:
+            position = index.position(queue.pk)
+            if position is None:
+                # 本进程索引中缺少该队列（例如刚由其他连接写入），重新加载一次
+                index = self._load(queue.department_id, index.version)
+                position = index.position(queue.pk)
+        return position
+
+    def get_ahead_count(self, queue):
+        """获取排在前面的人数"""
+        position = self.get_position(queue)
+        return position - 1 if position is not None else None
+
+    def get_department_positions(self, department_id):
+        """
+        获取科室内所有等待队列的位置
+
+        返回:
+        - dict: {queue_id: position}
+        """
+        index = self._get_index(department_id)
+        with self._lock:
+            return {
+                queue_id: bisect.bisect_left(index.keys, key) + 1
+                for queue_id, key in index.entries.items()
+            }
+
+    def sync(self, queue, previous_department_id=None, deleted=False):
+        """
+        在队列保存或删除后同步索引
+
+        在事务中保存时，只丢弃本进程的索引并在提交后通知其他进程，
+        避免回滚后索引中残留未提交的数据。deleted 为True时无论内存中的状态如何都从索引中移除。
+        """
+        department_ids = {queue.department_id}
+        if previous_department_id and previous_department_id != queue.department_id:
+            department_ids.add(previous_department_id)
+
+        if transaction.get_connection().in_atomic_block:
+            for department_id in department_ids:
+                self.invalidate(department_id)
+                transaction.on_commit(lambda d=department_id: self._bump_version(d))
+            return
+
+        for department_id in department_ids:
+            with self._lock:
+                index = self._departments.get(department_id)
+                if index is not None:
+                    if not deleted and queue.status == 'waiting' and queue.department_id == department_id:
+                        index.upsert(queue.pk, queue.priority, queue.enter_time)
+                    else:
+                        index.remove(queue.pk)
+            version = self._bump_version(department_id)
+            with self._lock:
+                index = self._departments.get(department_id)
+                if index is None:
+                    continue
+                if version is not None and index.version is not None and version == index.version + 1:
+                    index.version = version
+                else:
+                    # 期间有其他进程修改过该科室，下次查询时重新加载
+                    self._departments.pop(department_id, None)
+
+    def remove(self, queue, previous_department_id=None):
+        """在队列删除后同步索引，已删除的行总是从索引中移除"""
+        self.sync(queue, previous_department_id, deleted=True)
+
+    def invalidate(self, department_id=None):
+        """丢弃本进程中的科室索引，下次查询时重新加载"""
+        with self._lock:
+            if department_id is None:
+                self._departments.clear()
+            else:
+                self._departments.pop(department_id, None)
+
+    def notify_changed(self, department_ids):
+        """批量写入（bulk_create/update）后通知所有进程重新加载相关科室"""
+        for department_id in set(department_ids):
+            self.invalidate(department_id)
+            self._bump_version(department_id)
+
+
+# 全局索引实例
+queue_index = QueuePositionIndex()
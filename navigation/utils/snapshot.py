@@ -0,0 +1,275 @@
+"""
+队列看板快照
+
+构建 ws/queue_updates/ 推送的看板数据（统计、科室、队列），
+每次变更只构建一次，由所有连接的 QueueConsumer 共用。
+
+快照带有递增的版本号，编码后的JSON按版本存放在缓存中；广播消息只携带版本号，
+各进程按版本号读取一次并在本地缓存，已持有该版本的连接不会重复发送。
+"""
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from navigation.utils.dashboard_stats import dashboard_stats
+from navigation.utils.queue_index import queue_index
+
+logger = logging.getLogger(__name__)
+
+
+def get_stats(department_id=None):
+    """获取统计数据，来自共享的看板统计服务"""
+    return dashboard_stats.get_stats(department_id)
+
+
+def get_departments(department_id=None):
+    """获取启用科室及其等待人数"""
+    from navigation.models import Department
+
+    departments = Department.objects.filter(is_active=True)
+    if department_id is not None:
+        departments = departments.filter(id=department_id)
+    return [
+        {
+            'name': dept['name'],
+            'code': dept['code'],
+            'location': dept['location'],
+            'waiting_count': dashboard_stats.get_department_counts(dept['id'])['waiting_count'],
+        }
+        for dept in departments.values('id', 'name', 'code', 'location')
+    ]
+
+
+def get_queues(department_id=None):
+    """获取活动队列，排队人数由科室排队位置索引批量提供"""
+    from navigation.models import Queue
+
+    rows = Queue.objects.filter(status__in=['waiting', 'processing'])
+    if department_id is not None:
+        rows = rows.filter(department_id=department_id)
+    rows = rows.order_by('enter_time').values(
+        'id', 'queue_number', 'status', 'estimated_wait_time', 'enter_time', 'department_id',
+        'patient__name', 'department__name', 'examination__name'
+    )
+
+    department_positions = {}
+    queues = []
+    for row in rows:
+        ahead_count = None
+        if row['status'] == 'waiting':
+            dept_id = row['department_id']
+            if dept_id not in department_positions:
+                department_positions[dept_id] = queue_index.get_department_positions(dept_id)
+            position = department_positions[dept_id].get(row['id'])
+            ahead_count = position - 1 if position is not None else None
+
+        queues.append({
+            'queue_number': row['queue_number'],
+            'patient_name': row['patient__name'],
+            'department_name': row['department__name'],
+            'examination_name': row['examination__name'],
+            'status': row['status'],
+            'estimated_wait_time': row['estimated_wait_time'],
+            'enter_time': row['enter_time'].isoformat() if row['enter_time'] else None,
+            'ahead_count': ahead_count,
+        })
+    return queues
+
+
+def build_queue_snapshot(department_id=None):
+    """
+    构建完整的看板快照
+
+    参数:
+    - department_id: 科室ID，为None时构建全院看板
+
+    返回:
+    - dict: 包含 stats、departments、queues 和 timestamp
+    """
+    return {
+        'stats': get_stats(department_id),
+        'departments': get_departments(department_id),
+        'queues': get_queues(department_id),
+        'timestamp': timezone.now().isoformat(),
+    }
+
+
+def encode_payload(data):
+    """紧凑编码推送数据，中文不转义以减少传输字节"""
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def diff_snapshots(old, new):
+    """
+    计算两个快照之间的差异
+
+    队列按 queue_number 匹配，科室按 code 匹配；统计数据很小，直接发送变化的字段。
+
+    返回:
+    - dict: stats（变化的统计项）、departments（变化或新增的科室）、
+      removed_departments、queues（inserted/changed/removed）
+    """
+    old_queues = {q['queue_number']: q for q in old.get('queues', [])}
+    new_queues = {q['queue_number']: q for q in new.get('queues', [])}
+    old_departments = {d['code']: d for d in old.get('departments', [])}
+    new_departments = {d['code']: d for d in new.get('departments', [])}
+    old_stats = old.get('stats', {})
+
+    return {
+        'stats': {
+            key: value for key, value in new.get('stats', {}).items()
+            if old_stats.get(key) != value
+        },
+        'departments': [
+            dept for code, dept in new_departments.items()
+            if old_departments.get(code) != dept
+        ],
+        'removed_departments': [code for code in old_departments if code not in new_departments],
+        'queues': {
+            'inserted': [q for number, q in new_queues.items() if number not in old_queues],
+            'changed': [
+                q for number, q in new_queues.items()
+                if number in old_queues and old_queues[number] != q
+            ],
+            'removed': [number for number in old_queues if number not in new_queues],
+        },
+    }
+
+
+class QueueSnapshotStore:
+    """
+    按范围和版本号存储编码后的看板快照
+
+    范围为 None 表示全院看板，否则为科室ID；每个范围有独立的版本号。
+    """
+
+    VERSION_KEY = 'queue_snapshot_version_{scope}'
+    SNAPSHOT_KEY = 'queue_snapshot_{scope}_{version}'
+    LOCAL_CACHE_SIZE = 64
+
+    def __init__(self):
+        self._local = OrderedDict()
+        self._parsed = OrderedDict()
+        self._deltas = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'QUEUE_SNAPSHOT_TTL', 300)
+
+    @staticmethod
+    def _scope(department_id):
+        return 'all' if department_id is None else f'dept_{department_id}'
+
+    def _remember(self, key, payload, store=None):
+        store = self._local if store is None else store
+        with self._lock:
+            store[key] = payload
+            store.move_to_end(key)
+            while len(store) > self.LOCAL_CACHE_SIZE:
+                store.popitem(last=False)
+
+    def _next_version(self, department_id):
+        key = self.VERSION_KEY.format(scope=self._scope(department_id))
+        cache.add(key, 0, timeout=None)
+        return cache.incr(key)
+
+    def publish(self, department_id=None):
+        """
+        构建新版本的快照并写入缓存
+
+        先分配版本号再读取数据：并发发布时，版本号较大的一次在较晚的时刻读取，
+        不会出现旧数据占用较大版本号、客户端把新快照当作过期版本丢弃的情况。
+
+        返回:
+        - (version, payload): 版本号和编码后的JSON字符串
+        """
+        version = self._next_version(department_id)
+        snapshot = build_queue_snapshot(department_id)
+        payload = encode_payload({'type': 'queue_update', 'version': version, **snapshot})
+        scope = self._scope(department_id)
+        cache.set(self.SNAPSHOT_KEY.format(scope=scope, version=version), payload, timeout=self.timeout)
+        self._remember((scope, version), payload)
+        return version, payload
+
+    def get(self, version, department_id=None):
+        """按版本号获取编码后的快照，已过期时返回None"""
+        scope = self._scope(department_id)
+        with self._lock:
+            payload = self._local.get((scope, version))
+            if payload is not None:
+                self._local.move_to_end((scope, version))
+                return payload
+
+        payload = cache.get(self.SNAPSHOT_KEY.format(scope=scope, version=version))
+        if payload is not None:
+            self._remember((scope, version), payload)
+        return payload
+
+    def _get_parsed(self, version, department_id):
+        key = (self._scope(department_id), version)
+        with self._lock:
+            snapshot = self._parsed.get(key)
+        if snapshot is None:
+            payload = self.get(version, department_id)
+            if payload is None:
+                return None
+            snapshot = json.loads(payload)
+            self._remember(key, snapshot, self._parsed)
+        return snapshot
+
+    def get_delta(self, base_version, version, department_id=None):
+        """
+        获取从 base_version 到 version 的增量更新
+
+        同一对版本的增量在本进程内只计算一次。基准版本已过期时返回None，调用方应发送完整快照。
+
+        返回:
+        - str: 编码后的增量JSON，或None
+        """
+        key = (self._scope(department_id), base_version, version)
+        with self._lock:
+            payload = self._deltas.get(key)
+        if payload is not None:
+            return payload
+
+        old = self._get_parsed(base_version, department_id)
+        new = self._get_parsed(version, department_id)
+        if old is None or new is None:
+            return None
+
+        payload = encode_payload({
+            'type': 'queue_delta',
+            'base_version': base_version,
+            'version': version,
+            **diff_snapshots(old, new),
+            'timestamp': new.get('timestamp'),
+        })
+        self._remember(key, payload, self._deltas)
+        return payload
+
+    def latest_version(self, department_id=None):
+        return cache.get(self.VERSION_KEY.format(scope=self._scope(department_id)))
+
+    def get_latest(self, department_id=None):
+        """
+        获取最新版本的快照，不存在或已过期时重新构建
+
+        返回:
+        - (version, payload)
+        """
+        version = self.latest_version(department_id)
+        if version:
+            payload = self.get(version, department_id)
+            if payload is not None:
+                return version, payload
+        return self.publish(department_id)
+
+
+# 全局快照存储实例
+snapshot_store = QueueSnapshotStore()
@@ -0,0 +1,315 @@
+"""
+批量等待时间计算
+
+与 Queue.estimate_initial_wait_time() 使用相同的加权公式，但一次性加载所有需要的
+聚合数据（历史等待时间、服务时间、设备数量、处理中队列数、Prophet预测），
+按科室一次计算所有等待队列的位置，并用NumPy向量化计算，最后通过一次 bulk_update 写回。
+"""
+import logging
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWaitTimeEstimator:
+    """批量预估等待中队列的等待时间"""
+
+    HISTORY_DAYS = 30
+    PROPHET_WEIGHT = 0.4
+
+    def __init__(self, now=None):
+        self.now = now or timezone.now()
+        self._prophet_cache = {}
+
+    def _load_queues(self, queryset):
+        from navigation.models import Queue
+
+        if queryset is None:
+            queryset = Queue.objects.filter(status='waiting')
+        return list(
+            queryset.filter(status='waiting')
+            .select_related('department', 'equipment', 'examination')
+            .order_by()
+        )
+
+    def _compute_positions(self, department_ids):
+        """
+        按科室计算每个等待队列前面的人数
+
+        与单条计算一致: 优先级更高的人数 + 相同优先级且更早进入队列的人数
+        """
+        from navigation.models import Queue
+
+        rows = Queue.objects.filter(
+            department_id__in=department_ids,
+            status='waiting'
+        ).order_by().values_list('id', 'department_id', 'priority', 'enter_time')
+
+        by_department = {}
+        for queue_id, department_id, priority, enter_time in rows:
+            by_department.setdefault(department_id, []).append(
+                (queue_id, priority, enter_time.timestamp())
+            )
+
+        positions = {}
+        for entries in by_department.values():
+            ids = np.array([e[0] for e in entries], dtype=np.int64)
+            priorities = np.array([e[1] for e in entries], dtype=np.int64)
+            enter_ts = np.array([e[2] for e in entries], dtype=np.float64)
+
+            unique_priorities, counts = np.unique(priorities, return_counts=True)
+            # 每个优先级之上（更高优先级）的人数
+            higher = np.cumsum(counts[::-1])[::-1] - counts
+            higher_by_priority = dict(zip(unique_priorities.tolist(), higher.tolist()))
+
+            for priority in unique_priorities.tolist():
+                mask = priorities == priority
+                group_ts = enter_ts[mask]
+                earlier = np.searchsorted(np.sort(group_ts), group_ts, side='left')
+                for queue_id, ahead in zip(ids[mask].tolist(), (earlier + higher_by_priority[priority]).tolist()):
+                    positions[queue_id] = ahead
+        return positions
+
+    def _load_history(self, examination_ids):
+        """按检查项目加载过去30天的平均实际等待时间和平均服务时间"""
+        from navigation.models import Queue
+
+        since = self.now - timedelta(days=self.HISTORY_DAYS)
+        completed = Queue.objects.filter(
+            examination_id__in=examination_ids,
+            status='completed',
+            start_time__isnull=False,
+            enter_time__gte=since
+        ).order_by()
+
+        avg_wait = dict(
+            completed.filter(actual_wait_time__isnull=False)
+            .values('examination_id')
+            .annotate(avg_wait=Avg('actual_wait_time'))
+            .values_list('examination_id', 'avg_wait')
+        )
+
+        avg_service = {}
+        service_rows = (
+            completed.filter(end_time__isnull=False)
+            .values('examination_id')
+            .annotate(avg_service=Avg(ExpressionWrapper(
+                F('end_time') - F('start_time'), output_field=DurationField()
+            )))
+            .values_list('examination_id', 'avg_service')
+        )
+        for examination_id, duration in service_rows:
+            if duration is not None:
+                avg_service[examination_id] = duration.total_seconds() / 60
+        return avg_wait, avg_service
+
+    def _load_department_capacity(self, department_ids):
+        """按科室加载可用设备数和处理中队列数"""
+        from navigation.models import Department
+
+        return {
+            row['id']: (row['equipment_count'], row['processing_count'])
+            for row in Department.objects.filter(id__in=department_ids).annotate(
+                equipment_count=Count(
+                    'equipment', filter=Q(equipment__status='available'), distinct=True
+                ),
+                processing_count=Count(
+                    'queue', filter=Q(queue__status='processing'), distinct=True
+                ),
+            ).values('id', 'equipment_count', 'processing_count')
+        }
+
+    def _prophet_prediction(self, examination_id, department_id):
+        """
+        获取Prophet预测值，查找顺序与单条计算一致: 检查项目 -> 科室 -> 全局
+
+        Prophet模型不使用排队人数作为回归量，同一时刻同一模型的预测值相同，
+        因此每个检查项目只需预测一次。
+        """
+        if examination_id in self._prophet_cache:
+            return self._prophet_cache[examination_id]
+
+        from navigation.ml.inference import prophet_forecast
+
+        prediction = None
+        for kwargs in ({'examination_id': examination_id}, {'department_id': department_id}, {}):
+            key = ('model',) + tuple(sorted(kwargs.items()))
+            if key not in self._prophet_cache:
+                value = None
+                try:
+                    value = prophet_forecast(self.now, **kwargs)
+                except Exception as e:
+                    logger.warning(f"Prophet预测失败({kwargs}): {str(e)}")
+                self._prophet_cache[key] = value
+            prediction = self._prophet_cache[key]
+            if prediction is not None:
+                break
+
+        self._prophet_cache[examination_id] = prediction
+        return prediction
+
+    def estimate(self, queryset=None):
+        """
+        计算等待队列的预计等待时间
+
+        参数:
+        - queryset: 需要计算的队列查询集，默认为所有等待中的队列
+
+        返回:
+        - (queues, new_wait_times): 队列列表和对应的新等待时间列表
+        """
+        queues = self._load_queues(queryset)
+        if not queues:
+            return [], []
+
+        positions = self._compute_positions({q.department_id for q in queues})
+        return queues, self._estimate(queues, [positions.get(q.id, 0) for q in queues])
+
+    def estimate_new(self, queues):
+        """
+        为尚未保存的新队列（按进入顺序排列）计算预计等待时间，用于批量入队
+
+        位置与单条新建队列一致: 科室内优先级不低于自己的等待人数，
+        再加上同一批次中排在前面、同科室且优先级不低于自己的新队列
+
+        返回:
+        - list: 与 queues 对应的等待时间
+        """
+        if not queues:
+            return []
+        return self._estimate(queues, self._compute_new_positions(queues))
+
+    def _compute_new_positions(self, queues):
+        from navigation.models import Queue
+
+        waiting_counts = {}
+        rows = Queue.objects.filter(
+            department_id__in={q.department_id for q in queues},
+            status='waiting'
+        ).order_by().values('department_id', 'priority').annotate(
+            count=Count('id')
+        ).values_list('department_id', 'priority', 'count')
+        for department_id, priority, count in rows:
+            waiting_counts.setdefault(department_id, []).append((priority, count))
+
+        positions = []
+        admitted = {}
+        for queue in queues:
+            earlier = admitted.setdefault(queue.department_id, [])
+            positions.append(
+                sum(count for priority, count in waiting_counts.get(queue.department_id, ())
+                    if priority >= queue.priority)
+                + sum(1 for priority in earlier if priority >= queue.priority)
+            )
+            earlier.append(queue.priority)
+        return positions
+
+    def _estimate(self, queues, positions):
+        """按位置和批量加载的聚合数据计算一组队列的等待时间"""
+        department_ids = {q.department_id for q in queues}
+        examination_ids = {q.examination_id for q in queues}
+
+        avg_wait, avg_service = self._load_history(examination_ids)
+        capacity = self._load_department_capacity(department_ids)
+
+        n = len(queues)
+        position = np.empty(n, dtype=np.float64)
+        historical = np.empty(n, dtype=np.float64)
+        service = np.empty(n, dtype=np.float64)
+        prophet = np.full(n, np.nan, dtype=np.float64)
+        priority = np.empty(n, dtype=np.float64)
+        equipment_count = np.empty(n, dtype=np.float64)
+        processing_count = np.empty(n, dtype=np.float64)
+
+        for i, queue in enumerate(queues):
+            position[i] = positions[i]
+            historical[i] = avg_wait.get(queue.examination_id) or 0
+            service_time = avg_service.get(queue.examination_id, 0)
+            if service_time <= 0:
+                if queue.equipment:
+                    service_time = queue.equipment.average_service_time
+                else:
+                    service_time = queue.examination.duration
+            service[i] = service_time
+            prediction = self._prophet_prediction(queue.examination_id, queue.department_id)
+            if prediction is not None:
+                prophet[i] = prediction
+            priority[i] = queue.priority
+            equipment_count[i], processing_count[i] = capacity.get(queue.department_id, (0, 0))
+
+        wait_times = compute_wait_times(
+            position, historical, service, prophet, priority,
+            equipment_count, processing_count, self.PROPHET_WEIGHT
+        )
+        return [int(w) for w in wait_times]
+
+    def update(self, queryset=None, batch_size=500):
+        """
+        计算并批量写回预计等待时间
+
+        返回:
+        - list: [(queue, old_wait_time, new_wait_time), ...] 仅包含发生变化的队列
+        """
+        from navigation.models import Queue
+
+        queues, wait_times = self.estimate(queryset)
+        changed = []
+        for queue, new_wait_time in zip(queues, wait_times):
+            old_wait_time = queue.estimated_wait_time
+            if old_wait_time != new_wait_time:
+                queue.estimated_wait_time = new_wait_time
+                changed.append((queue, old_wait_time, new_wait_time))
+
+        if changed:
+            Queue.objects.bulk_update(
+                [queue for queue, _, _ in changed],
+                ['estimated_wait_time'],
+                batch_size=batch_size
+            )
+            from navigation.signals import broadcast_queue_update
+            broadcast_queue_update({queue.department_id for queue, _, _ in changed})
+
+        logger.info(f"批量更新等待时间: 共 {len(queues)} 个队列，更新 {len(changed)} 个")
+        return changed
+
+
+def compute_wait_times(position, historical, service, prophet, priority,
+                       equipment_count, processing_count, prophet_weight=0.4):
+    """
+    向量化的等待时间加权公式，与 Queue.estimate_initial_wait_time() 一致
+
+    prophet 中的 NaN 表示没有可用的Prophet预测。
+    """
+    base = position * service
+    has_history = historical > 0
+    has_prophet = ~np.isnan(prophet)
+    prophet_value = np.where(has_prophet, prophet, 0.0)
+
+    with_prophet = np.where(
+        has_history,
+        (historical * 0.2) + (base * 0.4) + (prophet_value * prophet_weight),
+        (base * 0.6) + (prophet_value * prophet_weight)
+    )
+    without_prophet = np.where(
+        has_history,
+        (historical * 0.3) + (base * 0.7),
+        base
+    )
+    adjusted = np.where(has_prophet, with_prophet, without_prophet)
+
+    # 根据优先级调整等待时间，每级优先级减少20%
+    final = adjusted * np.maximum(1 - (priority * 0.2), 0.2)
+
+    # 科室有空闲设备时减少等待时间，最多减少50%
+    has_free_capacity = (equipment_count > 0) & (processing_count < equipment_count)
+    safe_equipment_count = np.where(equipment_count > 0, equipment_count, 1)
+    free_capacity_factor = 1 - ((equipment_count - processing_count) / safe_equipment_count * 0.5)
+    final = np.where(has_free_capacity, final * np.maximum(free_capacity_factor, 0.5), final)
+
+    # 至少等待半个服务时间
+    final = np.maximum(service * 0.5, final)
+    return np.round(final)
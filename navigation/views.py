@@ -1,20 +1,22 @@
 from django.shortcuts import render
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from django.utils import timezone
-from django.db.models import Q, F, Count
+from django.utils.dateparse import parse_date, parse_datetime
+from django.db.models import F, Count
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
-from datetime import timedelta
+from datetime import datetime, time, timedelta
 from django.views.generic import TemplateView, ListView, DetailView
 from django.http import JsonResponse
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
 from django.urls import reverse
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, StreamingHttpResponse
 
 from .models import (
-    Patient, Department, Equipment, Examination, Queue,
+    Patient, Department, Equipment, Examination, Queue, QueueHistory,
     NotificationTemplate, NotificationCategory, NotificationStats
 )
 from .serializers import (
@@ -23,23 +25,28 @@ from .serializers import (
     EquipmentSerializer,
     ExaminationSerializer,
     QueueSerializer,
+    QueueHistorySerializer,
+    QueueBulkAdmissionSerializer,
     NotificationTemplateSerializer,
 )
+from .pagination import QueueCursorPagination, RecentQueueCursorPagination
+from .utils.dashboard_stats import dashboard_stats
+from .utils.history_export import EXPORT_FORMATS, iter_export
+from .utils.queue_admission import BatchQueueAdmission
 
 
 # 首页视图
 def index(request):
     """首页视图"""
-    departments = Department.objects.filter(is_active=True)
-    
     # 统计每个科室当前排队的人数
-    for dept in departments:
-        dept.waiting_count = dept.queue_set.filter(status='waiting').count()
+    departments = dashboard_stats.annotate_departments(
+        list(Department.objects.filter(is_active=True))
+    )
     
     # 获取最近的队列
     recent_queues = Queue.objects.filter(
         status__in=['waiting', 'processing']
-    ).order_by('-priority', 'enter_time')
+    ).select_related('patient', 'department', 'examination').order_by('-priority', 'enter_time')
     
     # 为每个等待中的队列添加ahead_count属性
     for queue in recent_queues:
@@ -58,15 +65,7 @@ def index(request):
     context = {
         'departments': departments,
         'recent_queues': recent_queues,
-        'stats': {
-            'total_patients': Queue.objects.filter(status__in=['waiting', 'processing']).count(),
-            'waiting_queues': Queue.objects.filter(status='waiting').count(),
-            'processing_queues': Queue.objects.filter(status='processing').count(),
-            'completed_today': Queue.objects.filter(
-                status='completed', 
-                end_time__date=timezone.now().date()
-            ).count(),
-        }
+        'stats': dashboard_stats.get_stats(),
     }
     return render(request, 'navigation/index.html', context)
 
@@ -79,31 +78,21 @@ class HomePageView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # 获取所有活跃科室
-        departments = Department.objects.filter(is_active=True)
-        
-        # 统计每个科室当前排队的人数
-        for dept in departments:
-            dept.waiting_count = dept.queue_set.filter(status='waiting').count()
+        # 获取所有活跃科室，并统计每个科室当前排队的人数
+        departments = dashboard_stats.annotate_departments(
+            list(Department.objects.filter(is_active=True))
+        )
         
         # 获取最近的队列
         recent_queues = Queue.objects.filter(
             status__in=['waiting', 'processing']
-        ).order_by('-priority', 'enter_time')
+        ).select_related('patient', 'department', 'examination').order_by('-priority', 'enter_time')
         
         # 添加统计数据
         context.update({
             'departments': departments,
             'recent_queues': recent_queues,
-            'stats': {
-                'total_patients': Queue.objects.filter(status__in=['waiting', 'processing']).count(),
-                'waiting_queues': Queue.objects.filter(status='waiting').count(),
-                'processing_queues': Queue.objects.filter(status='processing').count(),
-                'completed_today': Queue.objects.filter(
-                    status='completed', 
-                    end_time__date=timezone.now().date()
-                ).count(),
-            }
+            'stats': dashboard_stats.get_stats(),
         })
         
         return context
@@ -122,8 +111,7 @@ class DepartmentListView(ListView):
         context = super().get_context_data(**kwargs)
         
         # 为每个科室添加等待人数
-        for dept in context['departments']:
-            dept.waiting_count = dept.queue_set.filter(status='waiting').count()
+        dashboard_stats.annotate_departments(context['departments'])
             
         return context
 
@@ -146,10 +134,11 @@ class QueueInfoView(DetailView):
             status__in=['waiting', 'processing']
         ).order_by('-priority', 'enter_time')
         
+        counts = dashboard_stats.get_department_counts(department.id)
         context.update({
             'queues': queues,
-            'waiting_count': queues.filter(status='waiting').count(),
-            'processing_count': queues.filter(status='processing').count(),
+            'waiting_count': counts['waiting_count'],
+            'processing_count': counts['processing_count'],
         })
         
         return context
@@ -266,12 +255,29 @@ class PatientViewSet(viewsets.ModelViewSet):
             'history': QueueSerializer(history_queues, many=True).data
         })
 
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """获取患者的队列历史记录，按进入时间从新到旧游标分页"""
+        patient = self.get_object()
+        histories = QueueHistory.objects.filter(patient=patient).select_related(
+            *QueueHistoryViewSet.related_fields
+        )
+
+        paginator = RecentQueueCursorPagination()
+        page = paginator.paginate_queryset(histories, request, view=self)
+        return paginator.get_paginated_response(QueueHistorySerializer(page, many=True).data)
+
 
 class DepartmentViewSet(viewsets.ModelViewSet):
     """科室视图集"""
     queryset = Department.objects.all()
     serializer_class = DepartmentSerializer
 
+    def get_queryset(self):
+        """等待人数和平均等待时间通过注解一次查询得到"""
+        # 注解带 GROUP BY 时不会应用 Meta.ordering，显式按名称排序，分页结果稳定
+        return Department.annotate_queue_stats(Department.objects.order_by('name'))
+
     @action(detail=True, methods=['get'])
     def queues(self, request, pk=None):
         """获取科室当前排队情况"""
@@ -284,12 +290,9 @@ class DepartmentViewSet(viewsets.ModelViewSet):
     def stats(self, request, pk=None):
         """获取科室统计数据"""
         department = self.get_object()
-        today = timezone.now().date()
         
         return Response({
-            'waiting_count': department.queue_set.filter(status='waiting').count(),
-            'processing_count': department.queue_set.filter(status='processing').count(),
-            'completed_today': department.queue_set.filter(status='completed', end_time__date=today).count(),
+            **dashboard_stats.get_department_counts(department.id),
             'average_wait_time': department.get_average_wait_time(),
         })
 
@@ -346,6 +349,12 @@ class ExaminationViewSet(viewsets.ModelViewSet):
     queryset = Examination.objects.all()
     serializer_class = ExaminationSerializer
 
+    def get_queryset(self):
+        """科室名称随检查项目一起查询，设备ID列表、可用设备及其等待人数各一次预取"""
+        return Examination.prefetch_available_equipment(
+            Examination.objects.select_related('department').prefetch_related('equipment_type')
+        )
+
     @action(detail=True, methods=['get'])
     def wait_time(self, request, pk=None):
         """获取检查项目等待时间"""
@@ -371,10 +380,13 @@ class QueueViewSet(viewsets.ModelViewSet):
     """排队队列视图集"""
     queryset = Queue.objects.all()
     serializer_class = QueueSerializer
+    pagination_class = QueueCursorPagination
+    # QueueSerializer 读取的关联对象，与队列一起查询
+    related_fields = ('patient', 'department', 'equipment', 'examination')
 
     def get_queryset(self):
         """根据查询参数过滤队列"""
-        queryset = Queue.objects.all()
+        queryset = Queue.objects.select_related(*self.related_fields)
         status = self.request.query_params.get('status', None)
         department = self.request.query_params.get('department', None)
         patient = self.request.query_params.get('patient', None)
@@ -409,15 +421,120 @@ class QueueViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        queues = Queue.objects.filter(
-            Q(queue_number__icontains=query) |
-            Q(patient__name__icontains=query) |
-            Q(patient__id_number__icontains=query) |
-            Q(patient__medical_record_number__icontains=query)
-        ).order_by('-created_at')
+        # 队列号前缀、证件号精确匹配和姓名片段索引，见 Queue.search_filter
+        search_filter = Queue.search_filter(query)
+        if search_filter is None:
+            return Response(
+                {'error': 'Query parameter is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        queues = Queue.objects.select_related(*self.related_fields).filter(search_filter)
+
+        # 搜索结果按进入时间从新到旧游标分页
+        paginator = RecentQueueCursorPagination()
+        page = paginator.paginate_queryset(queues, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        批量入队
+
+        请求体: {"items": [{"patient", "department", "examination", "equipment", "priority", "notes"}, ...],
+        "atomic": false}。列表顺序即进入队列的顺序；atomic 为 true 时任何一项校验失败则整批不创建。
+        返回已创建的队列和校验失败的条目（index 为在 items 中的序号）。
+        """
+        serializer = QueueBulkAdmissionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        queues, errors = BatchQueueAdmission(serializer.validated_data['items']).admit(
+            atomic=serializer.validated_data['atomic']
+        )
+        return Response(
+            {
+                'created': self.get_serializer(queues, many=True).data,
+                'errors': errors,
+            },
+            status=status.HTTP_201_CREATED if queues else status.HTTP_400_BAD_REQUEST
+        )
+
+
+class QueueHistoryViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    队列历史记录视图集
+
+    列表按进入时间从新到旧游标分页；export 以 NDJSON 或 CSV 流式导出全部匹配的记录。
+    过滤参数: patient、department、examination、status、start、end（进入时间范围，ISO日期或时间）
+    """
+    queryset = QueueHistory.objects.all()
+    serializer_class = QueueHistorySerializer
+    pagination_class = RecentQueueCursorPagination
+    related_fields = ('patient', 'department', 'equipment', 'examination')
+
+    def get_queryset(self):
+        queryset = QueueHistory.objects.select_related(*self.related_fields)
+        params = self.request.query_params
+
+        for param in ('patient', 'department', 'examination'):
+            if params.get(param):
+                queryset = queryset.filter(**{f'{param}_id': params[param]})
+        if params.get('status'):
+            queryset = queryset.filter(status=params['status'])
+        start = self.parse_time_param('start')
+        if start is not None:
+            queryset = queryset.filter(enter_time__gte=start)
+        end = self.parse_time_param('end')
+        if end is not None:
+            queryset = queryset.filter(enter_time__lt=end)
+
+        return queryset
+
+    def parse_time_param(self, name):
+        """
+        解析 start/end 查询参数
+
+        接受ISO时间或日期，只有日期时取当天零点；不带时区的按当前时区处理。
+        无法解析时抛出 ValidationError（400），而不是在查询时报错。
+        """
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            parsed = parse_datetime(value)
+            if parsed is None:
+                day = parse_date(value)
+                parsed = datetime.combine(day, time.min) if day is not None else None
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ValidationError({name: f'无效的日期或时间: {value}'})
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        流式导出历史记录
+
+        参数 output 为 ndjson（默认）或 csv；不使用 format，避免与DRF的格式后缀冲突
+        """
+        export_format = request.query_params.get('output', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {'error': f'不支持的导出格式: {export_format}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        serializer = self.get_serializer(queues, many=True)
-        return Response(serializer.data)
+        queryset = self.filter_queryset(self.get_queryset()).order_by('enter_time', 'id')
+        response = StreamingHttpResponse(
+            iter_export(queryset, export_format),
+            content_type=EXPORT_FORMATS[export_format]
+        )
+        file_name = f"queue_history_{timezone.now():%Y%m%d%H%M%S}.{export_format}"
+        response['Content-Disposition'] = f'attachment; filename="{file_name}"'
+        return response
 
 
 class NotificationTemplateViewSet(viewsets.ModelViewSet):